@@ -0,0 +1,19 @@
+import sys
+import os
+import numpy as np
+
+
+def npy_to_csv(npy_path: str, csv_path: str = None) -> str:
+    """Конвертирует матрицу .npy (например, distance_matrix из runs/) в csv для просмотра."""
+    if csv_path is None:
+        csv_path = os.path.splitext(npy_path)[0] + '.csv'
+    np.savetxt(csv_path, np.load(npy_path), delimiter=',', fmt='%.6f')
+    return csv_path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Использование: python npy_to_csv.py <файл.npy> [<файл.npy> ...]")
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        print(f"✅ {path} -> {npy_to_csv(path)}")
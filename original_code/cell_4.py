@@ -2,27 +2,22 @@
 import sys
 import os
 import numpy as np
-import matplotlib.pyplot as plt
-import networkx as nx
-from IPython.display import display, HTML
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import NamedTuple
 
-from matplotlib.patches import FancyArrowPatch
-from scipy.optimize import minimize
+from scipy.optimize import minimize, NonlinearConstraint
 
 # %%
 current_dir = os.getcwd()
-# Поднимаемся от текущей директории до spores/v14_back/src
-project_root = os.path.abspath(os.path.join(current_dir, '..', '..', '..', 'src'))
+# Поднимаемся от original_code до корня репозитория (там лежит src/pendulum.py с JIT-ядрами)
+project_root = os.path.abspath(os.path.join(current_dir, '..'))
 if project_root not in sys.path:
     sys.path.append(project_root)
 
-from logic.pendulum import PendulumSystem
-from logic.control_tree import ControlTreeBuilder
-
-# Настройка matplotlib для Jupyter
-# %matplotlib inline
-plt.rcParams['figure.figsize'] = (14, 7)
-plt.rcParams['figure.dpi'] = 100
+from src.pendulum import PendulumSystem
+from src.tree_numeric import build_tree_numeric, batch_eval
+from visualize import visualize_tree  # лежит рядом (original_code/visualize.py), matplotlib грузится лениво
 
 print("✅ Модули загружены")
 
@@ -30,66 +25,242 @@ print("✅ Модули загружены")
 # 
 
 # %%
-def sort_grandchildren_simple(grandchildren, root_position, show: bool = False):
+# Конфигурация детей (неизменяемая, без аллокаций на каждый вызов):
+# (знак управления, знак dt, имя, цвет, dt_idx) - порядок [forward_max, backward_max, forward_min, backward_min]
+_CHILD_CONFIGS = (
+    (+1, +1, 'forward_max', 'blue', 0),
+    (+1, -1, 'backward_max', 'cyan', 1),
+    (-1, +1, 'forward_min', 'green', 2),
+    (-1, -1, 'backward_min', 'orange', 3),
+)
+# Внуки одного родителя: (знак dt, направление, цвет)
+_GC_CONFIGS = (
+    (+1, 'forward', 'lightblue'),
+    (-1, 'backward', 'lightcoral'),
+)
+
+_CHILD_STYLES = {(sign_u, sign_dt): (name, color, dt_idx)
+                 for sign_u, sign_dt, name, color, dt_idx in _CHILD_CONFIGS}
+_CHILD_DT_SIGNS = np.array([sign_dt for _, sign_dt, _, _, _ in _CHILD_CONFIGS], dtype=np.float64)
+_GC_DT_SIGNS = np.tile([sign_dt for sign_dt, _, _ in _GC_CONFIGS], 4).astype(np.float64)
+_GC_PARENT_IDX = np.repeat(np.arange(4, dtype=np.int32), 2)
+# Таблица циклических сдвигов: _ROLL_INDEX[k] = (arange(8) + k) % 8, т.е. a[_ROLL_INDEX[k]] == np.roll(a, -k)
+_ROLL_INDEX = (np.arange(8)[None, :] + np.arange(8)[:, None]) % 8
+
+# Константы драйвера: множители dt детей / внуков (dt внука = dt / 10) и стартовая позиция
+_ONES_4 = np.ones(4)
+_ONES_8_TENTH = np.ones(8) * 0.1
+_INITIAL_POSITION = np.array([np.pi, 0.0])
+_NO_GC_DTS = np.empty(0)  # маркер "dt внуков автоматически" для build_tree_numeric
+for _const in (_CHILD_DT_SIGNS, _GC_DT_SIGNS, _GC_PARENT_IDX, _ROLL_INDEX,
+               _ONES_4, _ONES_8_TENTH, _INITIAL_POSITION, _NO_GC_DTS):
+    _const.flags.writeable = False
+
+
+@lru_cache(maxsize=8)
+def _child_controls(pendulum):
+    """Управления 4 детей [u_max, u_max, u_min, u_min] - считаются один раз на маятник."""
+    u_min, u_max = pendulum.get_control_bounds()
+    controls = np.array([u_max if sign_u > 0 else u_min for sign_u, _, _, _, _ in _CHILD_CONFIGS],
+                        dtype=np.float64)
+    controls.flags.writeable = False
+    return controls
+
+# %%
+@dataclass
+class TreeArrays:
+    """
+    SoA-представление дерева спор глубиной 2 (без словарей на каждый узел).
+    
+    Индексация positions:
+        [0]     - корень
+        [1:5]   - дети (отсортированы по углу относительно корня)
+        [5:13]  - внуки (в порядке обхода: пары (0,1), (2,3), (4,5), (6,7))
+    
+    controls / dts: [4 ребенка + 8 внуков] в том же порядке, dt со знаком.
+    parent_idx: индекс родителя (среди отсортированных детей) для каждого внука.
+    """
+    positions: np.ndarray   # (13, 2)
+    parent_idx: np.ndarray  # (8,) int32
+    controls: np.ndarray    # (12,)
+    dts: np.ndarray         # (12,)
+
+
+@dataclass(slots=True)
+class Spore:
+    """
+    Узел дерева спор для визуализации (вместо словаря на каждый узел).
+    
+    __slots__: доступ к полям без dict-lookup и меньше памяти на запись.
+    Поля ребенка/внука у корня остаются None.
+    """
+    position: np.ndarray
+    id: str
+    color: str
+    size: int
+    name: str = None
+    control: float = None
+    dt: float = None
+    dt_abs: float = None
+    dt_idx: int = None          # только у детей: индекс в dt_list
+    parent_id: str = None       # дальше - только у внуков
+    parent_idx: int = None
+    local_idx: int = None
+    global_idx: int = None
+    parent_dt: float = None
+
+# %%
+def _sort_grandchildren_fast(gc_positions, parent_idx, root_position):
+    """
+    Порядок обхода внуков без отладочных веток (горячий путь).
+    
+    Returns:
+        np.array (8,) - индексы внуков в порядке обхода (перестановка для gc_positions[perm])
+    """
+    # 1. Сортируем по углу (против часовой стрелки): все углы одним вызовом + argsort
+    angles = np.arctan2(gc_positions[:, 1] - root_position[1], gc_positions[:, 0] - root_position[0])
+    order = np.argsort(-angles, kind='stable')  # stable = тот же порядок, что sorted(..., reverse=True)
+    
+    # 2. Находим первого внука от родителя 0 - он станет первым
+    roll_offset = int(np.argmax(parent_idx[order] == 0))
+    
+    # 3. Если следующий тоже от родителя 0 - сдвигаем на 1
+    n = len(order)
+    if parent_idx[order[(roll_offset + 1) % n]] == 0:
+        roll_offset -= 1
+    
+    # Итоговая перестановка = np.roll(order, -roll_offset) без промежуточных копий
+    if n == _ROLL_INDEX.shape[0]:
+        return order[_ROLL_INDEX[roll_offset % n]]
+    return order[(np.arange(n) + roll_offset) % n]
+
+
+def sort_grandchildren_simple(gc_positions, parent_idx, root_position, show: bool = False):
     """
     Простая сортировка внуков: фиксированное направление + roll по условию.
     
+    Обертка над _sort_grandchildren_fast: при show=True печатает углы и итоговый обход.
+    
     Args:
-        grandchildren: список внуков с данными позиций и родителей
+        gc_positions: np.array (8, 2) - позиции внуков
+        parent_idx: np.array (8,) - индексы родителей внуков
         root_position: позиция корневой споры для расчета углов
     
     Returns:
-        отсортированный список внуков
+        np.array (8,) - индексы внуков в порядке обхода (перестановка для gc_positions[perm])
     """
+    perm = _sort_grandchildren_fast(gc_positions, parent_idx, root_position)
+    if not show:
+        return perm
     
-    def get_angle_from_root(gc):
-        """Вычисляет угол от корня до внука."""
-        dx = gc['position'][0] - root_position[0]
-        dy = gc['position'][1] - root_position[1] 
-        return np.arctan2(dy, dx)
+    angles = np.arctan2(gc_positions[:, 1] - root_position[1], gc_positions[:, 0] - root_position[0])
+    print("🔍 Углы внуков в порядке обхода:")
+    for i, gc_idx in enumerate(perm):
+        print(f"  {i}: внук {gc_idx} (родитель {parent_idx[gc_idx]}) под углом {angles[gc_idx] * 180 / np.pi:.1f}°")
     
-    # 1. Сортируем по углу (против часовой стрелки)
-    sorted_gc = sorted(grandchildren, key=get_angle_from_root, reverse=True)
+    print(f"\n✅ Итоговый обход:")
+    print(f"   0-й внук от родителя {parent_idx[perm[0]]} (внук {perm[0]})")
+    print(f"   1-й внук от родителя {parent_idx[perm[1]]} (внук {perm[1]})")
     
-    if show:
-        print("🔍 Углы внуков после первичной сортировки:")
-    for i, gc in enumerate(sorted_gc):
-        angle_deg = get_angle_from_root(gc) * 180 / np.pi
-        if show:    
-            print(f"  {i}: {gc['name']} (родитель {gc['parent_idx']}) под углом {angle_deg:.1f}°")
-    
-    # 2. Находим первого внука от родителя 0
-    roll_offset = 0
-    for i, gc in enumerate(sorted_gc):
-        if gc['parent_idx'] == 0:
-            roll_offset = i
-            if show:
-                print(f"🎯 Найден внук родителя 0 на позиции {i}, roll_offset = {roll_offset}")
-            break
+    return perm
+
+# %%
+def _build_tree_arrays_fast(initial_position, dt_children, dt_grandchildren, pendulum, k=2):
+    """
+    Дерево в SoA-виде одним JIT-вызовом, без отладочных веток (горячий путь).
     
-    # 3. Делаем roll чтобы внук родителя 0 стал первым
-    sorted_gc = np.roll(sorted_gc, -roll_offset).tolist()
-    if show:
-        print(f"🔄 Применен roll на {-roll_offset}")
+    Args:
+        initial_position: np.array([theta, theta_dot])
+        dt_children: (4,) |dt| детей
+        dt_grandchildren: (8,) |dt| внуков или None (тогда |dt родителя| / k)
+        pendulum: объект маятника
+    """
+    gc_dts_abs = _NO_GC_DTS if dt_grandchildren is None else np.asarray(dt_grandchildren, dtype=np.float64)
+    return TreeArrays(*build_tree_numeric(np.asarray(initial_position, dtype=np.float64),
+                                           np.asarray(dt_children, dtype=np.float64), gc_dts_abs,
+                                           _child_controls(pendulum), pendulum.get_params(), k))
+
+
+def _build_tree_arrays_verbose(root_position, dt_list, dt_grandchildren, pendulum, k=2):
+    """
+    Отладочный вариант _build_tree_arrays_fast: те же шаги numpy-вызовами
+    с печатью промежуточных результатов. Результат совпадает бит-в-бит.
+    """
+    print(f"🌱 Строим дерево из позиции {root_position}")
+    print(f"📊 dt детей: {dt_list}")
+    if dt_grandchildren is not None:
+        print(f"👶 Используем индивидуальные dt внуков: {dt_grandchildren}")
+    else:
+        print(f"👶 dt внуков будет вычисляться автоматически (dt_parent / k)")
     
-    # 4. Проверяем критерий: 1-й внук от другого родителя?
-    if len(sorted_gc) >= 2 and sorted_gc[1]['parent_idx'] == 0:
-        # Если 1-й тоже от родителя 0, сдвигаем на 1
-        sorted_gc = np.roll(sorted_gc, 1).tolist()
-        if show:
-            print("🔄 Применен дополнительный roll +1")
+    # Выходные буферы выделяем один раз и заполняем по индексам (без vstack/concatenate)
+    positions = np.empty((13, 2))
+    controls = np.empty(12)
+    dts = np.empty(12)
+    positions[0] = root_position
     
-    if show:
-        print(f"\n✅ Итоговый обход:")
-        print(f"   0-й внук от родителя {sorted_gc[0]['parent_idx']} ({sorted_gc[0]['name']})")
-        print(f"   1-й внук от родителя {sorted_gc[1]['parent_idx']} ({sorted_gc[1]['name']})")
+    # 4 потомка: [forward_max, backward_max, forward_min, backward_min]
+    child_controls = _child_controls(pendulum)
+    child_dts = dt_list * _CHILD_DT_SIGNS
     
-    return sorted_gc
+    # Все 4 ребенка стартуют из корня -> один JIT-вызов
+    child_positions = pendulum.fan_step(root_position, child_controls, child_dts)
+    
+    # Сортируем детей по углу относительно корня
+    child_angles = np.arctan2(child_positions[:, 1] - root_position[1],
+                              child_positions[:, 0] - root_position[0])
+    child_order = np.argsort(child_angles, kind='stable')
+    child_positions = np.take(child_positions, child_order, axis=0, out=positions[1:5])
+    child_controls = np.take(child_controls, child_order, out=controls[0:4])
+    child_dts = np.take(child_dts, child_order, out=dts[0:4])
+    
+    print("\n🔄 Дети после сортировки по углу:")
+    for i in range(4):
+        print(f"  {i}: u={child_controls[i]:+.1f}, dt={child_dts[i]:+.3f} "
+              f"под углом {child_angles[child_order[i]] * 180 / np.pi:.1f}° → {child_positions[i]}")
+
+    if dt_grandchildren is not None:
+        gc_dts_abs = np.asarray(dt_grandchildren, dtype=np.float64)
+    else:
+        # Автоматическое вычисление: dt родителя / k
+        gc_dts_abs = np.repeat(np.abs(child_dts) / k, 2)
+    
+    # Все 8 внуков за один пакетный JIT-вызов: (родитель, -u родителя, +dt / -dt)
+    gc_parent_idx = _GC_PARENT_IDX
+    gc_controls = -child_controls[gc_parent_idx]
+    gc_dts = gc_dts_abs * _GC_DT_SIGNS
+    gc_positions = pendulum.batch_step(child_positions[gc_parent_idx], gc_controls, gc_dts)
+    
+    print("\n🌳 Уровень 2 (обращенное управление):")
+    for i in range(8):
+        direction = "вперед" if gc_dts[i] > 0 else "назад"
+        print(f"    🌱 {i}: родитель {gc_parent_idx[i]}, u={gc_controls[i]:+.1f}, "
+              f"dt={gc_dts[i]:+.4f} ({direction}) → {gc_positions[i]}")
+
+    # Порядок обхода внуков (перестановка индексов)
+    order = sort_grandchildren_simple(gc_positions, gc_parent_idx, root_position)
+    
+    print("\n🔄 Итоговый порядок внуков:")
+    for i, gc_idx in enumerate(order):
+        print(f"  {i}: родитель {gc_parent_idx[gc_idx]}, u={gc_controls[gc_idx]:+.1f}, dt={gc_dts[gc_idx]:+.4f}")
+    
+    np.take(gc_positions, order, axis=0, out=positions[5:13])
+    np.take(gc_controls, order, out=controls[4:12])
+    np.take(gc_dts, order, out=dts[4:12])
+    
+    return TreeArrays(
+        positions=positions,
+        parent_idx=gc_parent_idx[order],
+        controls=controls,
+        dts=dts,
+    )
 
-# %%
-def build_simple_tree(initial_position, dt_value, pendulum, dt_children=None, dt_grandchildren=None, show: bool = False):
+
+def build_tree_arrays(initial_position, dt_value, pendulum, dt_children=None, dt_grandchildren=None, show: bool = False):
     """
-    Строит простое дерево спор глубиной 2 с поддержкой индивидуальных dt.
+    Строит дерево спор глубиной 2 сразу в SoA-виде (TreeArrays).
+    
+    show=False - _build_tree_arrays_fast (один JIT-вызов), show=True - _build_tree_arrays_verbose.
     
     Args:
         initial_position: np.array([theta, theta_dot]) - начальная позиция
@@ -102,305 +273,95 @@ def build_simple_tree(initial_position, dt_value, pendulum, dt_children=None, dt
         show: bool - выводить отладочную информацию
     
     Returns:
-        dict с корневой спорой, детьми и внуками
+        TreeArrays
     """
-    if show:
-        print(f"🌱 Строим дерево из позиции {initial_position}")
-        if dt_children is not None:
-            print(f"📊 Используем индивидуальные dt детей: {dt_children}")
-        else:
-            print(f"📊 Используем стандартный dt={dt_value} для всех детей")
-        
-        if dt_grandchildren is not None:
-            print(f"👶 Используем индивидуальные dt внуков: {dt_grandchildren}")
-        else:
-            print(f"👶 dt внуков будет вычисляться автоматически (dt_parent / k)")
-    
-    # Получаем границы управления
-    u_min, u_max = pendulum.get_control_bounds()
-    
-    # Корневая спора
-    root = {
-        'position': initial_position.copy(),
-        'id': 'root',
-        'color': 'red',
-        'size': 100
-    }
+    root_position = np.asarray(initial_position, dtype=np.float64)
     
     # Настройка dt для каждого ребенка
     if dt_children is None:
         # Стандартный режим - все дети используют один dt
-        dt_list = [dt_value, dt_value, dt_value, dt_value]
+        dt_list = np.full(4, dt_value, dtype=np.float64)
     else:
         # Индивидуальные dt для каждого ребенка
         assert len(dt_children) == 4, "dt_children должен содержать ровно 4 элемента"
-        dt_list = dt_children.copy()
-    
-    # 4 потомка с индивидуальными dt
-    children = []
-    configs = [
-        {'control': u_max, 'dt_sign': 1, 'name': 'forward_max', 'color': 'blue', 'dt_idx': 0},
-        {'control': u_max, 'dt_sign': -1, 'name': 'backward_max', 'color': 'cyan', 'dt_idx': 1}, 
-        {'control': u_min, 'dt_sign': 1, 'name': 'forward_min', 'color': 'green', 'dt_idx': 2},
-        {'control': u_min, 'dt_sign': -1, 'name': 'backward_min', 'color': 'orange', 'dt_idx': 3}
-    ]
-    
-    for i, config in enumerate(configs):
-        # Используем индивидуальный dt для этого ребенка
-        child_dt = dt_list[config['dt_idx']] * config['dt_sign']
-        
-        # Вычисляем новую позицию
-        new_pos = pendulum.scipy_rk45_step(initial_position, config['control'], child_dt)
-            
-        child = {
-            'position': new_pos,
-            'id': f"child_{i}",
-            'name': config['name'],
-            'color': config['color'],
-            'size': 60,
-            'control': config['control'],
-            'dt': child_dt,
-            'dt_abs': abs(child_dt),  # Абсолютное значение dt для внуков
-            'dt_idx': config['dt_idx']  # Индекс в dt_list
-        }
-        children.append(child)
-        
-        if show:
-            print(f"  🍄 {config['name']}: u={config['control']:+.1f}, dt={child_dt:+.3f} → {new_pos}")
+        dt_list = np.asarray(dt_children, dtype=np.float64)
     
-    # Сортируем детей по углу относительно корня
-    def get_angle(child):
-        dx = child['position'][0] - root['position'][0] 
-        dy = child['position'][1] - root['position'][1]
-        return np.arctan2(dy, dx)
-    
-    children_sorted = sorted(children, key=get_angle)
+    if dt_grandchildren is not None:
+        assert len(dt_grandchildren) == 8, "dt_grandchildren должен содержать ровно 8 элементов"
     
-    # Переназначаем ID по порядку
-    for i, child in enumerate(children_sorted):
-        child['id'] = f"child_{i}"
+    k = 2  # Коэффициент уменьшения dt для внуков (используется только если dt_grandchildren=None)
     
     if show:
-        print("\n🔄 После сортировки по углу:")
-        for i, child in enumerate(children_sorted):
-            angle = get_angle(child) * 180 / np.pi
-            print(f"  {i}: {child['name']} под углом {angle:.1f}°, dt={child['dt']:+.3f}")
-
-    # Строим внуков (уровень 2)
-    grandchildren = []
-    if show:
-        print("\n🌳 Строим уровень 2 (обращенное управление):")
+        return _build_tree_arrays_verbose(root_position, dt_list, dt_grandchildren, pendulum, k)
+    return _build_tree_arrays_fast(root_position, dt_list, dt_grandchildren, pendulum, k)
 
-    k = 2  # Коэффициент уменьшения dt для внуков (используется только если dt_grandchildren=None)
-
-    for parent_idx, parent in enumerate(children_sorted):
-        # Обращаем знак управления родителя
-        reversed_control = -parent['control']
-        
-        if show:
-            print(f"\n  👶 От споры {parent_idx} (u={parent['control']:+.1f}, dt={parent['dt']:+.3f}):")
-            print(f"      Строим детей с u={reversed_control:+.1f}")
-        
-        # 2 потомка с обращенным управлением: +dt и -dt
-        grandchild_configs = [
-            {'dt_sign': 1, 'name': f'gc_{parent_idx}_forward', 'color': 'lightblue'},
-            {'dt_sign': -1, 'name': f'gc_{parent_idx}_backward', 'color': 'lightcoral'}
-        ]
-        
-        for gc_idx, gc_config in enumerate(grandchild_configs):
-            # Вычисляем глобальный индекс внука для dt_grandchildren
-            gc_global_idx = parent_idx * 2 + gc_idx
-            
-            # Определяем dt для этого внука
-            if dt_grandchildren is not None:
-                # Используем индивидуальный dt из массива
-                assert len(dt_grandchildren) == 8, "dt_grandchildren должен содержать ровно 8 элементов"
-                gc_dt_abs = dt_grandchildren[gc_global_idx]
-            else:
-                # Автоматическое вычисление: dt родителя / k
-                gc_dt_abs = parent['dt_abs'] / k
-            
-            # Применяем знак направления
-            final_dt = gc_dt_abs * gc_config['dt_sign']
-            
-            new_pos = pendulum.scipy_rk45_step(parent['position'], reversed_control, final_dt)
-            
-            grandchild = {
-                'position': new_pos,
-                'parent_id': parent['id'],
-                'parent_idx': parent_idx,
-                'local_idx': gc_idx,
-                'global_idx': gc_global_idx,  # Будет переназначен после сортировки
-                'id': f"gc_{parent_idx}_{gc_idx}",
-                'name': gc_config['name'],
-                'color': gc_config['color'],
-                'size': 40,
-                'control': reversed_control,
-                'dt': final_dt,
-                'dt_abs': gc_dt_abs,
-                'parent_dt': parent['dt']  # Сохраняем dt родителя для отладки
-            }
-            grandchildren.append(grandchild)
-            
-            if show:
-                direction = "вперед" if gc_config['dt_sign'] > 0 else "назад"
-                dt_source = f"индивидуальный[{gc_global_idx}]" if dt_grandchildren is not None else f"авто (родитель/k)"
-                print(f"    🌱 {gc_idx}: u={reversed_control:+.1f}, dt={final_dt:+.4f} ({direction}, {dt_source}) → {new_pos}")
-
-    grandchildren_sorted = sort_grandchildren_simple(grandchildren, root['position'])
-    
-    # Переназначаем глобальные индексы
-    for i, gc in enumerate(grandchildren_sorted):
-        gc['global_idx'] = i
+# %%
+def build_simple_tree(initial_position, dt_value, pendulum, dt_children=None, dt_grandchildren=None, show: bool = False):
+    """
+    Строит простое дерево спор глубиной 2 с поддержкой индивидуальных dt.
     
-    if show:
-        print("\n🔄 Итоговый порядок внуков:")
-        for i, gc in enumerate(grandchildren_sorted):
-            print(f"  {i}: родитель {gc['parent_idx']}, u={gc['control']:+.1f}, dt={gc['dt']:+.4f}")
-        
+    Тонкая обертка над build_tree_arrays: собирает узлы Spore для visualize_tree.
+    В оптимизации используйте build_tree_arrays напрямую.
+    
+    Args:
+        те же, что у build_tree_arrays
+    
+    Returns:
+        dict с корневой спорой, детьми и внуками (узлы - Spore)
+    """
+    arrays = build_tree_arrays(initial_position, dt_value, pendulum,
+                               dt_children=dt_children, dt_grandchildren=dt_grandchildren, show=show)
+    positions, controls, dts = arrays.positions, arrays.controls, arrays.dts
+    
+    # Корневая спора
+    root = Spore(position=positions[0].copy(), id='root', color='red', size=100)
+    
+    # Имя/цвет ребенка по (знак управления, знак dt)
+    child_styles = [_CHILD_STYLES[(int(np.sign(controls[i])), int(np.sign(dts[i])))] for i in range(4)]
+    children = [Spore(
+        position=positions[1 + i].copy(),
+        id=f"child_{i}",
+        name=name,
+        color=color,
+        size=60,
+        control=controls[i],
+        dt=dts[i],
+        dt_abs=abs(dts[i]),  # Абсолютное значение dt для внуков
+        dt_idx=dt_idx  # Индекс в dt_list
+    ) for i, (name, color, dt_idx) in enumerate(child_styles)]
+    
+    # local_idx: 0 - вперед (+dt), 1 - назад (-dt)
+    gc_parent_idx = arrays.parent_idx.tolist()
+    gc_local_idx = (dts[4:12] < 0).astype(int).tolist()
+    grandchildren = [Spore(
+        position=positions[5 + i].copy(),
+        parent_id=children[parent_idx].id,
+        parent_idx=parent_idx,
+        local_idx=local_idx,
+        global_idx=i,
+        id=f"gc_{parent_idx}_{local_idx}",
+        name=f'gc_{parent_idx}_{_GC_CONFIGS[local_idx][1]}',
+        color=_GC_CONFIGS[local_idx][2],
+        size=40,
+        control=controls[4 + i],
+        dt=dts[4 + i],
+        dt_abs=abs(dts[4 + i]),
+        parent_dt=children[parent_idx].dt  # Сохраняем dt родителя для отладки
+    ) for i, (parent_idx, local_idx) in enumerate(zip(gc_parent_idx, gc_local_idx))]
+    
+    k = 2
     return {
         'root': root,
-        'children': children_sorted,
-        'grandchildren': grandchildren_sorted,
+        'children': children,
+        'grandchildren': grandchildren,
         'dt_info': {
-            'dt_children': dt_list,
+            'dt_children': np.array(dt_children, dtype=np.float64) if dt_children is not None else [dt_value] * 4,
             'dt_grandchildren': dt_grandchildren if dt_grandchildren is not None else 'auto',
             'dt_standard': dt_value,
             'k_factor': k
         }
     }
 
-# %%
-def visualize_tree(tree_data):
-    """
-    Визуализирует дерево спор с траекториями и стрелочками.
-    Показывает индивидуальные dt для каждого ребенка.
-    
-    Args:
-        tree_data: словарь с данными дерева от build_simple_tree
-    """
-    fig, ax = plt.subplots(1, 1, figsize=(14, 8))
-    
-    root = tree_data['root']
-    children = tree_data['children']
-    dt_info = tree_data.get('dt_info', {})
-    
-    # Рисуем корневую спору
-    ax.scatter(root['position'][0], root['position'][1], 
-              c=root['color'], s=root['size'], alpha=0.8, 
-              label='Root', edgecolors='black', linewidth=2)
-    
-    # Рисуем детей и стрелочки от корня к детям
-    for i, child in enumerate(children):
-        # Номер рядом с точкой
-        percent = 0.0001 * 0
-        ax.text(child['position'][0] * (1 + percent), child['position'][1] * (1 + percent), 
-            str(i), fontsize=12, fontweight='bold', 
-            color='black', ha='left', va='bottom',
-            bbox=dict(boxstyle="circle,pad=0.1", facecolor='white', alpha=0.8))
-        
-        # Точка-потомок
-        ax.scatter(child['position'][0], child['position'][1],
-                  c=child['color'], s=child['size'], alpha=0.7,
-                  label=child['name'], edgecolors='black')
-        
-        # Стрелочка от корня к потомку
-        arrow = FancyArrowPatch(
-            (root['position'][0], root['position'][1]),
-            (child['position'][0], child['position'][1]),
-            arrowstyle='->', 
-            mutation_scale=15,
-            color=child['color'],
-            alpha=0.6,
-            linewidth=2
-        )
-        ax.add_patch(arrow)
-        
-        # Аннотация с параметрами (показываем индивидуальный dt)
-        mid_x = (root['position'][0] + child['position'][0]) / 2
-        mid_y = (root['position'][1] + child['position'][1]) / 2
-        
-        label_text = f"u={child['control']:+.1f}\ndt={child['dt']:+.3f}"
-        ax.annotate(label_text, (mid_x, mid_y), 
-                   fontsize=8, ha='center', va='center',
-                   bbox=dict(boxstyle="round,pad=0.2", facecolor='white', alpha=0.7))
-    
-    # Рисуем внуков если они есть
-    if 'grandchildren' in tree_data:
-        for grandchild in tree_data['grandchildren']:
-            # Точка-внук
-            ax.scatter(grandchild['position'][0], grandchild['position'][1],
-                    c=grandchild['color'], s=grandchild['size'], alpha=0.6,
-                    edgecolors='gray', linewidth=1)
-            
-            # Стрелочка от родителя к внуку
-            parent = children[grandchild['parent_idx']]
-            arrow = FancyArrowPatch(
-                (parent['position'][0], parent['position'][1]),
-                (grandchild['position'][0], grandchild['position'][1]),
-                arrowstyle='->', 
-                mutation_scale=10,
-                color=grandchild['color'],
-                alpha=0.5,
-                linewidth=1.5
-            )
-            ax.add_patch(arrow)
-            
-            # Глобальный индекс внука
-            label = str(grandchild.get('global_idx', '?'))
-            ax.text(grandchild['position'][0], grandchild['position'][1], 
-                   label, fontsize=10, fontweight='bold', 
-                   color='white', ha='center', va='center',
-                   bbox=dict(boxstyle="circle,pad=0.15", facecolor='purple', alpha=0.8))
-    
-    # Настройки графика
-    ax.set_xlabel('θ (радианы)', fontsize=12)
-    ax.set_ylabel('θ̇ (рад/с)', fontsize=12)
-    
-    # Формируем заголовок с информацией о dt
-    title = "Дерево спор глубиной 2"
-    if dt_info:
-        if 'dt_children' in dt_info and dt_info['dt_children'] is not None:
-            # Показываем индивидуальные dt детей
-            dt_children = dt_info['dt_children']
-            title += f"\nДети dt: [{dt_children[0]:.3f}, {dt_children[1]:.3f}, {dt_children[2]:.3f}, {dt_children[3]:.3f}]"
-        else:
-            # Показываем стандартный dt
-            title += f"\nСтандартный dt = {dt_info.get('dt_standard', 'N/A')}"
-        
-        # Добавляем информацию о dt внуков
-        if 'dt_grandchildren' in dt_info:
-            dt_gc = dt_info['dt_grandchildren']
-            if isinstance(dt_gc, str) and dt_gc == 'auto':
-                title += f"\nВнуки dt: автоматические (k={dt_info.get('k_factor', 2)})"
-            elif dt_gc is not None:
-                title += f"\nВнуки dt: индивидуальные ({len(dt_gc)} значений)"
-            else:
-                title += f"\nВнуки dt: автоматические (k={dt_info.get('k_factor', 2)})"
-    
-    ax.set_title(title, fontsize=12)
-    ax.grid(True, alpha=0.3)
-    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    
-    plt.tight_layout()
-    plt.show()
-    
-    # Выводим сводку в консоль
-    print(f"\n📊 СВОДКА ДЕРЕВА:")
-    print(f"   🌳 Корень: {root['position']}")
-    print(f"   🍄 Детей: {len(children)} спор")
-    if 'grandchildren' in tree_data:
-        print(f"   👶 Внуков: {len(tree_data['grandchildren'])} спор")
-    if dt_info:
-        print(f"   ⏱️  dt детей: {dt_info.get('dt_children', 'стандартный')}")
-        dt_gc = dt_info.get('dt_grandchildren', 'auto')
-        if isinstance(dt_gc, str) and dt_gc == 'auto':
-            print(f"   👶 dt внуков: автоматические (k={dt_info.get('k_factor', 2)})")
-        elif dt_gc is not None:
-            print(f"   👶 dt внуков: индивидуальные {[f'{dt:.3f}' for dt in dt_gc]}")
-        else:
-            print(f"   👶 dt внуков: автоматические (k={dt_info.get('k_factor', 2)})")
-
 # %%
 
 dt = 0.01  # Временной шаг - можно менять!
@@ -414,118 +375,167 @@ pendulum = PendulumSystem(
     max_control=2.0
 )
 
-initial_pos = np.array([np.pi, 0.0])
+initial_pos = _INITIAL_POSITION
 
 # Строим дерево
 tree = build_simple_tree(initial_pos, dt, pendulum, 
-                         dt_children=np.ones(4)*dt,
-                         dt_grandchildren=np.ones(8)*dt/10
+                         dt_children=_ONES_4 * dt,
+                         dt_grandchildren=_ONES_8_TENTH * dt
 )
 
 # Визуализируем  
 visualize_tree(tree)
 
 # print(f"\n📊 Статистика:")
-# print(f"Корневая спора: {tree['root']['position']}")
+# print(f"Корневая спора: {tree['root'].position}")
 # print(f"Количество потомков: {len(tree['children'])}")
 # for child in tree['children']:
-#     distance = np.linalg.norm(child['position'] - tree['root']['position'])
-#     print(f"  {child['name']}: расстояние от корня = {distance:.3f}")
+#     distance = np.linalg.norm(child.position - tree['root'].position)
+#     print(f"  {child.name}: расстояние от корня = {distance:.3f}")
 
 # %%
-def calc_pair_distances(grandchildren, show=True):
+def calc_pair_distances(gc_positions):
     """
     Вычисляет расстояния между парами внуков.
-    Пары: (0,1), (2,3), (4,5), (6,7) по прямому индексу в отсортированном списке.
+    Пары: (0,1), (2,3), (4,5), (6,7) по прямому индексу в порядке обхода.
     
     Args:
-        grandchildren: список внуков после сортировки (порядок уже правильный)
-        show: выводить отладочную информацию
+        gc_positions: np.array (8, 2) - позиции внуков после сортировки (TreeArrays.positions[5:])
         
     Returns:
         np.array из 4 расстояний между парами
     """
-    distances = np.zeros(4)
-    
-    for pair_idx in range(4):
-        # Прямые индексы пары: (0,1), (2,3), (4,5), (6,7)
-        idx1 = pair_idx * 2
-        idx2 = pair_idx * 2 + 1
-        
-        if idx1 < len(grandchildren) and idx2 < len(grandchildren):
-            # Берем внуков напрямую по индексу
-            gc1 = grandchildren[idx1]
-            gc2 = grandchildren[idx2]
-            
-            # Вычисляем расстояние между позициями
-            pos1 = gc1['position']
-            pos2 = gc2['position']
-            distance = np.linalg.norm(pos1 - pos2)
-            distances[pair_idx] = distance
-        else:
-            if show:
-                print(f"⚠️ Недостаточно внуков для пары {pair_idx}: нужны индексы {idx1}, {idx2}")
-            distances[pair_idx] = float('inf')
-    
-    return distances
+    return np.linalg.norm(gc_positions[0::2] - gc_positions[1::2], axis=1)
 
 # %%
-def calculate_mean_points(grandchildren, show=True):
+def calculate_mean_points(gc_positions):
     """
     Вычисляет средние точки для каждой пары внуков.
-    Пары: (0,1), (2,3), (4,5), (6,7) по прямому индексу в отсортированном списке.
+    Пары: (0,1), (2,3), (4,5), (6,7) по прямому индексу в порядке обхода.
     
     Args:
-        grandchildren: список внуков после сортировки (порядок уже правильный)
-        show: выводить отладочную информацию
+        gc_positions: np.array (8, 2) - позиции внуков после сортировки (TreeArrays.positions[5:])
         
     Returns:
         np.array размера (4, 2) со средними точками 4 пар
     """
-    means = np.zeros((4, 2))
-    
-    for pair_idx in range(4):
-        # Прямые индексы пары: (0,1), (2,3), (4,5), (6,7)
-        idx1 = pair_idx * 2
-        idx2 = pair_idx * 2 + 1
-        
-        if idx1 < len(grandchildren) and idx2 < len(grandchildren):
-            # Берем внуков напрямую по индексу
-            gc1 = grandchildren[idx1]
-            gc2 = grandchildren[idx2]
-            
-            # Вычисляем среднюю точку
-            pos1 = gc1['position']
-            pos2 = gc2['position']
-            means[pair_idx] = (pos1 + pos2) / 2
-        else:
-            if show:
-                print(f"⚠️ Недостаточно внуков для пары {pair_idx}: нужны индексы {idx1}, {idx2}")
-            means[pair_idx] = np.array([0, 0])
-    
-    return means
+    return 0.5 * (gc_positions[0::2] + gc_positions[1::2])
 
 # %%
 def calculate_area(mean_points):
     """
-    Вычисляет площадь четырехугольника по 4 точкам, используя формулу Шнура.
+    Вычисляет площадь четырехугольника по 4 точкам (формула Шнура, развернутая для 4 вершин).
     
     Args:
         mean_points: np.array размера (4, 2) с координатами 4 вершин
+                     (или (B, 4, 2) - пакет четырехугольников)
         
     Returns:
-        float: площадь четырехугольника
+        float: площадь четырехугольника (или np.array (B,) для пакета)
     """
-    # Извлекаем координаты
-    x = [p[0] for p in mean_points]
-    y = [p[1] for p in mean_points]
+    p = mean_points
     
-    # Формула Шнура (shoelace formula)
-    # Площадь = 0.5 * |Σ(x_i * y_{i+1} - y_i * x_{i+1})|
-    area = 0.5 * np.abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
+    # Формула Шнура для 4 вершин = половина модуля векторного произведения диагоналей:
+    # Площадь = 0.5 * |(p0 - p2) × (p1 - p3)|  (без np.roll/np.dot и временных массивов)
+    area = 0.5 * abs((p[..., 0, 0] - p[..., 2, 0]) * (p[..., 1, 1] - p[..., 3, 1])
+                     - (p[..., 1, 0] - p[..., 3, 0]) * (p[..., 0, 1] - p[..., 2, 1]))
     
     return area
 
+# %%
+class PairMetrics(NamedTuple):
+    """Метрики пар внуков одного дерева (или пакета деревьев)."""
+    distances: np.ndarray  # (4,) - расстояния внутри пар
+    means: np.ndarray      # (4, 2) - средние точки пар
+    area: float            # площадь четырехугольника средних точек
+
+
+def pair_metrics(gc_positions):
+    """
+    Все метрики пар внуков за один проход: расстояния, средние точки и площадь.
+    
+    Args:
+        gc_positions: np.array (8, 2) - позиции внуков после сортировки (TreeArrays.positions[5:])
+                      или (B, 8, 2) - пакет деревьев
+        
+    Returns:
+        PairMetrics(distances (4,), means (4, 2), area float) - для пакета с ведущей осью B
+    """
+    d = gc_positions[..., 1::2, :] - gc_positions[..., 0::2, :]
+    distances = np.linalg.norm(d, axis=-1)
+    means = gc_positions[..., 0::2, :] + 0.5 * d
+    return PairMetrics(distances, means, calculate_area(means))
+
+
+# Кэш метрик деревьев: (dt_all.tobytes(), initial_position.tobytes(), pendulum) -> PairMetrics
+_TREE_CACHE = {}
+_TREE_CACHE_MAX_SIZE = 64
+
+
+def _cache_key(dt_all, initial_position, pendulum):
+    """Точный ключ кэша по байтам массивов (без округления и кортежей из float)."""
+    return (np.ascontiguousarray(dt_all, dtype=np.float64).tobytes(),
+            np.ascontiguousarray(initial_position, dtype=np.float64).tobytes(),
+            pendulum)
+
+
+def _cache_put(cache, key, value, max_size):
+    """Кладет значение в кэш, вытесняя самую старую запись (dict хранит порядок вставки)."""
+    if len(cache) >= max_size:
+        del cache[next(iter(cache))]
+    cache[key] = value
+    return value
+
+
+def tree_metrics(dt_all, initial_position, pendulum):
+    """
+    Мемоизированные метрики дерева для заданного вектора dt.
+    
+    SLSQP на одной точке зовет целевую функцию и 4 ограничения -
+    дерево строится один раз, остальные вызовы берут результат из _TREE_CACHE.
+    
+    Returns:
+        PairMetrics(distances, means, area) - не изменяйте массивы, они общие
+    """
+    key = _cache_key(dt_all, initial_position, pendulum)
+    metrics = _TREE_CACHE.get(key)
+    if metrics is None:
+        dt_all = np.asarray(dt_all, dtype=np.float64)
+        tree = _build_tree_arrays_fast(initial_position, dt_all[0:4], dt_all[4:12], pendulum)
+        metrics = _cache_put(_TREE_CACHE, key, pair_metrics(tree.positions[5:]), _TREE_CACHE_MAX_SIZE)
+    return metrics
+
+# %%
+# Кэш якобианов: тот же ключ, что у _TREE_CACHE, + шаг h
+_JAC_CACHE = {}
+_JAC_CACHE_MAX_SIZE = 32
+
+
+def fd_jacobians(dt_all, initial_position, pendulum, h=1e-7):
+    """
+    Градиент площади и якобиан расстояний пар по вектору dt.
+    
+    Вместо 12 скалярных конечных разностей SciPy на каждую функцию (целевая + 4 ограничения)
+    все 13 деревьев (база + 12 возмущений) считаются одним вызовом batch_eval
+    (prange по деревьям, без GIL); результат кэшируется и делится между jac
+    целевой функции и ограничений.
+    
+    Returns:
+        tuple: (area_grad (12,), distance_jac (4, 12))
+    """
+    key = _cache_key(dt_all, initial_position, pendulum) + (h,)
+    jacobians = _JAC_CACHE.get(key)
+    if jacobians is None:
+        dt_batch = np.tile(np.asarray(dt_all, dtype=np.float64), (13, 1))
+        dt_batch[1:] += h * np.eye(12)
+        
+        areas, distances = batch_eval(np.asarray(initial_position, dtype=np.float64), dt_batch,
+                                      _child_controls(pendulum), pendulum.get_params())
+        area_grad = (areas[1:] - areas[0]) / h                  # (12,)
+        distance_jac = ((distances[1:] - distances[0]) / h).T    # (4, 12)
+        jacobians = _cache_put(_JAC_CACHE, key, (area_grad, distance_jac), _JAC_CACHE_MAX_SIZE)
+    return jacobians
+
 # %%
 def objective_function(dt_all, initial_position, dt_value, pendulum, show=False):
     """
@@ -542,28 +552,8 @@ def objective_function(dt_all, initial_position, dt_value, pendulum, show=False)
         float: отрицательная площадь (для минимизации = максимизации площади)
     """
     try:
-        # Разделяем dt на детей и внуков
-        dt_children = dt_all[0:4]      # Первые 4 элемента
-        dt_grandchildren = dt_all[4:12]  # Остальные 8 элементов
-        
-        # Строим дерево с текущими dt
-        tree = build_simple_tree(
-            initial_position=initial_position,
-            dt_value=dt_value, 
-            pendulum=pendulum,
-            dt_children=dt_children,
-            dt_grandchildren=dt_grandchildren,
-            show=False
-        )
-        
-        # Получаем внуков
-        grandchildren = tree['grandchildren']
-        
-        # Вычисляем средние точки пар
-        mean_points = calculate_mean_points(grandchildren, show=show)
-        
-        # Вычисляем площадь четырехугольника
-        area = calculate_area(mean_points)
+        # Дерево + площадь (общий кэш с ограничениями)
+        area = tree_metrics(dt_all, initial_position, pendulum).area
         
         # Возвращаем отрицательную площадь (scipy.optimize минимизирует)
         return -area
@@ -584,35 +574,21 @@ def constraint_function(dt_all, initial_position, dt_value, pendulum,
         initial_position: начальная позиция
         dt_value: стандартный dt (не используется, оставлен для совместимости)
         pendulum: объект маятника
-        pair_idx: индекс пары (0, 1, 2, 3)
+        pair_idx: индекс пары (0, 1, 2, 3) или None - сразу все 4 пары
         epsilon: допустимое расстояние между внуками в паре
         show: выводить отладочную информацию
         
     Returns:
-        float: epsilon - distance (> 0 означает выполнение ограничения)
+        float: epsilon - distance (> 0 означает выполнение ограничения);
+        np.array (4,) при pair_idx=None
     """
     try:
-        # Разделяем dt на детей и внуков
-        dt_children = dt_all[0:4]      # Первые 4 элемента
-        dt_grandchildren = dt_all[4:12]  # Остальные 8 элементов
+        # Расстояния между парами (общий кэш с целевой функцией)
+        distances = tree_metrics(dt_all, initial_position, pendulum).distances
         
-        # Строим дерево с текущими dt
-        tree = build_simple_tree(
-            initial_position=initial_position,
-            dt_value=dt_value, 
-            pendulum=pendulum,
-            dt_children=dt_children,
-            dt_grandchildren=dt_grandchildren,
-            show=False
-        )
-        
-        # Получаем внуков
-        grandchildren = tree['grandchildren']
-        
-        # Вычисляем расстояния между парами
-        distances = calc_pair_distances(grandchildren, show=show)
-        
-        # Возвращаем ограничение для указанной пары
+        # Возвращаем ограничение для указанной пары (или вектор по всем парам)
+        if pair_idx is None:
+            return epsilon - distances
         constraint_value = epsilon - distances[pair_idx]
         
         return constraint_value
@@ -620,45 +596,63 @@ def constraint_function(dt_all, initial_position, dt_value, pendulum,
     except Exception as e:
         if show:
             print(f"❌ Ошибка в constraint_function для пары {pair_idx}: {e}")
-        return -1e6  # Большое отрицательное значение при ошибке
+        # Большое отрицательное значение при ошибке
+        return np.full(4, -1e6) if pair_idx is None else -1e6
 
 
-def create_constraints(initial_position, dt_value, pendulum, epsilon=1e-3, show=True):
+def create_constraints(initial_position, dt_value, pendulum, epsilon=1e-3, method='SLSQP', show=True):
     """
-    Создает список ограничений для всех 4 пар внуков.
+    Создает одно векторное ограничение сразу для всех 4 пар внуков.
+    
+    Все 4 пары считаются одним вызовом (fun -> (4,), jac -> (4, 12)),
+    поэтому оптимизатор строит дерево для ограничений один раз на точку,
+    а не 4 раза.
     
     Args:
         initial_position: начальная позиция
         dt_value: стандартный dt (для совместимости)
         pendulum: объект маятника
         epsilon: допустимое расстояние между внуками в паре
+        method: 'SLSQP' (словари 'ineq') или 'trust-constr' (NonlinearConstraint)
         show: выводить отладочную информацию
         
     Returns:
-        list: список словарей ограничений для scipy.optimize
+        list: список из одного ограничения для scipy.optimize
     """
-    constraints = []
+    def constraint_func(dt_all):
+        """epsilon - distances для всех 4 пар."""
+        return constraint_function(dt_all, initial_position, dt_value, pendulum, None, epsilon, show=False)
     
-    def make_constraint_func(pair_idx):
-        """Создает функцию ограничения для конкретной пары."""
-        def constraint_func(dt_all):
-            return constraint_function(dt_all, initial_position, dt_value, pendulum, pair_idx, epsilon, show=False)
-        return constraint_func
+    def constraint_jac(dt_all):
+        """Якобиан ограничений: d(epsilon - distances)/d(dt) = -d(distances)/d(dt), форма (4, 12)."""
+        return -fd_jacobians(dt_all, initial_position, pendulum)[1]
     
-    for pair_idx in range(4):
+    if method == 'trust-constr':
+        # epsilon - distance >= 0
+        constraint = NonlinearConstraint(constraint_func, 0.0, np.inf, jac=constraint_jac)
+    else:
         constraint = {
             'type': 'ineq',
-            'fun': make_constraint_func(pair_idx)
+            'fun': constraint_func,
+            'jac': constraint_jac
         }
-        constraints.append(constraint)
+    constraints = [constraint]
     
     if show:
-        print(f"✅ Создано {len(constraints)} ограничений для пар внуков с epsilon={epsilon}")
+        print(f"✅ Создано векторное ограничение для 4 пар внуков с epsilon={epsilon}")
     return constraints
 
 # %%
+def default_initial_guess(dt_base):
+    """Стандартное начальное приближение: [dt_base]*4 для детей + [dt_base*0.1]*8 для внуков."""
+    initial_guess = np.empty(12)
+    initial_guess[:4] = dt_base
+    initial_guess[4:] = dt_base * 0.1
+    return initial_guess
+
+
 def optimize_dt(initial_position, pendulum, dt_base=0.1, 
-                epsilon=1e-3, dt_bounds=(0.001, 0.1), show=True):
+                epsilon=1e-3, dt_bounds=(0.001, 0.1), method='SLSQP', initial_guess=None, show=True):
     """
     Оптимизирует все 12 dt (4 детей + 8 внуков) для максимизации площади четырехугольника
     при условии схождения пар внуков.
@@ -669,46 +663,47 @@ def optimize_dt(initial_position, pendulum, dt_base=0.1,
         dt_base: базовое значение dt для начального приближения
         epsilon: допустимое расстояние между внуками в паре
         dt_bounds: кортеж (min_dt, max_dt) для ограничений
+        method: 'SLSQP' (по умолчанию) или 'trust-constr' (NonlinearConstraint + тот же jac).
+                На этой задаче SLSQP сходится за ~15 итераций, trust-constr упирается в maxiter
+        initial_guess: np.array (12,) - стартовая точка; если None, [dt_base]*4 + [dt_base*0.1]*8
         show: показывать отладочную информацию и прогресс
         
     Returns:
         dict с результатами оптимизации
     """
+    if method not in ('trust-constr', 'SLSQP'):
+        raise ValueError(f"method должен быть 'trust-constr' или 'SLSQP', получено {method!r}")
     
     if show:
-        print(f"🚀 Запуск оптимизации всех 12 dt (4 детей + 8 внуков)")
+        print(f"🚀 Запуск оптимизации всех 12 dt (4 детей + 8 внуков), метод {method}")
         print(f"   📍 Начальная позиция: {initial_position}")
         print(f"   ⏱️  Базовый dt: {dt_base}")
         print(f"   🎯 Epsilon: {epsilon}")
         print(f"   📏 Границы dt: {dt_bounds}")
     
     # Начальное приближение для всех 12 dt
-    initial_guess = dt_base * np.hstack((np.ones(4), np.ones(8)/10))
+    if initial_guess is None:
+        initial_guess = default_initial_guess(dt_base)
+    else:
+        initial_guess = np.array(initial_guess, dtype=np.float64)
+        assert initial_guess.shape == (12,), "initial_guess должен содержать ровно 12 элементов"
     
     # Границы для всех 12 dt
     bounds = [dt_bounds] * 12
     
     # Создаем ограничения для схождения пар
-    constraints = create_constraints(initial_position, dt_base, pendulum, epsilon, show=show)
+    constraints = create_constraints(initial_position, dt_base, pendulum, epsilon, method=method, show=show)
     
     # Счетчик итераций для callback
     iteration_count = [0]
     
-    def callback(xk):
-        """Callback функция для отслеживания прогресса."""
+    def callback(xk, *args):
+        """Callback функция для отслеживания прогресса (trust-constr передает еще state)."""
         if show:
             iteration_count[0] += 1
             if iteration_count[0] % 10 == 0:
-                # Разделяем dt
-                dt_children = xk[0:4]
-                dt_grandchildren = xk[4:12]
-                
-                # Вычисляем текущие метрики
-                tree = build_simple_tree(initial_position, dt_base, pendulum, 
-                                       dt_children, dt_grandchildren, show=False)
-                distances = calc_pair_distances(tree['grandchildren'], show=False)
-                mean_points = calculate_mean_points(tree['grandchildren'], show=False)
-                area = calculate_area(mean_points)
+                # Текущие метрики (как правило, уже в кэше)
+                distances, _, area = tree_metrics(xk, initial_position, pendulum)
                 
                 print(f"   Итерация {iteration_count[0]:3d}: площадь={area:.6f}, "
                       f"расстояния={[f'{d:.4f}' for d in distances]}")
@@ -716,15 +711,21 @@ def optimize_dt(initial_position, pendulum, dt_base=0.1,
     if show:
         print(f"🎯 Начинаем оптимизацию 12 параметров...")
     
+    if method == 'trust-constr':
+        options = {'maxiter': 1000, 'xtol': 1e-9, 'gtol': 1e-7}
+    else:
+        options = {'maxiter': 1000, 'ftol': 1e-9}
+    
     # Запускаем оптимизацию
     result = minimize(
         fun=lambda dt_all: objective_function(dt_all, initial_position, dt_base, pendulum, show=False),
+        jac=lambda dt_all: -fd_jacobians(dt_all, initial_position, pendulum)[0],
         x0=initial_guess,
-        method='SLSQP',
+        method=method,
         bounds=bounds,
         constraints=constraints,
         callback=callback if show else None,
-        options={'maxiter': 1000, 'ftol': 1e-9}
+        options=options
     )
     
     if show:
@@ -753,7 +754,7 @@ def optimize_dt(initial_position, pendulum, dt_base=0.1,
         )
         
         # Проверяем финальные расстояния
-        final_distances = calc_pair_distances(final_tree['grandchildren'], show=False)
+        final_distances = calc_pair_distances(np.array([gc.position for gc in final_tree['grandchildren']]))
         if show:
             print(f"   📏 Финальные расстояния пар: {[f'{d:.6f}' for d in final_distances]}")
             print(f"   ✅ Все пары сошлись: {np.all(final_distances <= epsilon)}")
@@ -777,6 +778,68 @@ def optimize_dt(initial_position, pendulum, dt_base=0.1,
             'scipy_result': result
         }
 
+# %%
+def multistart_optimize_dt(initial_position, pendulum, n_starts=16, dt_base=0.1,
+                           epsilon=1e-3, dt_bounds=(0.001, 0.1), method='SLSQP',
+                           max_refine=3, seed=None, show=True):
+    """
+    Мультистарт: оценивает n_starts стартовых точек одним пакетом и запускает optimize_dt из лучшей.
+    
+    Кандидаты - стандартное приближение (в границах) + случайные dt в dt_bounds.
+    Все деревья и их метрики считаются одним вызовом batch_eval (prange по кандидатам).
+    Рейтинг кандидатов: сначала минимальное нарушение
+    ограничений sum(max(distance - epsilon, 0)), затем максимальная площадь.
+    Если SLSQP из лучшего кандидата не сошелся, пробуем следующие (до max_refine запусков).
+    
+    Args:
+        initial_position: начальная позиция маятника
+        pendulum: объект PendulumSystem
+        n_starts: число стартовых точек (B)
+        dt_base, epsilon, dt_bounds, method: как у optimize_dt
+        max_refine: максимум запусков optimize_dt (по рейтингу кандидатов)
+        seed: seed для np.random.default_rng
+        show: показывать отладочную информацию
+        
+    Returns:
+        dict от optimize_dt + 'start_index', 'start_dt_all', 'start_areas', 'start_violations'
+    """
+    if n_starts < 1:
+        raise ValueError(f"n_starts должно быть >= 1, получено {n_starts}")
+    if max_refine < 1:
+        raise ValueError(f"max_refine должно быть >= 1, получено {max_refine}")
+    
+    rng = np.random.default_rng(seed)
+    low, high = dt_bounds
+    
+    # Кандидаты (B, 12): 0 - стандартное приближение, остальные - случайные
+    candidates = np.empty((n_starts, 12))
+    candidates[0] = np.clip(default_initial_guess(dt_base), low, high)
+    candidates[1:] = rng.uniform(low, high, size=(n_starts - 1, 12))
+    
+    # Все кандидаты - одним пакетом
+    areas, distances = batch_eval(np.asarray(initial_position, dtype=np.float64), candidates,
+                                  _child_controls(pendulum), pendulum.get_params())
+    violations = np.maximum(distances - epsilon, 0.0).sum(axis=1)
+    ranking = np.lexsort((-areas, violations))
+    
+    if show:
+        print(f"🎲 Мультистарт: {n_starts} кандидатов оценены одним пакетом")
+    
+    for best in ranking[:max_refine].tolist():
+        if show:
+            print(f"   🏆 Кандидат {best}: площадь={areas[best]:.6f}, "
+                  f"нарушение={violations[best]:.6f}")
+        result = optimize_dt(initial_position, pendulum, dt_base=dt_base, epsilon=epsilon,
+                             dt_bounds=dt_bounds, method=method, initial_guess=candidates[best], show=show)
+        if result['success']:
+            break
+    
+    result['start_index'] = best
+    result['start_dt_all'] = candidates[best]
+    result['start_areas'] = areas
+    result['start_violations'] = violations
+    return result
+
 # %%
 # Тихая оптимизация
 result = optimize_dt(
@@ -796,4 +859,8 @@ if result['success']:
 # %%
 result
 
+# %%
+# Мультистарт: 16 стартовых точек оцениваются одним пакетом, SLSQP - из лучшей
+# result_ms = multistart_optimize_dt(initial_pos, pendulum, n_starts=16, dt_bounds=(0.001, 0.2), seed=0, show=False)
+
 
@@ -0,0 +1,133 @@
+def visualize_tree(tree_data):
+    """
+    Визуализирует дерево спор с траекториями и стрелочками.
+    Показывает индивидуальные dt для каждого ребенка.
+    
+    Args:
+        tree_data: словарь с данными дерева от build_simple_tree (узлы - Spore)
+    """
+    # Ленивый импорт: matplotlib нужен только для отрисовки, не для оптимизации
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import FancyArrowPatch
+    
+    fig, ax = plt.subplots(1, 1, figsize=(14, 8))
+    
+    root = tree_data['root']
+    children = tree_data['children']
+    dt_info = tree_data.get('dt_info', {})
+    
+    # Рисуем корневую спору
+    ax.scatter(root.position[0], root.position[1], 
+              c=root.color, s=root.size, alpha=0.8, 
+              label='Root', edgecolors='black', linewidth=2)
+    
+    # Рисуем детей и стрелочки от корня к детям
+    for i, child in enumerate(children):
+        # Номер рядом с точкой
+        percent = 0.0001 * 0
+        ax.text(child.position[0] * (1 + percent), child.position[1] * (1 + percent), 
+            str(i), fontsize=12, fontweight='bold', 
+            color='black', ha='left', va='bottom',
+            bbox=dict(boxstyle="circle,pad=0.1", facecolor='white', alpha=0.8))
+        
+        # Точка-потомок
+        ax.scatter(child.position[0], child.position[1],
+                  c=child.color, s=child.size, alpha=0.7,
+                  label=child.name, edgecolors='black')
+        
+        # Стрелочка от корня к потомку
+        arrow = FancyArrowPatch(
+            (root.position[0], root.position[1]),
+            (child.position[0], child.position[1]),
+            arrowstyle='->', 
+            mutation_scale=15,
+            color=child.color,
+            alpha=0.6,
+            linewidth=2
+        )
+        ax.add_patch(arrow)
+        
+        # Аннотация с параметрами (показываем индивидуальный dt)
+        mid_x = (root.position[0] + child.position[0]) / 2
+        mid_y = (root.position[1] + child.position[1]) / 2
+        
+        label_text = f"u={child.control:+.1f}\ndt={child.dt:+.3f}"
+        ax.annotate(label_text, (mid_x, mid_y), 
+                   fontsize=8, ha='center', va='center',
+                   bbox=dict(boxstyle="round,pad=0.2", facecolor='white', alpha=0.7))
+    
+    # Рисуем внуков если они есть
+    if 'grandchildren' in tree_data:
+        for grandchild in tree_data['grandchildren']:
+            # Точка-внук
+            ax.scatter(grandchild.position[0], grandchild.position[1],
+                    c=grandchild.color, s=grandchild.size, alpha=0.6,
+                    edgecolors='gray', linewidth=1)
+            
+            # Стрелочка от родителя к внуку
+            parent = children[grandchild.parent_idx]
+            arrow = FancyArrowPatch(
+                (parent.position[0], parent.position[1]),
+                (grandchild.position[0], grandchild.position[1]),
+                arrowstyle='->', 
+                mutation_scale=10,
+                color=grandchild.color,
+                alpha=0.5,
+                linewidth=1.5
+            )
+            ax.add_patch(arrow)
+            
+            # Глобальный индекс внука
+            label = str(grandchild.global_idx if grandchild.global_idx is not None else '?')
+            ax.text(grandchild.position[0], grandchild.position[1], 
+                   label, fontsize=10, fontweight='bold', 
+                   color='white', ha='center', va='center',
+                   bbox=dict(boxstyle="circle,pad=0.15", facecolor='purple', alpha=0.8))
+    
+    # Настройки графика
+    ax.set_xlabel('θ (радианы)', fontsize=12)
+    ax.set_ylabel('θ̇ (рад/с)', fontsize=12)
+    
+    # Формируем заголовок с информацией о dt
+    title = "Дерево спор глубиной 2"
+    if dt_info:
+        if 'dt_children' in dt_info and dt_info['dt_children'] is not None:
+            # Показываем индивидуальные dt детей
+            dt_children = dt_info['dt_children']
+            title += f"\nДети dt: [{dt_children[0]:.3f}, {dt_children[1]:.3f}, {dt_children[2]:.3f}, {dt_children[3]:.3f}]"
+        else:
+            # Показываем стандартный dt
+            title += f"\nСтандартный dt = {dt_info.get('dt_standard', 'N/A')}"
+        
+        # Добавляем информацию о dt внуков
+        if 'dt_grandchildren' in dt_info:
+            dt_gc = dt_info['dt_grandchildren']
+            if isinstance(dt_gc, str) and dt_gc == 'auto':
+                title += f"\nВнуки dt: автоматические (k={dt_info.get('k_factor', 2)})"
+            elif dt_gc is not None:
+                title += f"\nВнуки dt: индивидуальные ({len(dt_gc)} значений)"
+            else:
+                title += f"\nВнуки dt: автоматические (k={dt_info.get('k_factor', 2)})"
+    
+    ax.set_title(title, fontsize=12)
+    ax.grid(True, alpha=0.3)
+    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+    
+    plt.tight_layout()
+    plt.show()
+    
+    # Выводим сводку в консоль
+    print(f"\n📊 СВОДКА ДЕРЕВА:")
+    print(f"   🌳 Корень: {root.position}")
+    print(f"   🍄 Детей: {len(children)} спор")
+    if 'grandchildren' in tree_data:
+        print(f"   👶 Внуков: {len(tree_data['grandchildren'])} спор")
+    if dt_info:
+        print(f"   ⏱️  dt детей: {dt_info.get('dt_children', 'стандартный')}")
+        dt_gc = dt_info.get('dt_grandchildren', 'auto')
+        if isinstance(dt_gc, str) and dt_gc == 'auto':
+            print(f"   👶 dt внуков: автоматические (k={dt_info.get('k_factor', 2)})")
+        elif dt_gc is not None:
+            print(f"   👶 dt внуков: индивидуальные {[f'{dt:.3f}' for dt in dt_gc]}")
+        else:
+            print(f"   👶 dt внуков: автоматические (k={dt_info.get('k_factor', 2)})")
@@ -3,7 +3,6 @@
 import numpy as np
 import sys
 import os
-import re
 import matplotlib.pyplot as plt
 from scipy.optimize import minimize
 
@@ -41,35 +40,12 @@ cfg = SporeTreeConfig(
 )
 cfg.validate()
 
-# %%
-def take_time_sign(grandchild):
-    """
-    Извлекает слово после последнего подчеркивания из поля 'name' каждого внука.
-    Возвращает список этих слов.
-    """
-    
-    name = grandchild['name']
-    match = re.search(r'_([^_]+)$', name)
-    if match.group(1) == 'forward':
-        return 1
-    elif match.group(1) == 'backward':
-        return -1
-    else:
-        raise ValueError(f"Неизвестный знак времени: {match}")
-
-# take_time_sign(grandchildren[1])
-
-# %%
-
 # %%
 def draw_quad(state, time_sign,control, control_dot=0, N = 10, max_dt=0.1):
-    quad_poses = [state]
-
+    # Каждый шаг стартует из предыдущей точки (цепочка), поэтому это не расчет
+    # от одной базы, а один JIT-вызов всей цепочки (без list.append и массива на каждый шаг)
     time = np.linspace(0, max_dt, N+1)
-    for i in range(1,N+1):
-        quad_poses.append(pendulum.quad_step(quad_poses[-1], control, 0, time_sign*time[i]))
-        
-    return np.array(quad_poses)
+    return pendulum.quad_trajectory(state, control, control_dot, time_sign*time)
 
 
 init_state = np.array([np.pi/2, 1])
@@ -99,7 +75,7 @@ tree.calculate_mean_points()
 # ──────────────────────────────────────────────────────────────────────
 visualize_spore_tree(tree, "Тест")
 
-tuples = [(grandchildren[i]['position'], grandchildren[i]['control'], take_time_sign(grandchildren[i])) for i in range(len(grandchildren))]
+tuples = [(grandchildren[i]['position'], grandchildren[i]['control'], grandchildren[i]['sign_dt']) for i in range(len(grandchildren))]
 for gc in (tuples[3], tuples[7]):
     pos = gc[0]
     control = gc[1]
@@ -129,7 +105,6 @@ pendulum.find_all_quadratic_intersections(
 # %%
 init_position = np.array([np.pi/2, 1])
 
-vary_dt_poses = [init_position]
 rk45_poses = [init_position]
 quad_poses = [init_position]
 
@@ -138,9 +113,9 @@ dt = 0.01
 u = -1
 u_dot = 0
 
-for i in range(-N, N):
-    next_position = pendulum.step(init_position, u, i*dt)
-    vary_dt_poses.append(next_position)
+# Все 2N шагов стартуют из init_position - один веерный JIT-вызов вместо цикла
+vary_dts = np.arange(-N, N) * dt
+vary_dt_poses = np.vstack([init_position, pendulum.fan_step(init_position, np.full(2 * N, float(u)), vary_dts)])
 
 for i in range(N):
     rk45_poses.append(pendulum.scipy_rk45_step(rk45_poses[-1], u, dt))
@@ -150,7 +125,6 @@ for i in range(N):
 #     quad_poses.append(pendulum.quad_step(quad_poses[-1], u, u_dot, dt))
 #     quad_poses = [pendulum.quad_step(quad_poses[0], 1, 0, -dt)] + quad_poses
 
-vary_dt_poses = np.array(vary_dt_poses)
 rk45_poses = np.array(rk45_poses)
 quad_poses = np.array(draw_quad(state=init_position, time_sign=-1, control=u, N=100, max_dt=0.1))
 
@@ -219,27 +193,21 @@ dt = 0.01
 time_steps = 200
 time = np.arange(0, time_steps) * dt  # Создаём время корректно
 
-states = [initial_state]
-derivatives_1 = []  # θ̇
-derivatives_2 = []  # θ̈  
-derivatives_3 = []  # θ⃛
+# Предвыделенные массивы вместо списков с .append
+states = np.empty((time_steps, 2))
+states[0] = initial_state
+derivatives_1 = np.empty(time_steps)  # θ̇
+derivatives_2 = np.empty(time_steps)  # θ̈  
+derivatives_3 = np.empty(time_steps)  # θ⃛
 
 # Симулируем time_steps шагов
 for i in range(time_steps):
-    current_state = states[-1]
-    
     # Вычисляем все производные для текущего состояния
-    d1, d2, d3 = pendulum.get_all_derivatives(current_state, control, control_dot)
-    derivatives_1.append(d1)
-    derivatives_2.append(d2)
-    derivatives_3.append(d3)
+    derivatives_1[i], derivatives_2[i], derivatives_3[i] = pendulum.get_all_derivatives(states[i], control, control_dot)
     
     # Следующий шаг (кроме последней итерации)
-    if i < time_steps - 1:
-        next_state = pendulum.step(current_state, control, dt)
-        states.append(next_state)
-
-states = np.array(states)  # Конвертируем в numpy массив
+    if i + 1 < time_steps:
+        states[i + 1] = pendulum.step(states[i], control, dt)
 
 # Отладочная информация
 print(f"Отладка размеров:")
@@ -3,12 +3,14 @@ import sys
 import os
 import matplotlib.pyplot as plt
 import pandas as pd
-from scipy.optimize import minimize
+from scipy.optimize import minimize, differential_evolution
 import yaml
 from dataclasses import dataclass, field
 import logging
 import time
 import json
+from functools import partial
+import multiprocessing
 
 # --- Настройка импортов ---
 sys.path.insert(0, os.path.abspath(os.path.join(os.getcwd(), '')))
@@ -44,94 +46,251 @@ def setup_logging(log_dir: str):
     )
     logging.info(f"Логгер инициализирован. Логи сохраняются в {log_file}")
 
-def main():
-    # --- Создание директории для результатов ---
-    run_timestamp = time.strftime("%Y%m%d_%H%M%S")
-    run_dir = os.path.join('runs', run_timestamp)
-    os.makedirs(run_dir, exist_ok=True)
+NUM_CHILDREN = 4
+NUM_GRANDCHILDREN = 8
+LOG_EVERY = 20  # логировать прогресс раз в столько итераций
 
-    # --- Настройка логирования ---
-    setup_logging(run_dir)
 
-    # --- Загрузка конфигурации ---
-    try:
-        with open('config/optimization.yaml', 'r', encoding='utf-8') as f:
-            config_yaml = yaml.safe_load(f)
-        logging.info("✅ Конфигурация успешно загружена из 'config/optimization.yaml'.")
-    except FileNotFoundError:
-        logging.error("Ошибка: Файл 'config/optimization.yaml' не найден.")
-        return
-
-    opt_config = config_yaml['optimizer']
-    integ_config = config_yaml['integration']
-    
-    # --- Инициализация системы ---
+def build_system(step_size: float):
+    """Маятник, конфиг, дерево и evaluator - отдельно в каждом процессе мульти-старта."""
     pendulum = PendulumSystem()
     spore_tree_config = SporeTreeConfig(
         initial_position=np.array([np.pi, 0.0]),
-        dt_base=integ_config['step_size'],
+        dt_base=step_size,
         dt_grandchildren_factor=0.1,
         show_debug=False
     )
     tree = SporeTree(pendulum, spore_tree_config)
     evaluator = TreeEvaluator(tree)
+    return pendulum, spore_tree_config, tree, evaluator
 
-    num_children = 4
-    num_grandchildren_per_child = 2
-    num_total_grandchildren = num_children * num_grandchildren_per_child
-    num_params = num_total_grandchildren
-    logging.info(f"Система инициализирована. Количество оптимизируемых параметров (только внуки): {num_params}")
 
-    opt_state = OptimizationState()
+def make_pairing_objective(pendulum, tree, evaluator, fixed_dt_children, initial_dt_grandchildren):
+    """
+    Строит дерево в начальной точке и возвращает функции оптимизации внуков:
+    (loss, loss_and_grad, dist_matrix). Индексы допустимых пар захватываются замыканием.
+    """
+    # ---- ВАЖНО: карта кандидатов должна быть создана до первого вызова objective -----
+    evaluator._build_if_needed(np.concatenate([fixed_dt_children, initial_dt_grandchildren]))
+    # Индексы допустимых пар (i < j) - считаются один раз после построения карты кандидатов
+    _idx_i, _idx_j = tree.pairing_candidate_idx
 
-    def grandchildren_pairing_loss(dt_grandchildren, fixed_dt_children, pairing_map):
+    def grandchildren_positions(dt_grandchildren):
         dt_all = np.concatenate([fixed_dt_children, dt_grandchildren])
         evaluator._build_if_needed(dt_all)
+        return tree.gc_positions
+
+    def grandchildren_pairing_loss(dt_grandchildren):
+        # Сумма квадратов расстояний только по допустимым парам (i < j) - без матрицы 8x8 и маски
+        positions = grandchildren_positions(dt_grandchildren)
+        d = positions[_idx_i] - positions[_idx_j]
+        return np.einsum('ij,ij->', d, d)
+
+    def grandchildren_pairing_loss_and_grad(dt_grandchildren):
+        # Лосс и аналитический градиент по 8 dt внуков за одно построение дерева.
+        # dp_k/d(dt_k) = sign_k * f(p_k, u_k): динамика маятника в точке внука
+        positions = grandchildren_positions(dt_grandchildren)
+        d = positions[_idx_i] - positions[_idx_j]
+        loss = np.einsum('ij,ij->', d, d)
         
-        grandchildren_positions = np.array([gc['position'] for gc in tree.grandchildren])
-        dist_matrix = pairwise_sqdist(grandchildren_positions)
-        
-        # Создаем маску нелегитимных пар
-        mask = np.full_like(dist_matrix, np.inf)
-        for gc_idx, allowed_partners in pairing_map.items():
-            mask[gc_idx, allowed_partners] = 1.0
-            
-        # Применяем маску: расстояние до нелегитимных пар становится бесконечным
-        masked_dist_matrix = dist_matrix * mask
+        # dL/dp_k: +2d для первого внука пары, -2d для второго
+        grad_p = np.zeros_like(positions)
+        np.add.at(grad_p, _idx_i, 2.0 * d)
+        np.add.at(grad_p, _idx_j, -2.0 * d)
         
-        # Суммируем только конечные значения (верхний треугольник)
-        loss = np.sum(np.triu(masked_dist_matrix, k=1)[np.isfinite(np.triu(masked_dist_matrix, k=1))])
+        theta, theta_dot = positions[:, 0], positions[:, 1]
+        theta_ddot = (-pendulum.g / pendulum.l * np.sin(theta) - pendulum.damping * theta_dot
+                      + tree.gc_controls / (pendulum.m * pendulum.l ** 2))
+        grad = tree.gc_sign_dt * (grad_p[:, 0] * theta_dot + grad_p[:, 1] * theta_ddot)
+        return loss, grad
+
+    def grandchildren_dist_matrix(dt_grandchildren):
+        # Полная матрица квадратов расстояний - только для сохранения в csv
+        return pairwise_sqdist(grandchildren_positions(dt_grandchildren))
 
-        return loss, dist_matrix
+    return grandchildren_pairing_loss, grandchildren_pairing_loss_and_grad, grandchildren_dist_matrix
+
+
+def initial_dt_vectors(spore_tree_config, seed: int):
+    """Фиксированные dt детей и возмущенные (по seed) стартовые dt внуков."""
+    default_dt_vector = spore_tree_config.get_default_dt_vector()
+    fixed_dt_children = default_dt_vector[:NUM_CHILDREN]
+    initial_dt_grandchildren = default_dt_vector[NUM_CHILDREN:]
+    np.random.seed(seed)
+    initial_dt_grandchildren += np.random.uniform(-0.001, 0.001, size=initial_dt_grandchildren.shape)
+    return fixed_dt_children, initial_dt_grandchildren
+
+
+def run_one(seed: int, step_size: float, maxiter: int = 1000) -> dict:
+    """
+    Один рестарт оптимизации внуков (выполняется в процессе пула).
+    Возвращает только picklable-результат: dt, лосс, статус и историю.
+    """
+    pendulum, spore_tree_config, tree, evaluator = build_system(step_size)
+    fixed_dt_children, initial_dt_grandchildren = initial_dt_vectors(spore_tree_config, seed)
+    _, loss_and_grad, _ = make_pairing_objective(
+        pendulum, tree, evaluator, fixed_dt_children, initial_dt_grandchildren
+    )
+
+    opt_state = OptimizationState()
+    last_loss = None
+
+    def objective(dt_grandchildren):
+        # Запоминаем последний лосс, чтобы callback не делал лишний прямой проход
+        nonlocal last_loss
+        last_loss, grad = loss_and_grad(dt_grandchildren)
+        return last_loss, grad
 
     def callback_function(current_dt_grandchildren):
-        fixed_dt_children = spore_tree_config.get_default_dt_vector()[:num_children]
-        current_loss, _ = grandchildren_pairing_loss(
-            current_dt_grandchildren, 
-            fixed_dt_children, 
-            tree.pairing_candidate_map
-        )
-        logging.info(f"Iter {opt_state.iteration}: Loss={current_loss:.6f}")
-        opt_state.history.append({'iteration': opt_state.iteration, 'loss': current_loss})
+        opt_state.history.append({'iteration': opt_state.iteration, 'loss': last_loss})
+        if opt_state.iteration % LOG_EVERY == 0:
+            logging.info(f"[seed {seed}] Iter {opt_state.iteration}: Loss={last_loss:.6f}")
         opt_state.iteration += 1
 
-    logging.info("Определены функции для оптимизации встречи внуков с учетом родственных связей.")
+    bounds = [(0.001, 0.2)] * NUM_GRANDCHILDREN
 
-    # --- Запуск оптимизации ---
-    fixed_dt_children = spore_tree_config.get_default_dt_vector()[:num_children]
-    initial_dt_grandchildren = spore_tree_config.get_default_dt_vector()[num_children:]
-    np.random.seed(42)
-    initial_dt_grandchildren += np.random.uniform(-0.001, 0.001, size=initial_dt_grandchildren.shape)
+    # Лосс гладкий - L-BFGS-B с аналитическим градиентом (jac=True: objective возвращает (loss, grad))
+    result = minimize(
+        objective, initial_dt_grandchildren.copy(),
+        method='L-BFGS-B', jac=True,
+        bounds=bounds, callback=callback_function,
+        options={
+            'maxiter': maxiter,
+            'ftol': 1e-9
+        }
+    )
+
+    return {
+        'seed': seed,
+        'initial_dt_grandchildren': initial_dt_grandchildren,
+        'x': result.x,
+        'fun': float(result.fun),
+        'nit': int(result.nit),
+        'success': bool(result.success),
+        'message': str(result.message),
+        'history': opt_state.history
+    }
+
+
+def warm_jit_cache(step_size: float) -> None:
+    """
+    Один расчет лосса с градиентом в основном процессе до запуска пула.
+    JIT-ядра (cache=True) компилируются и пишутся в кэш Numba один раз,
+    а spawn-воркеры загружают их с диска, а не компилируют одновременно.
+    """
+    pendulum, spore_tree_config, tree, evaluator = build_system(step_size)
+    fixed_dt_children, initial_dt_grandchildren = initial_dt_vectors(spore_tree_config, seed=42)
+    _, loss_and_grad, _ = make_pairing_objective(
+        pendulum, tree, evaluator, fixed_dt_children, initial_dt_grandchildren
+    )
+    loss_and_grad(initial_dt_grandchildren)
+
+
+# Состояние воркера DE: своя копия системы в каждом процессе, создается лениво при первом вызове
+_WORKER_STATE = {}
 
-    bounds = [(0.001, 0.2)] * num_params
+
+def worker_objective(dt_grandchildren, step_size: float) -> float:
+    """Лосс спаривания внуков для процессов пула differential_evolution (реентерабельно по процессам)."""
+    loss = _WORKER_STATE.get(step_size)
+    if loss is None:
+        pendulum, spore_tree_config, tree, evaluator = build_system(step_size)
+        default_dt_vector = spore_tree_config.get_default_dt_vector()
+        fixed_dt_children = default_dt_vector[:NUM_CHILDREN]
+        initial_dt_grandchildren = default_dt_vector[NUM_CHILDREN:]
+        loss, _, _ = make_pairing_objective(
+            pendulum, tree, evaluator, fixed_dt_children, initial_dt_grandchildren
+        )
+        _WORKER_STATE[step_size] = loss
+    return loss(dt_grandchildren)
+
+
+def run_differential_evolution(step_size: float, n_workers: int, seed: int = 42, maxiter: int = 1000) -> dict:
+    """
+    Безградиентная альтернатива мульти-старту: differential_evolution,
+    популяция оценивается параллельно в пуле процессов. Результат в формате run_one.
+    """
+    _, spore_tree_config, _, _ = build_system(step_size)
+    initial_dt_grandchildren = spore_tree_config.get_default_dt_vector()[NUM_CHILDREN:]
+    bounds = [(0.001, 0.2)] * NUM_GRANDCHILDREN
+
+    # spawn, а не fork - см. main; пул передается в DE как map-функция
+    with multiprocessing.get_context('spawn').Pool(n_workers) as pool:
+        result = differential_evolution(
+            partial(worker_objective, step_size=step_size), bounds,
+            x0=initial_dt_grandchildren, workers=pool.map, updating='deferred',
+            polish=True, seed=seed, maxiter=maxiter
+        )
+
+    return {
+        'seed': seed,
+        'initial_dt_grandchildren': initial_dt_grandchildren,
+        'x': result.x,
+        'fun': float(result.fun),
+        'nit': int(result.nit),
+        'success': bool(result.success),
+        'message': str(result.message),
+        'history': []
+    }
+
+
+def main():
+    # --- Создание директории для результатов ---
+    run_timestamp = time.strftime("%Y%m%d_%H%M%S")
+    run_dir = os.path.join('runs', run_timestamp)
+    os.makedirs(run_dir, exist_ok=True)
+
+    # --- Настройка логирования ---
+    setup_logging(run_dir)
+
+    # --- Загрузка конфигурации ---
+    try:
+        with open('config/optimization.yaml', 'r', encoding='utf-8') as f:
+            config_yaml = yaml.safe_load(f)
+        logging.info("✅ Конфигурация успешно загружена из 'config/optimization.yaml'.")
+    except FileNotFoundError:
+        logging.error("Ошибка: Файл 'config/optimization.yaml' не найден.")
+        return
+
+    opt_config = config_yaml['optimizer']
+    integ_config = config_yaml['integration']
+    step_size = integ_config['step_size']
+    n_starts = int(opt_config.get('n_starts', 4))
+    gc_method = opt_config.get('grandchildren_method', 'multistart')
     
-    # ---- ВАЖНО: Убедимся, что карта создана до первого вызова objective -----
-    evaluator._build_if_needed(np.concatenate([fixed_dt_children, initial_dt_grandchildren]))
-    # -----------------------------------------------------------------------
+    logging.info(f"Количество оптимизируемых параметров (только внуки): {NUM_GRANDCHILDREN}")
+
+    # --- Прогрев JIT-кэша до пула: воркеры не компилируют ядра заново ---
+    t_warm = time.perf_counter()
+    warm_jit_cache(step_size)
+    logging.info(f"JIT-кэш прогрет за {time.perf_counter() - t_warm:.2f} с")
+
+    if gc_method == 'differential_evolution':
+        # --- DE: популяция оценивается параллельно в n_starts процессах ---
+        logging.info(f"--- НАЧАЛО ОПТИМИЗАЦИИ ВНУКОВ: differential_evolution, Pool({n_starts}) ---")
+        runs = [run_differential_evolution(step_size, n_starts)]
+    else:
+        # --- Мульти-старт: независимые рестарты по процессам ---
+        # Первый seed = 42 совпадает с прежним одиночным запуском
+        seeds = [42 + k for k in range(n_starts)]
+        logging.info(f"--- НАЧАЛО ОПТИМИЗАЦИИ ВНУКОВ: {n_starts} рестартов в Pool({n_starts}) ---")
+        # spawn, а не fork: параллельный слой Numba (TBB) не переживает fork - воркеры зависают на выходе
+        with multiprocessing.get_context('spawn').Pool(n_starts) as pool:
+            runs = pool.map(partial(run_one, step_size=step_size), seeds)
+    logging.info("--- ОПТИМИЗАЦИЯ ВНУКОВ ЗАВЕРШЕНА ---")
 
-    objective_wrapped = lambda dt_gc: grandchildren_pairing_loss(dt_gc, fixed_dt_children, tree.pairing_candidate_map)[0]
+    for run in runs:
+        logging.info(f"  seed {run['seed']}: Loss={run['fun']:.6f}, iters={run['nit']}, success={run['success']}")
+    best = min(runs, key=lambda run: run['fun'])
+    logging.info(f"🏆 Лучший рестарт: seed {best['seed']} (Loss={best['fun']:.6f})")
 
-    logging.info("--- НАЧАЛО ОПТИМИЗАЦИИ ВНУКОВ ---")
+    # --- Дерево лучшего рестарта в основном процессе (для сохранений) ---
+    pendulum, spore_tree_config, tree, evaluator = build_system(step_size)
+    fixed_dt_children = spore_tree_config.get_default_dt_vector()[:NUM_CHILDREN]
+    initial_dt_grandchildren = best['initial_dt_grandchildren']
+    _, _, grandchildren_dist_matrix = make_pairing_objective(
+        pendulum, tree, evaluator, fixed_dt_children, initial_dt_grandchildren
+    )
     
     # --- Сохранение и визуализация начального состояния ---
     initial_dt_all = np.concatenate([fixed_dt_children, initial_dt_grandchildren])
@@ -142,14 +301,10 @@ def main():
         'grandchildren': [gc.copy() for gc in tree.grandchildren]
     }
     
-    # Сохраняем начальную матрицу расстояний
-    _, initial_dist_matrix = grandchildren_pairing_loss(
-        initial_dt_grandchildren, 
-        fixed_dt_children, 
-        tree.pairing_candidate_map
-    )
-    initial_dist_matrix_path = os.path.join(run_dir, 'initial_distance_matrix.csv')
-    np.savetxt(initial_dist_matrix_path, initial_dist_matrix, delimiter=',', fmt='%.6f')
+    # Сохраняем начальную матрицу расстояний (бинарно; csv - через npy_to_csv.py)
+    initial_dist_matrix = grandchildren_dist_matrix(initial_dt_grandchildren)
+    initial_dist_matrix_path = os.path.join(run_dir, 'initial_distance_matrix.npy')
+    np.save(initial_dist_matrix_path, initial_dist_matrix)
     logging.info(f"Начальная матрица расстояний сохранена в {initial_dist_matrix_path}")
 
     fig, ax = plt.subplots(figsize=(12, 11))
@@ -159,37 +314,19 @@ def main():
     plt.close(fig)
     logging.info(f"Начальное состояние сохранено в {initial_state_path}")
 
-    result = minimize(
-        objective_wrapped, initial_dt_grandchildren,
-        method='Nelder-Mead',
-        bounds=bounds, callback=callback_function,
-        options={
-            'maxiter': 1000,  # Явно задаем низкий предел итераций
-            'disp': True, 
-            'xatol': 1e-3,  # Увеличиваем допуск (требуем меньшей точности)
-            'fatol': 1e-3   # Увеличиваем допуск (требуем меньшей точности)
-        }
-    )
-
-    logging.info("--- ОПТИМИЗАЦИЯ ВНУКОВ ЗАВЕРШЕНА ---")
-
     # --- Сохранение и визуализация конечного состояния ---
-    final_dt_grandchildren = result.x
+    final_dt_grandchildren = best['x']
     final_dt_all = np.concatenate([fixed_dt_children, final_dt_grandchildren])
     evaluator._build_if_needed(final_dt_all)
     
     # Сохраняем финальную матрицу расстояний
-    _, final_dist_matrix = grandchildren_pairing_loss(
-        final_dt_grandchildren, 
-        fixed_dt_children,
-        tree.pairing_candidate_map
-    )
-    final_dist_matrix_path = os.path.join(run_dir, 'final_distance_matrix.csv')
-    np.savetxt(final_dist_matrix_path, final_dist_matrix, delimiter=',', fmt='%.6f')
+    final_dist_matrix = grandchildren_dist_matrix(final_dt_grandchildren)
+    final_dist_matrix_path = os.path.join(run_dir, 'final_distance_matrix.npy')
+    np.save(final_dist_matrix_path, final_dist_matrix)
     logging.info(f"Финальная матрица расстояний сохранена в {final_dist_matrix_path}")
 
-    title = f"Финальное состояние после {result.nit} итераций"
-    if not result.success:
+    title = f"Финальное состояние после {best['nit']} итераций (seed {best['seed']})"
+    if not best['success']:
         title += " (Оптимизация НЕ УДАЛАСЬ)"
         logging.warning("Оптимизация не была успешной.")
 
@@ -202,13 +339,18 @@ def main():
 
     # --- Сохранение метрик ---
     metrics = {
-        'success': bool(result.success),
-        'message': result.message,
-        'final_loss': result.fun,
-        'iterations': result.nit,
+        'success': best['success'],
+        'message': best['message'],
+        'final_loss': best['fun'],
+        'iterations': best['nit'],
+        'seed': best['seed'],
         'initial_dt_grandchildren': initial_dt_grandchildren.tolist(),
         'final_dt_grandchildren': final_dt_grandchildren.tolist(),
-        'history': opt_state.history
+        'history': best['history'],
+        'restarts': [
+            {'seed': run['seed'], 'final_loss': run['fun'], 'iterations': run['nit'], 'success': run['success']}
+            for run in runs
+        ]
     }
     metrics_path = os.path.join(run_dir, 'metrics.json')
     with open(metrics_path, 'w', encoding='utf-8') as f:
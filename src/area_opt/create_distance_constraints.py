@@ -1,26 +1,30 @@
 import numpy as np
+from scipy.sparse import csr_matrix
 
 
-def create_distance_constraints(pairs, tree, pendulum, constraint_distance=1e-5, show=False):
+def create_distance_constraints(pairs, tree, pendulum, constraint_distance=1e-5, area_evaluator=None, show=False):
     """
-    Создает список функций-констрейнтов для оптимизации площади.
+    Создает ОДНУ векторную функцию-констрейнт для оптимизации площади.
     
-    Для каждой пары внуков создает лямбда-функцию, которая:
+    Функция constraint_batch(dt_vector) -> np.array (n_pairs,):
     1. Принимает dt_vector [4 dt детей + 8 dt внуков]
-    2. Вычисляет позиции обоих внуков в паре при этих временах
-    3. Возвращает расстояние между ними
+    2. Берет позиции 8 внуков у area_evaluator.positions() (общий проход с целевой функцией)
+       или, без evaluator, считает 4 родителей одним веером из корня и 8 внуков одним batch_step
+    3. Возвращает constraint_distance - расстояние для каждой пары
+    Якобиан (n_pairs, 12) - отдельно и только по запросу: constraint_batch.jac(dt_vector).
     
     Констрейнт считается выполненным когда расстояние <= constraint_distance.
     
     Args:
         pairs: список пар [(gc_i, gc_j, meeting_info), ...] от find_optimal_pairs()
         tree: исходное дерево SporeTree для получения структуры
-        pendulum: объект маятника для вычисления step
+        pendulum: объект маятника (fan_step / batch_step)
         constraint_distance: float - максимально допустимое расстояние в парах
+        area_evaluator: TreeAreaEvaluator того же дерева - источник позиций внуков (опционально)
         show: bool - вывод отладочной информации
         
     Returns:
-        list: список функций-констрейнтов для scipy.optimize.minimize
+        callable: векторная функция-констрейнт для scipy.optimize.minimize (None при ошибке)
         dict: информация о констрейнтах для дебага
     """
     
@@ -28,7 +32,7 @@ def create_distance_constraints(pairs, tree, pendulum, constraint_distance=1e-5,
         if not pairs:
             if show:
                 print("Ошибка: Список пар пуст")
-            return [], {}
+            return None, {}
             
         if show:
             print("СОЗДАНИЕ КОНСТРЕЙНТОВ РАССТОЯНИЙ")
@@ -36,149 +40,195 @@ def create_distance_constraints(pairs, tree, pendulum, constraint_distance=1e-5,
             print(f"Создаем констрейнты для {len(pairs)} пар")
             print(f"Максимальное допустимое расстояние: {constraint_distance}")
         
-        # Собираем информацию о структуре дерева
+        # Собираем информацию о структуре дерева (не меняется при оптимизации)
         root_position = tree.root['position']
         
-        # Информация о детях: индекс -> (control, sign_dt)
-        children_info = {}
-        for i, child in enumerate(tree.children):
-            children_info[i] = {
-                'control': child['control'],
-                'sign_dt': np.sign(child['dt'])  # +1 для forward, -1 для backward
-            }
+        # Дети: управление и знак dt (+1 для forward, -1 для backward)
+        parent_ctrl = np.array([child['control'] for child in tree.children], dtype=np.float64)
+        parent_sign = np.sign([child['dt'] for child in tree.children]).astype(np.float64)
         
-        # Информация о внуках: global_idx -> (parent_idx, control, sign_dt)
-        grandchildren_info = {}
-        for gc in tree.grandchildren:
-            grandchildren_info[gc['global_idx']] = {
-                'parent_idx': gc['parent_idx'],
-                'control': gc['control'],
-                'sign_dt': np.sign(gc['dt'])  # +1 для forward, -1 для backward
-            }
+        # Внуки: SoA-буферы дерева в порядке global_idx (захватываются по ссылке)
+        gc_parent_of = tree.gc_parent_idx
+        gc_ctrl = tree.gc_controls
+        gc_sign = tree.gc_sign_dt
+        
+        # Индексы пар
+        pair_i = np.array([gc_i for gc_i, _, _ in pairs], dtype=np.intp)
+        pair_j = np.array([gc_j for _, gc_j, _ in pairs], dtype=np.intp)
+        
+        # Предусловия проверяются один раз здесь, а не try/except на каждом вызове
+        n_gc = len(gc_ctrl)
+        if min(pair_i.min(), pair_j.min()) < 0 or max(pair_i.max(), pair_j.max()) >= n_gc:
+            raise ValueError(f"Индексы внуков в парах вне диапазона [0, {n_gc})")
         
         if show:
             print(f"\nИнформация о структуре:")
             print(f"  Корень: {root_position}")
-            print(f"  Детей: {len(children_info)}")
-            print(f"  Внуков: {len(grandchildren_info)}")
+            print(f"  Детей: {len(parent_ctrl)}")
+            print(f"  Внуков: {len(gc_ctrl)}")
         
-        # Создаем функции-констрейнты
-        constraints = []
-        constraint_info = {}
+        # Кэши по dt детей: при конечно-разностном якобиане 8 из 12 возмущений меняют
+        # только dt внуков, и веер из корня пересчитывать не нужно
+        _parent_cache = {'key': None, 'pos': None}
+        _parent_sens_cache = {'key': None, 'pos': None, 'sens': None}
+        # Последняя точка для значений и для якобиана - раздельно: SLSQP на линейном поиске
+        # запрашивает только значения, якобиан - лишь в принятых точках
+        _last_values = {'key': None, 'values': None}
+        _last_jac = {'key': None, 'jac': None}
         
-        for pair_idx, (gc_i, gc_j, meeting_info) in enumerate(pairs):
-            
-            # Получаем информацию о внуках в паре
-            gc_i_info = grandchildren_info[gc_i]
-            gc_j_info = grandchildren_info[gc_j]
+        n_pairs = len(pair_i)
+        rows = np.arange(n_pairs)
+        root_states = np.tile(np.asarray(root_position, dtype=np.float64), (len(parent_ctrl), 1))
+        zero_parent_dir = np.zeros_like(root_states)
+        zero_gc_dir = np.zeros((len(gc_ctrl), 2))
+        zero_gc_dt = np.zeros(len(gc_ctrl))
+        
+        def _values(dt_vector):
+            """Значения всех констрейнтов: позиции 4 родителей и 8 внуков двумя пакетными шагами."""
+            dt_vector = np.asarray(dt_vector, dtype=np.float64)
+            key = dt_vector.tobytes()
+            if key == _last_values['key']:
+                return _last_values['values']
             
-            # Создаем замыкание для текущей пары
-            def create_constraint_for_pair(gc_i_idx, gc_j_idx, gc_i_data, gc_j_data):
-                """
-                Создает функцию-констрейнт для конкретной пары.
-                Использует замыкание для захвата параметров пары.
-                """
-                
-                def constraint_function(dt_vector):
-                    """
-                    Функция-констрейнт для scipy.optimize.minimize.
-                    
-                    Args:
-                        dt_vector: np.array из 12 элементов [4 dt детей + 8 dt внуков]
-                        
-                    Returns:
-                        float: constraint_distance - расстояние_между_парой
-                        Положительное значение = констрейнт выполнен
-                        Отрицательное значение = констрейнт нарушен
-                    """
-                    try:
-                        # Извлекаем времена из вектора
-                        dt_children = dt_vector[0:4]
-                        dt_grandchildren = dt_vector[4:12]
-                        
-                        # Вычисляем позицию первого внука
-                        parent_i_idx = gc_i_data['parent_idx']
-                        parent_i_control = children_info[parent_i_idx]['control']
-                        parent_i_dt_signed = dt_children[parent_i_idx] * children_info[parent_i_idx]['sign_dt']
-                        
-                        # Позиция родителя gc_i
-                        parent_i_pos = pendulum.step(root_position, parent_i_control, parent_i_dt_signed)
-                        
-                        # Позиция внука gc_i
-                        gc_i_dt_signed = dt_grandchildren[gc_i_idx] * gc_i_data['sign_dt']
-                        gc_i_pos = pendulum.step(parent_i_pos, gc_i_data['control'], gc_i_dt_signed)
-                        
-                        # Вычисляем позицию второго внука
-                        parent_j_idx = gc_j_data['parent_idx']
-                        parent_j_control = children_info[parent_j_idx]['control']
-                        parent_j_dt_signed = dt_children[parent_j_idx] * children_info[parent_j_idx]['sign_dt']
-                        
-                        # Позиция родителя gc_j
-                        parent_j_pos = pendulum.step(root_position, parent_j_control, parent_j_dt_signed)
-                        
-                        # Позиция внука gc_j
-                        gc_j_dt_signed = dt_grandchildren[gc_j_idx] * gc_j_data['sign_dt']
-                        gc_j_pos = pendulum.step(parent_j_pos, gc_j_data['control'], gc_j_dt_signed)
-                        
-                        # Расстояние между внуками
-                        distance = np.linalg.norm(gc_i_pos - gc_j_pos)
-                        
-                        # Возвращаем constraint_distance - distance
-                        # Положительное = констрейнт выполнен (расстояние меньше порога)
-                        # Отрицательное = констрейнт нарушен (расстояние больше порога)
-                        return (constraint_distance - distance)
-                        
-                    except Exception as e:
-                        # При ошибке возвращаем большое отрицательное значение (нарушение)
-                        return -1e6
+            if area_evaluator is not None:
+                # Позиции внуков из прохода целевой функции в той же точке
+                gc_pos = area_evaluator.positions(dt_vector)
+            else:
+                # 4 родителя - один веер из корня, если dt детей изменились
+                parent_key = dt_vector[0:4].tobytes()
+                if parent_key != _parent_cache['key']:
+                    _parent_cache['pos'] = pendulum.fan_step(root_position, parent_ctrl, dt_vector[0:4] * parent_sign)
+                    _parent_cache['key'] = parent_key
                 
-                return constraint_function
+                # 8 внуков от своих родителей одним batch_step
+                gc_pos = pendulum.batch_step(_parent_cache['pos'][gc_parent_of], gc_ctrl, dt_vector[4:12] * gc_sign)
+            
+            # Расстояния всех пар разом
+            d = gc_pos[pair_i] - gc_pos[pair_j]
+            distance = np.sqrt(np.einsum('ij,ij->i', d, d))
+            
+            # Численный сбой (NaN) - большое отрицательное значение (нарушение), без исключений
+            values = np.where(np.isnan(distance), -1e6, constraint_distance - distance)
+            
+            _last_values['key'], _last_values['values'] = key, values
+            return values
+        
+        def _jacobian(dt_vector):
+            """Якобиан констрейнтов (n_pairs, 12): позиции и касательные RK4 за один проход."""
+            dt_vector = np.asarray(dt_vector, dtype=np.float64)
+            key = dt_vector.tobytes()
+            if key == _last_jac['key']:
+                return _last_jac['jac']
             
-            # Создаем функцию для текущей пары
-            constraint_func = create_constraint_for_pair(gc_i, gc_j, gc_i_info, gc_j_info)
-            constraints.append(constraint_func)
+            # Родители и их производные по своему dt
+            parent_key = dt_vector[0:4].tobytes()
+            if parent_key != _parent_sens_cache['key']:
+                _parent_sens_cache['pos'], _parent_sens_cache['sens'] = pendulum.batch_step_jvp(
+                    root_states, parent_ctrl, dt_vector[0:4] * parent_sign, zero_parent_dir, parent_sign)
+                _parent_sens_cache['key'] = parent_key
+            parent_pos, parent_sens = _parent_sens_cache['pos'], _parent_sens_cache['sens']
             
-            # Сохраняем информацию о констрейнте
+            # 8 внуков от своих родителей: позиции + производная по своему dt
+            gc_start = parent_pos[gc_parent_of]
+            gc_dts = dt_vector[4:12] * gc_sign
+            gc_pos, gc_sens = pendulum.batch_step_jvp(gc_start, gc_ctrl, gc_dts, zero_gc_dir, gc_sign)
+            # ... и перенос производной родителя по dt ребенка через шаг внука
+            _, gc_parent_sens = pendulum.batch_step_jvp(gc_start, gc_ctrl, gc_dts, parent_sens[gc_parent_of], zero_gc_dt)
+            
+            d = gc_pos[pair_i] - gc_pos[pair_j]
+            distance = np.sqrt(np.einsum('ij,ij->i', d, d))
+            
+            # d(constraint)/d(gc_i) = -d/|d|, d(constraint)/d(gc_j) = +d/|d| - по цепочке до dt
+            w = np.divide(d, distance[:, None], out=np.zeros_like(d), where=distance[:, None] > 0)
+            jac = np.zeros((n_pairs, 12))
+            jac[rows, 4 + pair_i] -= np.einsum('ij,ij->i', w, gc_sens[pair_i])
+            jac[rows, 4 + pair_j] += np.einsum('ij,ij->i', w, gc_sens[pair_j])
+            np.add.at(jac, (rows, gc_parent_of[pair_i]), -np.einsum('ij,ij->i', w, gc_parent_sens[pair_i]))
+            np.add.at(jac, (rows, gc_parent_of[pair_j]), np.einsum('ij,ij->i', w, gc_parent_sens[pair_j]))
+            jac[np.isnan(distance)] = 0.0
+            
+            _last_jac['key'], _last_jac['jac'] = key, jac
+            return jac
+        
+        def constraint_batch(dt_vector):
+            """
+            Векторная функция-констрейнт для scipy.optimize.minimize.
+            
+            Args:
+                dt_vector: np.array из 12 элементов [4 dt детей + 8 dt внуков]
+                
+            Returns:
+                np.array (n_pairs,): constraint_distance - расстояние_между_парой
+                Положительное значение = констрейнт выполнен
+                Отрицательное значение = констрейнт нарушен
+            """
+            return _values(dt_vector)
+        
+        def constraint_jac(dt_vector):
+            """Якобиан констрейнтов (n_pairs, 12) - считается только по запросу оптимизатора."""
+            return _jacobian(dt_vector)
+        
+        # Структура якобиана постоянна: строка пары зависит только от dt двух внуков
+        # и dt их родителей (<= 4 из 12). Уникальные (строка, столбец) в порядке CSR
+        sparsity = np.unique(np.concatenate([
+            np.stack([rows, gc_parent_of[pair_i]], 1), np.stack([rows, gc_parent_of[pair_j]], 1),
+            np.stack([rows, 4 + pair_i], 1), np.stack([rows, 4 + pair_j], 1)
+        ]), axis=0)
+        sparse_rows, sparse_cols = sparsity[:, 0], sparsity[:, 1]
+        sparse_indptr = np.searchsorted(sparse_rows, np.arange(n_pairs + 1))
+        
+        def constraint_jac_sparse(dt_vector):
+            """Якобиан констрейнтов как scipy.sparse.csr_matrix (n_pairs, 12) - для trust-constr."""
+            jac = _jacobian(dt_vector)
+            return csr_matrix((jac[sparse_rows, sparse_cols], sparse_cols, sparse_indptr), shape=(n_pairs, 12))
+        
+        # Якобиан доступен как атрибут: {'type': 'ineq', 'fun': constraint_batch, 'jac': constraint_batch.jac}
+        constraint_batch.jac = constraint_jac
+        constraint_batch.jac_sparse = constraint_jac_sparse
+        
+        # Сохраняем информацию о констрейнтах
+        constraint_info = {}
+        for pair_idx, (gc_i, gc_j, meeting_info) in enumerate(pairs):
             constraint_info[pair_idx] = {
                 'gc_i': gc_i,
                 'gc_j': gc_j,
-                'gc_i_parent': gc_i_info['parent_idx'],
-                'gc_j_parent': gc_j_info['parent_idx'],
+                'gc_i_parent': int(gc_parent_of[gc_i]),
+                'gc_j_parent': int(gc_parent_of[gc_j]),
                 'target_distance': constraint_distance,
                 'original_distance': meeting_info['distance'],
                 'meeting_time': meeting_info['meeting_time']
             }
             
             if show:
-                gc_i_dir = "F" if gc_i_info['sign_dt'] > 0 else "B"
-                gc_j_dir = "F" if gc_j_info['sign_dt'] > 0 else "B"
+                gc_i_dir = "F" if gc_sign[gc_i] > 0 else "B"
+                gc_j_dir = "F" if gc_sign[gc_j] > 0 else "B"
                 print(f"  Констрейнт {pair_idx+1}: gc_{gc_i}({gc_i_dir}) ↔ gc_{gc_j}({gc_j_dir})")
-                print(f"    Родители: {gc_i_info['parent_idx']} ↔ {gc_j_info['parent_idx']}")
+                print(f"    Родители: {gc_parent_of[gc_i]} ↔ {gc_parent_of[gc_j]}")
                 print(f"    Целевое расстояние: <= {constraint_distance}")
                 print(f"    Исходное расстояние: {meeting_info['distance']:.6f}")
         
         if show:
-            print(f"\nСоздано {len(constraints)} функций-констрейнтов")
+            print(f"\nСоздана векторная функция на {len(constraint_info)} констрейнтов")
             print(f"Формат dt_vector: [4 dt детей] + [8 dt внуков] = 12 элементов")
-            print(f"Констрейнт выполнен когда функция возвращает >= 0")
+            print(f"Констрейнт выполнен когда компонента результата >= 0")
             
             print(f"\nПример использования в scipy.optimize.minimize:")
-            print(f"constraints = [{{'type': 'ineq', 'fun': func}} for func in constraint_functions]")
+            print(f"constraints = [{{'type': 'ineq', 'fun': constraint_batch, 'jac': constraint_batch.jac}}]")
         
-        return constraints, constraint_info
+        return constraint_batch, constraint_info
         
     except Exception as e:
         if show:
             print(f"Ошибка при создании констрейнтов: {e}")
-        return [], {}
+        return None, {}
 
 
-def test_constraints(constraint_functions, dt_vector, constraint_info, show=False):
+def test_constraints(constraint_batch, dt_vector, constraint_info, show=False):
     """
-    Тестирует функции-констрейнты на заданном векторе dt.
+    Тестирует векторную функцию-констрейнт на заданном векторе dt.
     
     Args:
-        constraint_functions: список функций от create_distance_constraints()
+        constraint_batch: векторная функция от create_distance_constraints()
         dt_vector: np.array из 12 элементов для тестирования
         constraint_info: информация о констрейнтах
         show: bool - вывод результатов тестирования
@@ -191,14 +241,14 @@ def test_constraints(constraint_functions, dt_vector, constraint_info, show=Fals
         if show:
             print("ТЕСТИРОВАНИЕ КОНСТРЕЙНТОВ")
             print("="*40)
-            print(f"Тестируем {len(constraint_functions)} констрейнтов")
+            print(f"Тестируем {len(constraint_info)} констрейнтов")
             print(f"dt_vector: {dt_vector}")
         
         results = {}
         all_satisfied = True
         
-        for i, constraint_func in enumerate(constraint_functions):
-            constraint_value = constraint_func(dt_vector)
+        constraint_values = constraint_batch(dt_vector)
+        for i, constraint_value in enumerate(constraint_values):
             is_satisfied = constraint_value >= 0
             
             if not is_satisfied:
@@ -222,7 +272,7 @@ def test_constraints(constraint_functions, dt_vector, constraint_info, show=Fals
                       f"цель=<={target_distance}")
         
         results['summary'] = {
-            'total_constraints': len(constraint_functions),
+            'total_constraints': len(constraint_info),
             'satisfied_count': sum(1 for r in results.values() if isinstance(r, dict) and r.get('satisfied', False)),
             'all_satisfied': all_satisfied
         }
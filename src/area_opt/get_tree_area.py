@@ -1,34 +1,13 @@
 import numpy as np
-from numba import jit
 
-# Мы будем использовать ту же JIT-компилированную функцию, что и раньше.
-# Ее определение должно быть выполнено один раз в вашем коде.
-# Если вы используете Jupyter Notebook или аналогичную среду,
-# достаточно выполнить эту ячейку один раз.
-@jit(nopython=True)
-def _calculate_total_area_numba(root_pos, children_pos, grandchildren_pos, parent_indices):
-    """
-    JIT-компилированная функция для быстрого расчета общей площади.
-    Предполагается, что на вход подаются NumPy-массивы.
-    """
-    total_area = 0.0
-    num_grandchildren = grandchildren_pos.shape[0]
-
-    for i in range(num_grandchildren):
-        p1 = root_pos
-        p2 = children_pos[parent_indices[i]]
-        p3 = grandchildren_pos[i]
-
-        area = 0.5 * np.abs(p1[0] * (p2[1] - p3[1]) + p2[0] * (p3[1] - p1[1]) + p3[0] * (p1[1] - p2[1]))
-        total_area += area
-        
-    return total_area
+from .tree_area_evaluator import _area_vec
 
 # --- ГЛАВНАЯ ФУНКЦИЯ ---
 def get_tree_area(tree):
     """
     Принимает объект дерева и возвращает общую площадь.
-    Эта функция подготавливает данные для Numba и вызывает JIT-компилированный код.
+    Площадь считается одним векторным NumPy-выражением (_area_vec) - функция вызывается
+    разово, и прогрев JIT здесь стоил бы дороже самого расчета.
     """
     if not tree._children_created or not tree._grandchildren_created:
         print("Ошибка: Дерево должно содержать и детей, и внуков.")
@@ -39,20 +18,19 @@ def get_tree_area(tree):
     
     children_positions = np.array([child['position'] for child in tree.children])
     
-    grandchildren_positions = np.array([gc['position'] for gc in tree.grandchildren])
+    # Внуки уже лежат в SoA-буферах дерева (в порядке global_idx)
+    grandchildren_positions = tree.gc_positions
 
-    # 2. Создание индекса для связи внуков с их родителями
-    # Это работает, если внуки упорядочены по родителям:
+    # 2. Индекс связи внуков с их родителями:
     # gc[0], gc[1] -> children[0]
     # gc[2], gc[3] -> children[1] и т.д.
-    parent_indices = np.repeat(np.arange(len(tree.children)), 2)
+    parent_indices = tree.gc_parent_idx
     
-    # 3. Вызов оптимизированной Numba-функции
-    total_area = _calculate_total_area_numba(
-        root_pos, 
-        children_positions, 
-        grandchildren_positions, 
-        parent_indices
+    # 3. Сумма площадей треугольников root-parent-grandchild
+    total_area = _area_vec(
+        root_pos,
+        children_positions[parent_indices],
+        grandchildren_positions
     )
     
     return total_area
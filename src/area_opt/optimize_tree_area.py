@@ -1,12 +1,208 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
 import numpy as np
-from scipy.optimize import minimize
+from scipy.optimize import minimize, NonlinearConstraint, OptimizeResult
 from .create_distance_constraints import create_distance_constraints, test_constraints
 from .tree_area_evaluator import TreeAreaEvaluator
 
+try:
+    import nlopt  # опционально: SLSQP на C без Python-обвязки scipy
+except ImportError:
+    nlopt = None
+
+
+# Шаг центральной разности для gradient='central'
+FD_STEP = 1e-6
+
+# Относительный разброс стартовых точек мультистарта: x0 * (1 + N(0, sigma))
+START_PERTURBATION = 0.1
+
+# optimization_method для SLSQP из nlopt (без nlopt - откат на scipy 'SLSQP')
+NLOPT_METHOD = 'nlopt-SLSQP'
+
+# Допуск констрейнтов пар для nlopt (scipy SLSQP выполняет их точно)
+NLOPT_CONSTRAINT_TOL = 1e-12
+
+# Evaluator, переданный в процесс-воркер один раз (через initializer пула)
+_FD_WORKER = {}
+
+
+def _init_fd_worker(area_evaluator):
+    _FD_WORKER['evaluator'] = area_evaluator
+
+
+def _fd_worker_areas(points):
+    """Площади для пачки возмущенных dt_vector (выполняется в воркере)."""
+    evaluator = _FD_WORKER['evaluator']
+    return [evaluator.area(x) for x in points]
+
+
+def _central_gradient(area_evaluator, dt_vector, executor=None, n_workers=1):
+    """
+    Градиент -площади центральными разностями.
+    12 пар возмущений независимы - с executor считаются пачками в процессах.
+    """
+    x = np.asarray(dt_vector, dtype=np.float64)
+    steps = np.eye(len(x)) * FD_STEP
+    points = np.vstack([x + steps, x - steps])
+    
+    if executor is not None:
+        chunks = np.array_split(points, n_workers)
+        areas = np.concatenate([np.asarray(a) for a in executor.map(_fd_worker_areas, chunks)])
+    else:
+        areas = area_evaluator.area_batch(points)
+    
+    # objective = -area
+    return -(areas[:len(x)] - areas[len(x):]) / (2 * FD_STEP)
+
+
+def _cached_negative_area(area_evaluator, maxsize=256):
+    """
+    -area(dt) с LRU-кэшем по байтам dt_vector: SLSQP повторно запрашивает
+    те же точки (линейный поиск, базовая точка разностей) - повтор стоит один поиск в словаре.
+    """
+    @lru_cache(maxsize=maxsize)
+    def negative_area(key):
+        return -area_evaluator.area(np.frombuffer(key))
+    
+    return lambda dt_vector: negative_area(np.asarray(dt_vector, dtype=np.float64).tobytes())
+
+
+def _scipy_constraints(constraint_batch, optimization_method):
+    """
+    Констрейнты пар в формате метода: trust-constr - NonlinearConstraint с разреженным
+    якобианом (<= 4 ненулевых из 12 в строке), остальные - словарь {'type': 'ineq'}.
+    """
+    if optimization_method == 'trust-constr':
+        return [NonlinearConstraint(constraint_batch, 0.0, np.inf, jac=constraint_batch.jac_sparse)]
+    return [{'type': 'ineq', 'fun': constraint_batch, 'jac': constraint_batch.jac}]
+
+
+def _solver_options(optimization_method, max_iterations, show=False):
+    """Опции minimize: у trust-constr критерий останова gtol вместо ftol."""
+    if optimization_method == 'trust-constr':
+        return {'maxiter': max_iterations, 'gtol': 1e-9, 'disp': show}
+    return {'maxiter': max_iterations, 'ftol': 1e-9, 'disp': show}
+
+
+def _minimize_nlopt(fun, jac, x0, dt_bounds, constraint_batch, max_iterations):
+    """
+    SLSQP из nlopt (LD_SLSQP) с тем же интерфейсом результата, что у scipy minimize.
+    
+    Констрейнты пар - один векторный mconstraint: nlopt требует c(x) <= 0,
+    у constraint_batch знак обратный (>= 0). max_iterations ограничивает число вызовов целевой.
+    
+    Подзадача QP у LD_SLSQP при несовместных линеаризованных констрейнтах выдает NaN-итерации;
+    на первой такой точке решатель останавливается, результат - лучшая допустимая из пройденных.
+    """
+    # nlopt отвергает x0 вне границ (invalid_argument), scipy SLSQP молча проецирует - так же и здесь
+    x0 = np.clip(np.asarray(x0, dtype=np.float64), *dt_bounds)
+    n_constraints = len(constraint_batch(x0))
+    best = {'x': x0.copy(), 'fun': np.inf}
+    
+    def objective(x, grad):
+        if np.isnan(x).any():
+            opt.force_stop()
+            return np.inf
+        if grad.size > 0:
+            grad[:] = jac(x)
+        return fun(x)
+    
+    def pair_constraints(result, x, grad):
+        values = constraint_batch(x)
+        result[:] = -values
+        if grad.size > 0:
+            grad[:] = -constraint_batch.jac(x)
+        # Допустимая точка - кандидат в ответ (fun кэширован, повтор бесплатный)
+        if values.min() >= -NLOPT_CONSTRAINT_TOL:
+            value = fun(x)
+            if value < best['fun']:
+                best['x'], best['fun'] = x.copy(), value
+    
+    opt = nlopt.opt(nlopt.LD_SLSQP, len(x0))
+    opt.set_min_objective(objective)
+    opt.add_inequality_mconstraint(pair_constraints, np.full(n_constraints, NLOPT_CONSTRAINT_TOL))
+    opt.set_lower_bounds(np.full(len(x0), dt_bounds[0]))
+    opt.set_upper_bounds(np.full(len(x0), dt_bounds[1]))
+    opt.set_ftol_rel(1e-9)
+    opt.set_maxeval(max_iterations)
+    
+    try:
+        opt.optimize(x0)
+    except (nlopt.ForcedStop, nlopt.RoundoffLimited):
+        pass
+    status = opt.last_optimize_result()
+    
+    # MAXEVAL_REACHED / FORCED_STOP - не сходимость, но лучшая допустимая точка возвращается
+    success = status in (nlopt.SUCCESS, nlopt.STOPVAL_REACHED, nlopt.FTOL_REACHED, nlopt.XTOL_REACHED)
+    x = best['x']
+    return OptimizeResult(x=x, fun=fun(x), success=success, status=status,
+                          message=f"nlopt result code {status}",
+                          nit=opt.get_numevals(), nfev=opt.get_numevals())
+
+
+def _minimize(fun, jac, x0, optimization_method, dt_bounds, constraint_batch, max_iterations, show=False):
+    """
+    Запуск решателя: NLOPT_METHOD - nlopt (если установлен), иначе scipy minimize.
+    
+    Returns:
+        scipy OptimizeResult
+    """
+    if optimization_method == NLOPT_METHOD:
+        if nlopt is not None:
+            return _minimize_nlopt(fun, jac, x0, dt_bounds, constraint_batch, max_iterations)
+        if show:
+            print(f"nlopt не установлен - используется scipy SLSQP")
+        optimization_method = 'SLSQP'
+    
+    # Один векторный констрейнт на все пары, с аналитическим якобианом
+    # (для trust-constr - разреженным)
+    return minimize(
+        fun=fun,
+        x0=x0,
+        jac=jac,
+        method=optimization_method,
+        bounds=[(dt_bounds[0], dt_bounds[1]) for _ in range(len(x0))],
+        constraints=_scipy_constraints(constraint_batch, optimization_method),
+        options=_solver_options(optimization_method, max_iterations, show)
+    )
+
+
+def _run_slsqp(tree, pairs, pendulum, x0, constraint_distance, dt_bounds, max_iterations,
+               optimization_method, gradient):
+    """
+    Один запуск оптимизации площади из x0 для мультистарта.
+    
+    Evaluator и констрейнты строятся заново - функция самодостаточна и
+    выполняется в отдельном процессе. Градиент конечными разностями - последовательно.
+    
+    Returns:
+        scipy OptimizeResult или None при ошибке
+    """
+    try:
+        area_evaluator = TreeAreaEvaluator(tree)
+        constraint_batch, _ = create_distance_constraints(pairs, tree, pendulum, constraint_distance,
+                                                          area_evaluator=area_evaluator)
+        if constraint_batch is None:
+            return None
+        
+        if gradient == 'analytic':
+            jac = lambda x: -area_evaluator.area_gradient(x)
+        else:
+            jac = lambda x: _central_gradient(area_evaluator, x)
+        
+        return _minimize(_cached_negative_area(area_evaluator), jac, x0, optimization_method,
+                         dt_bounds, constraint_batch, max_iterations)
+    except Exception:
+        return None
+
 
 def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5, 
                       dt_bounds=(0.001, 0.1), max_iterations=1000, 
-                      optimization_method='SLSQP', show=False):
+                      optimization_method='SLSQP', gradient='analytic', n_workers=1,
+                      n_starts=1, workers=1, seed=42, show=False):
     """
     Оптимизирует площадь дерева спор при ограничениях на расстояния между парами.
     
@@ -21,7 +217,16 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
         constraint_distance: максимально допустимое расстояние в парах
         dt_bounds: границы для всех dt (min_dt, max_dt)
         max_iterations: максимальное количество итераций оптимизации
-        optimization_method: метод оптимизации ('SLSQP', 'L-BFGS-B', etc.)
+        optimization_method: метод оптимизации ('SLSQP', 'trust-constr', ...);
+                             для trust-constr якобиан констрейнтов передается разреженным;
+                             NLOPT_METHOD ('nlopt-SLSQP') - SLSQP из nlopt, если он установлен
+        gradient: 'analytic' - TreeAreaEvaluator.area_gradient,
+                  'central' - центральные разности (24 точки одним area_batch())
+        n_workers: число процессов для gradient='central' (1 - последовательно)
+        n_starts: число стартов; старт 0 - из времен дерева, остальные -
+                  случайные возмущения x0 * (1 + N(0, START_PERTURBATION))
+        workers: число процессов для дополнительных стартов (1 - последовательно)
+        seed: seed генератора возмущений стартовых точек
         show: вывод отладочной информации
         
     Returns:
@@ -32,7 +237,8 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
             'improvement': float - улучшение площади,
             'optimized_dt_vector': np.array - оптимальные времена [12],
             'optimized_tree': SporeTree - оптимизированное дерево,
-            'optimization_result': scipy result - полный результат scipy,
+            'optimization_result': scipy result - полный результат scipy (лучший старт),
+            'restarts': list - x0, fun, success, nit каждого старта,
             'constraint_violations': dict - нарушения констрейнтов
         }
         None при ошибке
@@ -57,6 +263,11 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
                 print("Ошибка: В дереве нет внуков")
             return None
         
+        if gradient not in ('analytic', 'central'):
+            if show:
+                print(f"Ошибка: Неизвестный способ градиента '{gradient}' (ожидается 'analytic' или 'central')")
+            return None
+        
         # ================================================================
         # СОЗДАНИЕ JIT-ОПТИМИЗИРОВАННОГО AREA EVALUATOR
         # ================================================================
@@ -72,9 +283,7 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
             area_evaluator = TreeAreaEvaluator(tree, show=show and False)
             
             # Получаем исходный dt_vector
-            original_dt_children = np.abs([child['dt'] for child in tree.children])
-            original_dt_grandchildren = np.abs([gc['dt'] for gc in tree.grandchildren])
-            original_dt_vector = np.hstack([original_dt_children, original_dt_grandchildren])
+            original_dt_vector = area_evaluator.tree_dt_vector(tree, out=np.empty(12))
             
             # Вычисляем исходную площадь
             original_area = area_evaluator.area(original_dt_vector)
@@ -95,25 +304,24 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
         if show:
             print("Создание констрейнтов расстояний...")
         
-        constraint_functions, constraint_info = create_distance_constraints(
-            pairs, tree, pendulum, constraint_distance, show=show and False
+        constraint_batch, constraint_info = create_distance_constraints(
+            pairs, tree, pendulum, constraint_distance, area_evaluator=area_evaluator, show=show and False
         )
         
-        if not constraint_functions:
+        if constraint_batch is None:
             if show:
                 print("Ошибка: Не удалось создать констрейнты")
             return None
         
-        # Преобразуем в формат scipy
-        scipy_constraints = [{'type': 'ineq', 'fun': func} for func in constraint_functions]
-        
         if show:
-            print(f"Создано {len(scipy_constraints)} констрейнтов")
+            print(f"Создано {len(constraint_info)} констрейнтов")
         
         # ================================================================
         # ПОДГОТОВКА JIT-ОПТИМИЗИРОВАННОЙ ЦЕЛЕВОЙ ФУНКЦИИ
         # ================================================================
         
+        cached_objective = _cached_negative_area(area_evaluator)
+        
         def objective_function(dt_vector):
             """
             JIT-оптимизированная целевая функция: -площадь (минимизируем для максимизации площади).
@@ -126,21 +334,25 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
             Returns:
                 float: -площадь дерева (для минимизации)
             """
-            try:
-                # TreeAreaEvaluator ожидает положительные dt и сам применяет знаки
-                dt_vector_abs = np.abs(dt_vector)
-                
-                # Быстрое вычисление площади через JIT-оптимизированный area_evaluator
-                area = area_evaluator.area(dt_vector_abs)
-                
-                # Возвращаем отрицательную площадь для минимизации
-                return -area
-                
-            except Exception as e:
-                # При ошибке возвращаем большое положительное число (плохая площадь)
-                if show:
-                    print(f"Ошибка в целевой функции: {e}")
-                return 1e6
+            # dt положительны по границам, знаки применяет TreeAreaEvaluator;
+            # повторные точки берутся из LRU-кэша, остальные - через JIT area_evaluator
+            return cached_objective(dt_vector)
+        
+        def analytic_gradient(dt_vector):
+            """
+            Аналитический градиент целевой функции: -d(площадь)/d(dt_vector).
+            Заменяет 12+ конечно-разностных вызовов area() на итерацию.
+            """
+            return -area_evaluator.area_gradient(dt_vector, show=show)
+        
+        # Пул для конечных разностей (gradient='central', n_workers > 1) - на время minimize
+        fd_executor = None
+        
+        def central_gradient(dt_vector):
+            """Градиент целевой функции центральными разностями (при n_workers > 1 - в процессах)."""
+            return _central_gradient(area_evaluator, dt_vector, fd_executor, n_workers)
+        
+        objective_jac = analytic_gradient if gradient == 'analytic' else central_gradient
         
         # ================================================================
         # НАЧАЛЬНОЕ ПРИБЛИЖЕНИЕ И ГРАНИЦЫ
@@ -149,14 +361,14 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
         # Начальное приближение: исходные времена дерева (уже вычислены выше)
         x0 = original_dt_vector.copy()
         
-        # Границы: все времена положительные
-        bounds = [(dt_bounds[0], dt_bounds[1]) for _ in range(12)]
-        
         if show:
             print(f"Начальное приближение: {x0}")
             print(f"Границы dt: {dt_bounds}")
             print(f"Метод оптимизации: {optimization_method}")
+            print(f"Градиент: {gradient}" + (f" ({n_workers} процессов)" if gradient == 'central' and n_workers > 1 else ""))
             print(f"Максимум итераций: {max_iterations}")
+            if n_starts > 1:
+                print(f"Стартов: {n_starts} (процессов: {workers})")
         
         # ================================================================
         # ТЕСТИРОВАНИЕ НАЧАЛЬНОГО ПРИБЛИЖЕНИЯ
@@ -177,7 +389,7 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
                 print(f"Проверка evaluator: OK")
             
             # Тестируем констрейнты
-            constraint_test = test_constraints(constraint_functions, x0, constraint_info, show=show and False)
+            constraint_test = test_constraints(constraint_batch, x0, constraint_info, show=show and False)
             satisfied_count = constraint_test.get('summary', {}).get('satisfied_count', 0)
             total_count = constraint_test.get('summary', {}).get('total_constraints', 0)
             print(f"Начальные констрейнты: {satisfied_count}/{total_count} выполнено")
@@ -189,22 +401,59 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
         if show:
             print(f"\nЗапуск оптимизации...")
         
-        # Настройки оптимизации
-        options = {
-            'maxiter': max_iterations,
-            'ftol': 1e-9,
-            'disp': show
-        }
-        
         # Запуск оптимизации
-        optimization_result = minimize(
-            fun=objective_function,
-            x0=x0,
-            method=optimization_method,
-            bounds=bounds,
-            constraints=scipy_constraints,
-            options=options
-        )
+        if gradient == 'central' and n_workers > 1:
+            fd_executor = ProcessPoolExecutor(max_workers=n_workers,
+                                              mp_context=multiprocessing.get_context('spawn'),
+                                              initializer=_init_fd_worker,
+                                              initargs=(area_evaluator,))
+        try:
+            optimization_result = _minimize(objective_function, objective_jac, x0, optimization_method,
+                                            dt_bounds, constraint_batch, max_iterations, show)
+        finally:
+            if fd_executor is not None:
+                fd_executor.shutdown()
+        
+        # ================================================================
+        # МУЛЬТИСТАРТ: ДОПОЛНИТЕЛЬНЫЕ ЗАПУСКИ ИЗ ВОЗМУЩЕННЫХ x0
+        # ================================================================
+        
+        restarts = [{'x0': x0, 'fun': float(optimization_result.fun),
+                     'success': bool(optimization_result.success), 'nit': optimization_result.get('nit')}]
+        
+        if n_starts > 1:
+            rng = np.random.default_rng(seed)
+            start_points = [np.clip(x0 * (1 + rng.normal(0, START_PERTURBATION, len(x0))), *dt_bounds)
+                            for _ in range(n_starts - 1)]
+            run = partial(_run_slsqp, tree, pairs, pendulum,
+                          constraint_distance=constraint_distance, dt_bounds=dt_bounds,
+                          max_iterations=max_iterations, optimization_method=optimization_method,
+                          gradient=gradient)
+            
+            if workers > 1:
+                # spawn: воркеры с fork зависают на выходе после Numba-ядер.
+                # Старт 0 уже прошел в этом процессе - ядра (cache=True) лежат в кэше Numba,
+                # воркеры загружают их с диска без компиляции
+                with multiprocessing.get_context('spawn').Pool(min(workers, len(start_points))) as pool:
+                    extra_results = pool.map(run, start_points)
+            else:
+                extra_results = [run(x_start) for x_start in start_points]
+            
+            for x_start, result in zip(start_points, extra_results):
+                if result is None:
+                    restarts.append({'x0': x_start, 'fun': None, 'success': False, 'nit': None})
+                    continue
+                restarts.append({'x0': x_start, 'fun': float(result.fun),
+                                 'success': bool(result.success), 'nit': result.get('nit')})
+                # Лучший из сошедшихся (или любой сошедшийся, если старт 0 не сошелся)
+                if result.success and (not optimization_result.success or result.fun < optimization_result.fun):
+                    optimization_result = result
+            
+            if show:
+                print(f"Мультистарт: {sum(r['success'] for r in restarts)}/{n_starts} сошлись")
+                for k, r in enumerate(restarts):
+                    area_str = f"{-r['fun']:.6f}" if r['fun'] is not None else "ошибка"
+                    print(f"  Старт {k}: площадь {area_str}, успех: {r['success']}")
         
         if show:
             print(f"Оптимизация завершена:")
@@ -247,14 +496,8 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
             dt_children_opt = np.abs(optimized_dt_vector[0:4])
             dt_grandchildren_opt = np.abs(optimized_dt_vector[4:12])
             
-            # Создаем оптимизированное дерево ОДИН РАЗ (не в циклах оптимизации!)
-            optimized_tree = tree.__class__(
-                pendulum=pendulum,
-                config=tree.config,
-                dt_children=dt_children_opt,
-                dt_grandchildren=dt_grandchildren_opt,
-                show=False
-            )
+            # Оптимизированное дерево из позиций evaluator - без повторной интеграции маятника
+            optimized_tree = area_evaluator.materialize(tree, optimized_dt_vector)
             
             if show:
                 print(f"Оптимизированное дерево создано")
@@ -269,7 +512,7 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
         # ================================================================
         
         constraint_violations = test_constraints(
-            constraint_functions, optimized_dt_vector, constraint_info, show=show and False
+            constraint_batch, optimized_dt_vector, constraint_info, show=show and False
         )
         
         if show:
@@ -277,7 +520,7 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
                            constraint_violations.get('summary', {}).get('satisfied_count', 0)
             
             print(f"\nПроверка финальных констрейнтов:")
-            print(f"  Нарушено: {violated_count}/{len(constraint_functions)}")
+            print(f"  Нарушено: {violated_count}/{len(constraint_info)}")
             
             if violated_count > 0:
                 print(f"  ВНИМАНИЕ: Есть нарушения констрейнтов!")
@@ -308,9 +551,10 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
             'optimized_dt_grandchildren': dt_grandchildren_opt,
             'optimized_tree': optimized_tree,
             'optimization_result': optimization_result,
+            'restarts': restarts,
             'constraint_violations': constraint_violations,
             'pairs_count': len(pairs),
-            'constraints_count': len(constraint_functions)
+            'constraints_count': len(constraint_info)
         }
         
     except Exception as e:
@@ -319,6 +563,46 @@ def optimize_tree_area(tree, pairs, pendulum, constraint_distance=1e-5,
         return None
 
 
+def optimize_tree_area_batch(trees, pairs_list, pendulum, workers=1, show=False, **optimize_kwargs):
+    """
+    Оптимизирует площадь для N независимых задач (tree, pairs).
+    
+    Задачи решаются optimize_tree_area по отдельности; при workers > 1 - в пуле процессов
+    (spawn), каждый воркер берет ядра Numba из дискового кэша один раз и решает
+    несколько задач подряд, так что импорт и прогрев JIT делятся между задачами.
+    
+    Args:
+        trees: список деревьев SporeTree
+        pairs_list: список пар для каждого дерева (той же длины, что trees)
+        pendulum: объект маятника
+        workers: число процессов (1 - последовательно в текущем процессе)
+        show: вывод сводки по пакету
+        **optimize_kwargs: остальные параметры optimize_tree_area (constraint_distance, dt_bounds, ...)
+        
+    Returns:
+        list: результаты optimize_tree_area в порядке trees (None для неудачных задач)
+    """
+    if len(trees) != len(pairs_list):
+        raise ValueError(f"trees и pairs_list разной длины: {len(trees)} != {len(pairs_list)}")
+    
+    run = partial(optimize_tree_area, pendulum=pendulum, show=False, **optimize_kwargs)
+    
+    if workers > 1 and len(trees) > 1:
+        n_procs = min(workers, len(trees))
+        # spawn: воркеры с fork зависают на выходе после Numba-ядер
+        with ProcessPoolExecutor(max_workers=n_procs, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = list(executor.map(run, trees, pairs_list,
+                                        chunksize=max(1, len(trees) // (4 * n_procs))))
+    else:
+        results = [run(tree, pairs) for tree, pairs in zip(trees, pairs_list)]
+    
+    if show:
+        n_success = sum(1 for r in results if r and r['success'])
+        print(f"Пакетная оптимизация: {n_success}/{len(trees)} задач сошлись")
+    
+    return results
+
+
 def compare_optimization_results(original_tree, optimization_result, show=False):
     """
     Сравнивает исходное и оптимизированное дерево.
@@ -1,38 +1,130 @@
+import copy
 import numpy as np
-from numba import jit
+from numba import njit, prange, float64, int32
+from numba.types import UniTuple
 
-@jit(nopython=True, cache=True, fastmath=True)
-def _calculate_total_area_numba(root_pos, children_pos, grandchildren_pos, parent_indices):
+
+@njit(inline='always', fastmath=True, cache=True)
+def _rk4_scalar(th, om, u, dt, g, l, c, inv_ml2):
+    """RK4-шаг маятника на скалярах (те же формулы, что PendulumSystem._rk4_step) -> (th, om)."""
+    k1t, k1o = om, -g / l * np.sin(th) - c * om + u * inv_ml2
+    k2t, k2o = om + 0.5 * dt * k1o, -g / l * np.sin(th + 0.5 * dt * k1t) - c * (om + 0.5 * dt * k1o) + u * inv_ml2
+    k3t, k3o = om + 0.5 * dt * k2o, -g / l * np.sin(th + 0.5 * dt * k2t) - c * (om + 0.5 * dt * k2o) + u * inv_ml2
+    k4t, k4o = om + dt * k3o,       -g / l * np.sin(th + dt * k3t)       - c * (om + dt * k3o)       + u * inv_ml2
+    return (th + (dt / 6.0) * (k1t + 2 * k2t + 2 * k3t + k4t),
+            om + (dt / 6.0) * (k1o + 2 * k2o + 2 * k3o + k4o))
+
+
+def _area_vec(root, parents_per_gc, gcs):
+    """
+    Площадь дерева одним NumPy-выражением: сумма треугольников root-parent-grandchild
+    через векторное произведение, без JIT (и без его прогрева на первом вызове).
+    
+    Args:
+        root: (2,) позиция корня
+        parents_per_gc: (N, 2) позиции родителей каждого внука (children_positions[parent_idx])
+        gcs: (N, 2) позиции внуков
+        
+    Returns:
+        float: общая площадь дерева
+    """
+    d2 = parents_per_gc - root
+    d3 = gcs - root
+    return float(0.5 * np.abs(d2[:, 0] * d3[:, 1] - d3[:, 0] * d2[:, 1]).sum())
+
+# Форма дерева фиксирована (проверяется в TreeAreaEvaluator.__init__): глобальные константы
+# для numba - compile-time, циклы ниже получают известное число итераций и разворачиваются
+N_CHILDREN = 4
+N_GRANDCHILDREN = 8
+
+
+@njit(inline='always', fastmath=True, cache=True)
+def _tree_area_inplace(r0, r1, controls_c, dts_c, controls_gc, dts_gc, parent_idx,
+                       g, l, c, inv_ml2, children_out, grandchildren_out):
+    """
+    Шаги детей и внуков одного дерева с записью позиций на место и площадь.
+    
+    Единственная реализация площади для JIT-ядер модуля (_propagate_and_area, _eval_tree_batch):
+    одна и та же арифметика при одиночной и пакетной оценке.
+    """
+    for i in range(N_CHILDREN):
+        children_out[i, 0], children_out[i, 1] = _rk4_scalar(r0, r1, controls_c[i], dts_c[i], g, l, c, inv_ml2)
+    
+    # Сумма |d2 x d3| (d2 = родитель - корень, d3 = внук - корень), множитель 0.5 - один раз в конце.
+    # Позиция родителя уже в регистрах (старт RK4 внука) - отдельный gather не нужен
+    cross_sum = 0.0
+    for i in range(N_GRANDCHILDREN):
+        p20, p21 = children_out[parent_idx[i], 0], children_out[parent_idx[i], 1]
+        p30, p31 = _rk4_scalar(p20, p21, controls_gc[i], dts_gc[i], g, l, c, inv_ml2)
+        grandchildren_out[i, 0], grandchildren_out[i, 1] = p30, p31
+        
+        cross_sum += abs((p20 - r0) * (p31 - r1) - (p30 - r0) * (p21 - r1))
+    
+    return 0.5 * cross_sum
+
+
+@njit(float64(float64[::1],                              # root_pos
+              float64[::1], float64[::1],                # controls_c, dts_c
+              float64[::1], float64[::1], int32[::1],    # controls_gc, dts_gc, parent_idx
+              UniTuple(float64, 4),                      # params = (g, l, c, inv_ml2)
+              float64[:, ::1], float64[:, ::1]),         # children_out, grandchildren_out
+      cache=True, fastmath=True, boundscheck=False)
+def _propagate_and_area(root_pos, controls_c, dts_c, controls_gc, dts_gc, parent_idx, params,
+                        children_out, grandchildren_out):
     """
-    JIT-компилированная функция для быстрого расчета общей площади дерева.
+    Полная оценка дерева одним JIT-вызовом: шаги детей, шаги внуков и площадь.
     
-    Вычисляет сумму площадей треугольников root-child-grandchild для всех внуков.
+    Площадь - сумма треугольников root-child-grandchild (как в get_tree_area),
+    накапливается сразу при расчете внука, без отдельного прохода.
+    
+    Все массивы - C-contiguous float64 (parent_idx - int32): сигнатура явная,
+    ядро компилируется при импорте под одну раскладку памяти.
     
     Args:
-        root_pos: np.array([theta, theta_dot]) - позиция корня
-        children_pos: np.array((4, 2)) - позиции детей  
-        grandchildren_pos: np.array((8, 2)) - позиции внуков
-        parent_indices: np.array([0,0,1,1,2,2,3,3]) - индексы родителей для каждого внука
+        root_pos: (2,) позиция корня
+        controls_c, dts_c: (4,) управления и знаковые dt детей
+        controls_gc, dts_gc: (8,) управления и знаковые dt внуков
+        parent_idx: (8,) индексы родителей внуков
+        params: pendulum.get_params() - (g, l, damping, 1/(m*l^2))
+        children_out: (4, 2) буфер для позиций детей (заполняется на месте)
+        grandchildren_out: (8, 2) буфер для позиций внуков (заполняется на месте)
         
     Returns:
         float: общая площадь дерева
     """
-    total_area = 0.0
-    num_grandchildren = grandchildren_pos.shape[0]
+    # Параметры маятника распаковываются один раз - дальше только скаляры в регистрах
+    g, l, c, inv_ml2 = params
+    return _tree_area_inplace(root_pos[0], root_pos[1], controls_c, dts_c, controls_gc, dts_gc, parent_idx,
+                              g, l, c, inv_ml2, children_out, grandchildren_out)
 
-    for i in range(num_grandchildren):
-        # Треугольник: корень -> родитель -> внук
-        p1 = root_pos
-        p2 = children_pos[parent_indices[i]]
-        p3 = grandchildren_pos[i]
 
-        # Площадь треугольника через векторное произведение
-        area = 0.5 * abs(p1[0] * (p2[1] - p3[1]) + 
-                        p2[0] * (p3[1] - p1[1]) + 
-                        p3[0] * (p1[1] - p2[1]))
-        total_area += area
+@njit(cache=True, parallel=True, fastmath=True)
+def _eval_tree_batch(roots, ctrls_c, dts_c, ctrls_gc, dts_gc, pidx, params):
+    """
+    Площади N деревьев одним JIT-вызовом (prange по деревьям) - та же сумма, что _propagate_and_area.
+    
+    Массивы структуры могут быть broadcast-видами (нулевой шаг по деревьям),
+    поэтому сигнатура не фиксируется: N оценок одного дерева не копируют его структуру.
+    
+    Args:
+        roots: (N, 2) позиции корней
+        ctrls_c, dts_c: (N, 4) управления и знаковые dt детей
+        ctrls_gc, dts_gc: (N, 8) управления и знаковые dt внуков
+        pidx: (N, 8) индексы родителей внуков
+        params: pendulum.get_params() - (g, l, damping, 1/(m*l^2))
         
-    return total_area
+    Returns:
+        np.array (N,): площади деревьев
+    """
+    g, l, c, inv_ml2 = params
+    n_trees = dts_c.shape[0]
+    areas = np.empty(n_trees)
+    children = np.empty((n_trees, N_CHILDREN, 2))
+    grandchildren = np.empty((n_trees, N_GRANDCHILDREN, 2))
+    for b in prange(n_trees):
+        areas[b] = _tree_area_inplace(roots[b, 0], roots[b, 1], ctrls_c[b], dts_c[b], ctrls_gc[b], dts_gc[b],
+                                      pidx[b], g, l, c, inv_ml2, children[b], grandchildren[b])
+    return areas
 
 
 class TreeAreaEvaluator:
@@ -62,100 +154,235 @@ class TreeAreaEvaluator:
             raise ValueError("Дерево должно иметь созданных детей")
         if not hasattr(tree, '_grandchildren_created') or not tree._grandchildren_created:
             raise ValueError("Дерево должно иметь созданных внуков")
+        # Форма dt_vector [4 + 8] проверяется здесь один раз, а не на каждом вызове area()
+        if len(tree.children) != N_CHILDREN or len(tree.grandchildren) != N_GRANDCHILDREN:
+            raise ValueError(f"Ожидается дерево 4 детей + 8 внуков, получено "
+                             f"{len(tree.children)} + {len(tree.grandchildren)}")
         
         # Сохраняем ссылки на основные объекты
         self.pendulum = tree.pendulum
-        self.root_position = tree.root['position'].copy()
-        
-        # Извлекаем структурную информацию (не меняется при оптимизации)
-        self.children_info = []
-        for child in tree.children:
-            self.children_info.append({
-                'control': child['control'],
-                'dt_sign': np.sign(child['dt'])  # +1 для forward, -1 для backward
-            })
-        
-        self.grandchildren_info = []
-        for gc in tree.grandchildren:
-            self.grandchildren_info.append({
-                'parent_idx': gc['parent_idx'],
-                'control': gc['control'], 
-                'dt_sign': np.sign(gc['dt'])  # +1 для forward, -1 для backward
-            })
-        
-        # Маппинг внук -> родитель для numba (константный массив)
-        self.parent_indices = np.array([gc['parent_idx'] for gc in tree.grandchildren], dtype=np.int32)
-        
-        # Кэш для позиций (переиспользуем массивы)
-        self.children_positions = np.zeros((len(self.children_info), 2))
-        self.grandchildren_positions = np.zeros((len(self.grandchildren_info), 2))
+        self.params = tuple(float(p) for p in tree.pendulum.get_params())
+        self.root_position = np.asarray(tree.root['position'], dtype=np.float64).copy()
+        
+        # Структурная информация (не меняется при оптимизации) - параллельными массивами (SoA),
+        # без словарей: передается в JIT-ядро как есть
+        self.children_control = np.asarray([child['control'] for child in tree.children], dtype=np.float64)
+        self.children_dt_sign = np.asarray([np.sign(child['dt']) for child in tree.children], dtype=np.float64)  # +1 forward, -1 backward
+        self.gc_control = np.asarray(tree.gc_controls, dtype=np.float64).copy()
+        self.gc_dt_sign = np.asarray(tree.gc_sign_dt, dtype=np.float64).copy()  # +1 forward, -1 backward
+        self.gc_parent_idx = np.asarray(tree.gc_parent_idx, dtype=np.int32).copy()  # внук -> родитель
+        # Знаки для всего dt_vector [4 детей + 8 внуков]: знаковые времена одним умножением
+        self.dt_sign = np.concatenate([self.children_dt_sign, self.gc_dt_sign])
+        
+        # Кэш для позиций (переиспользуем массивы).
+        # Только float64: площади оптимизированных деревьев ~1e-9 при координатах ~pi, а float32
+        # (eps ~1e-7) уже при хранении позиций дает ошибку площади ~2% на эталонном дереве
+        self.children_positions = np.zeros((N_CHILDREN, 2), dtype=np.float64, order='C')
+        self.grandchildren_positions = np.zeros((N_GRANDCHILDREN, 2), dtype=np.float64, order='C')
+        
+        # Последняя точка: площадь и позиции в буферах соответствуют этому dt_vector
+        # (целевая функция и констрейнты SLSQP запрашивают один и тот же x)
+        self._last_dt = None
+        self._last_area = None
+        
+        # Буфер для dt_vector, собранного из дерева (tree_dt_vector)
+        self._dt_buf = np.empty(len(self.children_control) + len(self.gc_control))
         
         if show:
             print(f"TreeAreaEvaluator создан:")
-            print(f"  Детей: {len(self.children_info)}")
-            print(f"  Внуков: {len(self.grandchildren_info)}")
+            print(f"  Детей: {len(self.children_control)}")
+            print(f"  Внуков: {len(self.gc_control)}")
     
     def area(self, dt_vector, show=False):
         """
         Вычисляет общую площадь дерева при заданных временах.
         
         Args:
-            dt_vector: np.array из 12 элементов [4 dt детей + 8 dt внуков]
+            dt_vector: np.array из 12 элементов [4 dt детей + 8 dt внуков], dt >= 0
+                       (знаки направлений хранятся в evaluator; границы оптимизатора положительные)
             show: вывод отладочной информации
             
         Returns:
             float: общая площадь дерева
         """
-        try:
-            dt_vector = np.asarray(dt_vector).ravel()
-            
-            if len(dt_vector) != 12:
-                raise ValueError(f"dt_vector должен содержать 12 элементов, получено {len(dt_vector)}")
-            
-            # Извлекаем времена (всегда положительные)
-            dt_children = np.abs(dt_vector[0:4])
-            dt_grandchildren = np.abs(dt_vector[4:12])
-            
-            if show:
-                print(f"Вычисление площади для dt_vector: {dt_vector}")
-            
-            # Обновляем позиции детей
-            for i, child_info in enumerate(self.children_info):
-                dt_signed = dt_children[i] * child_info['dt_sign']
-                self.children_positions[i] = self.pendulum.step(
-                    self.root_position, 
-                    child_info['control'], 
-                    dt_signed
-                )
-            
-            # Обновляем позиции внуков
-            for i, gc_info in enumerate(self.grandchildren_info):
-                parent_pos = self.children_positions[gc_info['parent_idx']]
-                dt_signed = dt_grandchildren[i] * gc_info['dt_sign']
-                self.grandchildren_positions[i] = self.pendulum.step(
-                    parent_pos,
-                    gc_info['control'],
-                    dt_signed
-                )
-            
-            # Вычисляем общую площадь через JIT
-            total_area = _calculate_total_area_numba(
-                self.root_position,
-                self.children_positions,
-                self.grandchildren_positions,
-                self.parent_indices
-            )
-            
-            if show:
-                print(f"Вычисленная площадь: {total_area:.6f}")
+        # Форма проверяется один раз при создании evaluator: dt_vector неверной длины
+        # не согласуется с self.dt_sign, и умножение ниже бросит ValueError
+        dt_vector = np.asarray(dt_vector, dtype=np.float64).ravel()
+        
+        if show:
+            print(f"Вычисление площади для dt_vector: {dt_vector}")
+            if np.any(dt_vector < 0):
+                print(f"ВНИМАНИЕ: отрицательные dt в dt_vector - ожидаются только положительные времена")
+        
+        key = dt_vector.tobytes()
+        if key == self._last_dt:
+            return self._last_area
+        
+        # Знаковые времена (forward/backward) одним умножением
+        dts_signed = dt_vector * self.dt_sign
+        
+        # Позиции детей и внуков (в кэш-буферы) и площадь - одним JIT-вызовом
+        total_area = _propagate_and_area(
+            self.root_position,
+            self.children_control,
+            dts_signed[:N_CHILDREN],
+            self.gc_control,
+            dts_signed[N_CHILDREN:],
+            self.gc_parent_idx,
+            self.params,
+            self.children_positions,
+            self.grandchildren_positions
+        )
+        
+        if show:
+            print(f"Вычисленная площадь: {total_area:.6f}")
+        
+        self._last_dt, self._last_area = key, total_area
+        return total_area
+    
+    def area_batch(self, dt_matrix):
+        """
+        Площади дерева для пачки dt_vector (S, 12) одним параллельным JIT-вызовом.
+        
+        Буферы позиций и кэш последней точки area() не трогаются.
+        
+        Args:
+            dt_matrix: (S, 12) |dt| [4 детей + 8 внуков] в каждой строке
             
-            return total_area
+        Returns:
+            np.array (S,): площади
+        """
+        dts_signed = np.asarray(dt_matrix, dtype=np.float64).reshape(-1, len(self.dt_sign)) * self.dt_sign
+        n = dts_signed.shape[0]
+        return _eval_tree_batch(
+            np.broadcast_to(self.root_position, (n, 2)),
+            np.broadcast_to(self.children_control, (n, N_CHILDREN)),
+            dts_signed[:, :N_CHILDREN],
+            np.broadcast_to(self.gc_control, (n, N_GRANDCHILDREN)),
+            dts_signed[:, N_CHILDREN:],
+            np.broadcast_to(self.gc_parent_idx, (n, N_GRANDCHILDREN)),
+            self.params
+        )
+    
+    def tree_dt_vector(self, tree, out=None):
+        """
+        |dt| детей и внуков дерева в формате dt_vector [4 dt детей + 8 dt внуков].
+        Заполняет out (по умолчанию - внутренний буфер evaluator) на месте, без hstack.
+        """
+        out = self._dt_buf if out is None else out
+        n_children = len(tree.children)
+        for i, child in enumerate(tree.children):
+            out[i] = abs(child['dt'])
+        for j, gc in enumerate(tree.grandchildren):
+            out[n_children + j] = abs(gc['dt'])
+        return out
+    
+    def positions(self, dt_vector):
+        """
+        Позиции внуков (8, 2) при заданных временах - из того же прохода, что и area().
+        Если площадь в этой точке уже считалась, дерево повторно не интегрируется.
+        
+        Возвращается буфер evaluator: он перезаписывается следующим вызовом с другим dt_vector.
+        """
+        self.area(dt_vector)
+        return self.grandchildren_positions
+
+    def materialize(self, tree_prototype, dt_vector):
+        """
+        Дерево с временами dt_vector из позиций evaluator - без повторной интеграции маятника.
+
+        Поверхностная копия tree_prototype (того же дерева, из которого создан evaluator):
+        структура, сортировка и карта пар общие, а словари детей/внуков и SoA-буферы - новые,
+        с position/dt из последнего прохода area(). Прототип не изменяется.
+
+        Args:
+            tree_prototype: SporeTree, по которому создан evaluator
+            dt_vector: np.array из 12 элементов [4 dt детей + 8 dt внуков], dt >= 0
+
+        Returns:
+            SporeTree: дерево с позициями при dt_vector
+        """
+        # Позиции в буферах соответствуют последней точке - при совпадении это попадание в кэш.
+        # Знаковые времена - тем же умножением, что и в area(), чтобы dt совпадали с позициями
+        self.area(dt_vector)
+        dts_signed = np.asarray(dt_vector, dtype=np.float64).ravel() * self.dt_sign
+
+        tree = copy.copy(tree_prototype)
+        tree.children = [
+            dict(child, position=self.children_positions[i].copy(), dt=dts_signed[i])
+            for i, child in enumerate(tree_prototype.children)
+        ]
+        tree.grandchildren = [
+            dict(gc, position=self.grandchildren_positions[j].copy(),
+                 dt=dts_signed[N_CHILDREN + j], dt_abs=abs(dts_signed[N_CHILDREN + j]))
+            for j, gc in enumerate(tree_prototype.grandchildren)
+        ]
+        # sorted_grandchildren ссылается на те же словари, что и grandchildren
+        tree.sorted_grandchildren = [tree.grandchildren[gc['global_idx']]
+                                     for gc in tree_prototype.sorted_grandchildren]
+
+        # SoA-буферы пишутся на месте в update_positions - у копии свои
+        tree.gc_positions = self.grandchildren_positions.copy()
+        tree.gc_controls = tree_prototype.gc_controls.copy()
+        tree.gc_parent_idx = tree_prototype.gc_parent_idx.copy()
+        tree.gc_sign_dt = tree_prototype.gc_sign_dt.copy()
+        tree.gc_dts = dts_signed[N_CHILDREN:].copy()
+        tree.child_positions = self.children_positions.copy()
+        tree.child_controls = tree_prototype.child_controls.copy()
+        tree.child_dts = dts_signed[:N_CHILDREN].copy()
+
+        if tree._grandchildren_sorted:
+            tree.calculate_mean_points(show=False)
+        return tree
+
+    def area_gradient(self, dt_vector, show=False):
+        """
+        Аналитический градиент площади по dt_vector (цепное правило через RK4-шаги).
+        
+        dA/dp из векторного произведения треугольника root-parent-grandchild, 
+        dp/ddt - касательные pendulum.batch_step_jvp: своя для внука и
+        перенесенная через шаг внука касательная родителя для dt детей.
+        
+        Args:
+            dt_vector: np.array из 12 элементов [4 dt детей + 8 dt внуков]
+            show: вывод отладочной информации
             
-        except Exception as e:
-            if show:
-                print(f"Ошибка вычисления площади: {e}")
-            # При ошибке возвращаем 0 (плохая площадь)
-            return 0.0
+        Returns:
+            np.array (12,): dA/d(dt_vector)
+        """
+        dt_vector = np.asarray(dt_vector, dtype=np.float64).ravel()
+        
+        dts_signed = dt_vector * self.dt_sign
+        dts_c, dts_gc = dts_signed[:N_CHILDREN], dts_signed[N_CHILDREN:]
+        
+        # Дети и их производные по своему dt
+        children_pos, children_sens = self.pendulum.batch_step_jvp(
+            np.tile(self.root_position, (N_CHILDREN, 1)), self.children_control, dts_c,
+            np.zeros((N_CHILDREN, 2)), self.children_dt_sign)
+        
+        # Внуки: производная по своему dt и перенос производной родителя по dt ребенка
+        parent_pos = children_pos[self.gc_parent_idx]
+        gc_pos, gc_sens = self.pendulum.batch_step_jvp(
+            parent_pos, self.gc_control, dts_gc, np.zeros((N_GRANDCHILDREN, 2)), self.gc_dt_sign)
+        _, gc_parent_sens = self.pendulum.batch_step_jvp(
+            parent_pos, self.gc_control, dts_gc, children_sens[self.gc_parent_idx], np.zeros(N_GRANDCHILDREN))
+        
+        # A = sum 0.5 * |d2 x d3|, d2 = parent - root, d3 = gc - root
+        d2 = parent_pos - self.root_position
+        d3 = gc_pos - self.root_position
+        half_sign = 0.5 * np.sign(d2[:, 0] * d3[:, 1] - d3[:, 0] * d2[:, 1])
+        
+        grad = np.zeros(N_CHILDREN + N_GRANDCHILDREN)
+        # d(cross)/d(gc) = (-d2y, d2x)
+        grad[N_CHILDREN:] = half_sign * (-d2[:, 1] * gc_sens[:, 0] + d2[:, 0] * gc_sens[:, 1])
+        # d(cross)/d(parent) = (d3y, -d3x) + путь через внука
+        via_parent = half_sign * (d3[:, 1] * children_sens[self.gc_parent_idx, 0]
+                                  - d3[:, 0] * children_sens[self.gc_parent_idx, 1]
+                                  - d2[:, 1] * gc_parent_sens[:, 0]
+                                  + d2[:, 0] * gc_parent_sens[:, 1])
+        np.add.at(grad, self.gc_parent_idx, via_parent)
+        
+        return grad
     
     def test_area_calculation(self, tree, show=False):
         """
@@ -170,9 +397,7 @@ class TreeAreaEvaluator:
         """
         try:
             # Получаем исходный dt_vector из дерева
-            dt_children = np.abs([child['dt'] for child in tree.children])
-            dt_grandchildren = np.abs([gc['dt'] for gc in tree.grandchildren])
-            original_dt_vector = np.hstack([dt_children, dt_grandchildren])
+            original_dt_vector = self.tree_dt_vector(tree)
             
             # Вычисляем площадь через evaluator
             evaluator_area = self.area(original_dt_vector, show=False)
@@ -1,3 +1,8 @@
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import numpy as np
 from src.spore_tree_config import SporeTreeConfig
 from src.spore_tree import SporeTree
@@ -7,12 +12,52 @@ from src.pairs.create_tree_from_pairs import create_tree_from_pairs
 from src.area_opt.optimize_tree_area import optimize_tree_area
 
 
+# LRU-кэш результатов пайплайна: ключ -> оптимальный вектор dt (только для чтения)
+_DT_VECTOR_CACHE = OrderedDict()
+DT_VECTOR_CACHE_SIZE = 4096
+
+
+# Поля конфига, которые читает пайплайн; поля отрисовки и отладки на результат не влияют
+_DT_VECTOR_CACHE_CONFIG_FIELDS = ('dt_base', 'dt_grandchildren_factor', 'dt_bounds', 'epsilon',
+                                  'max_iterations', 'optimization_method', 'tolerance')
+
+
+def _cache_value(value):
+    """Хешируемое значение для ключа кэша: последовательности и массивы (например, dt_bounds из YAML) - кортежи."""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(np.ravel(value).tolist())
+    return value
+
+
+def _dt_vector_cache_key(initial_position, pendulum, config, constraint_distance, area_dt_bounds, cache_grid):
+    """
+    Ключ кэша по значениям (не по id): позиция корня, округленная до сетки cache_grid
+    (None - до 10 знаков), параметры маятника, поля конфига, которые читает пайплайн, и границы.
+    """
+    position = np.asarray(initial_position, dtype=np.float64)
+    if cache_grid is None:
+        position = np.round(position, 10)
+    else:
+        position = np.round(position / cache_grid) * cache_grid
+    pendulum_key = (*pendulum.get_params(), pendulum.max_control)
+    config_key = tuple((name, _cache_value(getattr(config, name))) for name in _DT_VECTOR_CACHE_CONFIG_FIELDS)
+    return (tuple(position.tolist()), pendulum_key, config_key,
+            float(constraint_distance), _cache_value(area_dt_bounds))
+
+
+def clear_dt_vector_cache():
+    """Очищает кэш find_optimal_dt_vector."""
+    _DT_VECTOR_CACHE.clear()
+
+
 def find_optimal_dt_vector(initial_position, 
                           pendulum=None,
                           config=None,
                           constraint_distance=None,
                           area_optimization_dt_bounds=None,
-                          show=False):
+                          show=False,
+                          use_cache=True,
+                          cache_grid=None):
     """
     Находит оптимальный вектор времен dt через полный пайплайн оптимизации.
     
@@ -29,6 +74,9 @@ def find_optimal_dt_vector(initial_position,
         constraint_distance: float - максимальное расстояние между парами (если None, берет 1e-4)
         area_optimization_dt_bounds: tuple - границы dt для оптимизации площади (если None, берет config.dt_bounds)
         show: bool - вывод отладочной информации
+        use_cache: bool - брать результат из LRU-кэша, если пайплайн уже запускался с теми же входами
+        cache_grid: float - шаг сетки для позиции в ключе кэша (None - совпадение до 1e-10);
+                    например 1e-6 переиспользует результат для почти совпадающих стартов
         
     Returns:
         np.array: оптимальный вектор dt из 12 элементов [4 детей + 8 внуков]
@@ -92,6 +140,17 @@ def find_optimal_dt_vector(initial_position,
             print(f"  max_iterations: {max_iterations}")
             print(f"  optimization_method: {optimization_method}")
         
+        # Пайплайн детерминирован по входам - повторный запрос отдаем из кэша
+        if use_cache:
+            cache_key = _dt_vector_cache_key(initial_position, pendulum, config,
+                                             constraint_distance, area_dt_bounds, cache_grid)
+            cached = _DT_VECTOR_CACHE.get(cache_key)
+            if cached is not None:
+                _DT_VECTOR_CACHE.move_to_end(cache_key)
+                if show:
+                    print("Результат взят из кэша")
+                return cached.copy()
+        
         # ================================================================
         # ЭТАП 1: СОЗДАНИЕ ИСХОДНОГО ДЕРЕВА
         # ================================================================
@@ -117,7 +176,8 @@ def find_optimal_dt_vector(initial_position,
         
         pairs = find_optimal_pairs(tree, show=show)
         
-        if pairs is None:
+        # Пустой список - тот же отказ: без пар нет ни новых времен, ни констрейнтов площади
+        if not pairs:
             if show:
                 print("ОШИБКА: Не удалось найти оптимальные пары!")
             return None
@@ -133,7 +193,8 @@ def find_optimal_dt_vector(initial_position,
         if show:
             print(f"\nЭтап 3: Создание дерева из пар...")
         
-        result = create_tree_from_pairs(tree, pendulum, config, show=show and False)
+        # Пары уже найдены на этапе 2 - не ищем их повторно
+        result = create_tree_from_pairs(tree, pendulum, config, show=show and False, pairs=pairs)
         
         if not result or not result['success']:
             if show:
@@ -178,6 +239,13 @@ def find_optimal_dt_vector(initial_position,
         
         optimal_dt_vector = optimization_result['optimized_dt_vector']
         
+        if use_cache:
+            cached = np.array(optimal_dt_vector, dtype=np.float64)
+            cached.flags.writeable = False
+            _DT_VECTOR_CACHE[cache_key] = cached
+            if len(_DT_VECTOR_CACHE) > DT_VECTOR_CACHE_SIZE:
+                _DT_VECTOR_CACHE.popitem(last=False)
+        
         if show:
             print(f"\nОПТИМИЗАЦИЯ ЗАВЕРШЕНА УСПЕШНО!")
             print(f"Оптимальные времена найдены:")
@@ -193,4 +261,64 @@ def find_optimal_dt_vector(initial_position,
             print(f"КРИТИЧЕСКАЯ ОШИБКА в find_optimal_dt_vector: {e}")
             import traceback
             traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+
+
+def find_optimal_dt_vectors_batch(positions,
+                                  pendulum=None,
+                                  config=None,
+                                  constraint_distance=None,
+                                  area_optimization_dt_bounds=None,
+                                  workers=1,
+                                  cache_grid=None,
+                                  show=False):
+    """
+    Пакетный find_optimal_dt_vector для M начальных позиций.
+    
+    Совпадающие (с точностью cache_grid) позиции считаются один раз. Задачи независимы:
+    при workers > 1 они решаются в пуле процессов (spawn), иначе - последовательно
+    с LRU-кэшем find_optimal_dt_vector.
+    
+    Args:
+        positions: np.array (M, 2) - начальные позиции [theta, theta_dot]
+        pendulum, config, constraint_distance, area_optimization_dt_bounds: как в find_optimal_dt_vector
+        workers: число процессов (1 - последовательно в текущем процессе)
+        cache_grid: шаг сетки для отождествления позиций (None - совпадение до 1e-10)
+        show: вывод сводки по пакету
+        
+    Returns:
+        list: M векторов dt (или None для неудачных позиций) в порядке positions
+    """
+    positions = np.atleast_2d(np.asarray(positions, dtype=np.float64))
+    if positions.ndim != 2 or positions.shape[1] != 2:
+        raise ValueError(f"positions должен иметь форму (M, 2), получено: {positions.shape}")
+    
+    if pendulum is None:
+        pendulum = PendulumSystem(g=9.81, l=2.0, m=1.0, damping=0.05, max_control=2.0)
+    
+    # Уникальные позиции на сетке ключа кэша
+    keys = np.round(positions, 10) if cache_grid is None else np.round(positions / cache_grid) * cache_grid
+    _, unique_idx, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    unique_positions = positions[unique_idx]
+    
+    run = partial(find_optimal_dt_vector, pendulum=pendulum, config=config,
+                  constraint_distance=constraint_distance,
+                  area_optimization_dt_bounds=area_optimization_dt_bounds,
+                  cache_grid=cache_grid, show=False)
+    
+    if workers > 1 and len(unique_positions) > 1:
+        n_procs = min(workers, len(unique_positions))
+        # spawn: воркеры с fork зависают на выходе после Numba-ядер
+        with ProcessPoolExecutor(max_workers=n_procs, mp_context=multiprocessing.get_context('spawn')) as executor:
+            unique_results = list(executor.map(run, unique_positions,
+                                               chunksize=max(1, len(unique_positions) // (4 * n_procs))))
+    else:
+        unique_results = [run(position) for position in unique_positions]
+    
+    results = [None if unique_results[k] is None else unique_results[k].copy() for k in inverse.ravel()]
+    
+    if show:
+        n_success = sum(1 for r in results if r is not None)
+        print(f"Пакетный поиск dt: {n_success}/{len(results)} позиций, уникальных {len(unique_positions)}")
+    
+    return results
@@ -25,17 +25,15 @@ def universal_loss(X: np.ndarray,
     
     # Применяем маску разрешенных пар, если она есть
     if pairing_map:
-        # Создаем маску запретов: True, если пара ЗАПРЕЩЕНА
-        forbidden_mask = np.ones_like(C, dtype=bool)
-        for i in range(N):
-            # Важно: получаем копию, чтобы не изменять исходный словарь в дереве
-            allowed_partners = pairing_map.get(i, []).copy()
-            # Разрешаем самого себя (потом запретим диагональю)
-            allowed_partners.append(i)
-            forbidden_mask[i, allowed_partners] = False
-        
-        # Применяем маску
-        C[forbidden_mask] = 1e6
+        # Начинаем с барьера и переписываем только разрешенные клетки (без NxN маски).
+        # Диагональ разрешена для всех строк (потом запретим через forbid_self)
+        rows, cols = list(range(N)), list(range(N))
+        for i, partners in pairing_map.items():
+            rows.extend([i] * len(partners))
+            cols.extend(partners)
+        C_masked = np.full_like(C, 1e6)
+        C_masked[rows, cols] = C[rows, cols]
+        C = C_masked
 
     if loss_cfg.forbid_self:
         np.fill_diagonal(C, 1e6)
@@ -44,24 +42,19 @@ def universal_loss(X: np.ndarray,
     P = sinkhorn(C, sk_cfg)
 
     # 1) тянем парные расстояния
-    L_pull = float((P * C).sum())
+    L_pull = float(np.einsum('ij,ij->', P, C))  # без временного NxN массива P*C
 
-    # 2) отталкиваем от третьих (margin)
-    L_push = 0.0
-    for i in range(N):
-        for j in range(N):
-            if i == j: 
-                continue
-            pij = P[i, j]
-            if pij <= 1e-12: 
-                continue
-            dij = np.sqrt(C[i, j])
-            # усредненный hinge по третьим
-            for k in range(N):
-                if k == i or k == j: 
-                    continue
-                dik = np.sqrt(C[i, k])
-                L_push += pij * max(0.0, loss_cfg.margin - (dik - dij))
+    # 2) отталкиваем от третьих (margin): hinge[i,j,k] = max(0, margin - (d_ik - d_ij))
+    # одним (N,N,N) broadcast-выражением вместо тройного цикла
+    D = np.sqrt(C)
+    hinge = np.maximum(0.0, loss_cfg.margin - (D[:, None, :] - D[:, :, None]))
+    idx = np.arange(N)
+    hinge[idx, :, idx] = 0.0  # k == i
+    hinge[:, idx, idx] = 0.0  # k == j
+    # i == j и пренебрежимые веса (pij <= 1e-12) не участвуют
+    P_push = np.where(P > 1e-12, P, 0.0)
+    np.fill_diagonal(P_push, 0.0)
+    L_push = float(np.einsum('ij,ijk->', P_push, hinge))
 
     total = L_pull + loss_cfg.lam_push * L_push
     return {"total": total, "pull": L_pull, "push": L_push, "P": P, "C": C}
\ No newline at end of file
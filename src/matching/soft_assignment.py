@@ -1,5 +1,6 @@
 import numpy as np
 from dataclasses import dataclass
+from scipy.spatial.distance import cdist
 
 @dataclass
 class SinkhornConfig:
@@ -7,20 +8,57 @@ class SinkhornConfig:
     n_iter: int = 150          # итераций нормировки
     big_cost: float = 1e6      # барьер для запретов (диагональ)
     annea_schedule: tuple = (0.1, 0.05, 0.02, 0.01, 0.005)  # по эпохам
+    tol: float = 1e-9          # ранняя остановка: относительное изменение u
+    check_every: int = 10      # как часто проверять сходимость (итераций)
+    absorb_at: float = 1e30    # порог u, v для переноса в лог-потенциалы
 
 def pairwise_sqdist(X: np.ndarray) -> np.ndarray:
     # X: (N,d)
-    G = X @ X.T
-    sq = np.diag(G)[:,None] + np.diag(G)[None,:] - 2*G
-    return np.maximum(sq, 0.0)
+    # Прямая разность (cdist): без сокращения |x|^2 + |y|^2 - 2xy при координатах ~pi
+    # и расстояниях ~1e-4, неотрицательна без клипа; при d=2 быстрее Грама для любых N
+    return cdist(X, X, metric='sqeuclidean')
 
 def sinkhorn(C: np.ndarray, cfg: SinkhornConfig) -> np.ndarray:
     # C: (N,N) — стоимости; диагональ будет заменена на big_cost
-    K = np.exp(-C / cfg.eps)
-    u = np.ones(C.shape[0])
-    v = np.ones(C.shape[0])
-    for _ in range(cfg.n_iter):
-        u = 1.0 / (K @ v)
-        v = 1.0 / (K.T @ u)
-    P = np.diag(u) @ K @ np.diag(v)
+    # Стабилизированные нормировки: K = exp((alpha_i + beta_j - C_ij)/eps) с лог-потенциалами alpha, beta.
+    # Старт - сдвиг по строкам и столбцам (в каждой строке и столбце K есть exp(0) = 1);
+    # когда u или v растут выше absorb_at, их логарифмы переносятся в потенциалы и K пересчитывается -
+    # точность лог-пространства при цене двух GEMV на итерацию
+    alpha = C.min(axis=1)
+    beta = (C - alpha[:, None]).min(axis=0)
+    
+    N = C.shape[0]
+    # Буферы выделяются один раз: K и его C-непрерывная транспозиция (обе GEMV идут по строкам),
+    # u, v и K @ v пишутся на месте; при переносе в потенциалы K пересчитывается в те же буферы
+    K, K_T = np.empty_like(C, dtype=np.float64), np.empty_like(C, dtype=np.float64)
+    
+    def kernel():
+        np.subtract(alpha[:, None] + beta[None, :], C, out=K)
+        np.divide(K, cfg.eps, out=K)
+        np.exp(K, out=K)
+        K_T[...] = K.T
+    
+    kernel()
+    u, v, u_prev, Kv = np.ones(N), np.ones(N), np.ones(N), np.empty(N)
+    for it in range(cfg.n_iter):
+        np.reciprocal(np.dot(K, v, out=Kv), out=u)
+        np.reciprocal(np.dot(K_T, u, out=Kv), out=v)
+        # Проверки раз в check_every итераций - сами проверки дороже итерации;
+        # запас от absorb_at до переполнения (~1e308) покрывает рост u, v между ними
+        if it % cfg.check_every == 0:
+            if max(u.max(), v.max()) > cfg.absorb_at:
+                alpha += cfg.eps * np.log(u)
+                beta += cfg.eps * np.log(v)
+                kernel()
+                u.fill(1.0)
+                v.fill(1.0)
+                u_prev.fill(1.0)
+                continue
+            if np.abs(u - u_prev).max() <= cfg.tol * u.max():
+                break
+            u_prev[:] = u
+    # P_ij = u_i K_ij v_j - на месте в K (он больше не нужен), без промежуточных NxN массивов
+    P = K
+    P *= u[:, None]
+    P *= v[None, :]
     return P  # ~двойная стохастичность
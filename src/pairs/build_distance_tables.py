@@ -35,7 +35,7 @@ def build_grandchild_distance_tables(tree, pendulum, dt_bounds=(0.001, 0.1), sho
     
     # Шаг 1: Вычисляем таблицу скоростей сближения
     convergence_df = compute_distance_derivative_table(
-        tree.grandchildren, pendulum, show=show
+        tree.grandchildren, pendulum, show=show, as_dataframe=True
     )
     
     # Шаг 2: Находим сближающиеся пары
@@ -188,7 +188,7 @@ def build_grandchild_parent_distance_tables(tree, pendulum, dt_bounds=(0.001, 0.
     
     # Шаг 1: Вычисляем таблицу скоростей сближения
     convergence_df = compute_grandchild_parent_convergence_table(
-        tree.grandchildren, tree.children, pendulum, show=show
+        tree.grandchildren, tree.children, pendulum, show=show, as_dataframe=True
     )
     
     # Шаг 2: Находим сближающиеся пары
@@ -1,3 +1,220 @@
+import os
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+from numba import njit, prange
+from scipy.optimize import minimize
+
+
+# ──────────────────────────────────────────────────────────────────────
+# JIT-ядра предварительного прохода: скорости и скорости сближения
+# ──────────────────────────────────────────────────────────────────────
+@njit(cache=True, fastmath=True)
+def _dynamics(theta, theta_dot, u, params):
+    """Правая часть маятника (как PendulumSystem.pendulum_dynamics), params = (g, l, c, inv_ml2)."""
+    g, l, c, inv_ml2 = params
+    return theta_dot, -g / l * np.sin(theta) - c * theta_dot + u * inv_ml2
+
+
+@njit(cache=True, fastmath=True)
+def _velocities(positions, controls, dts, params):
+    """Скорости точек (N, 2) с учетом направления времени sign(dt)."""
+    n = positions.shape[0]
+    out = np.empty((n, 2))
+    for i in range(n):
+        sign = np.sign(dts[i])
+        d_theta, d_omega = _dynamics(positions[i, 0], positions[i, 1], controls[i], params)
+        out[i, 0] = sign * d_theta
+        out[i, 1] = sign * d_omega
+    return out
+
+
+@njit(inline='always', fastmath=True)
+def _closing_speed(ra, va, rb, vb, i, j):
+    """d|r_a - r_b|/dt = (r_diff · v_diff) / |r_diff|, 0 для совпадающих точек."""
+    dx, dy = ra[i, 0] - rb[j, 0], ra[i, 1] - rb[j, 1]
+    distance = np.sqrt(dx * dx + dy * dy)
+    if distance < 1e-10:
+        return 0.0
+    return (dx * (va[i, 0] - vb[j, 0]) + dy * (va[i, 1] - vb[j, 1])) / distance
+
+
+@njit(cache=True, parallel=True, fastmath=True)
+def _fill_gc_gc_convergence(positions, controls, dts, params):
+    """
+    Таблица (N, N) скоростей сближения внуков. Скорости считаются внутри ядра;
+    таблица симметрична, поэтому считается верхний треугольник и пишется в [i, j] и [j, i].
+    """
+    n = positions.shape[0]
+    velocities = _velocities(positions, controls, dts, params)
+    table = np.zeros((n, n))
+    for i in prange(n):
+        for j in range(i + 1, n):
+            speed = _closing_speed(positions, velocities, positions, velocities, i, j)
+            table[i, j] = speed
+            table[j, i] = speed
+    return table
+
+
+@njit(cache=True, parallel=True, fastmath=True)
+def _fill_gc_parent_convergence(gc_positions, gc_controls, gc_dts, gc_parent_idx,
+                                parent_positions, parent_controls, parent_dts, params):
+    """Таблица (N_gc, N_parents) скоростей сближения внук-родитель; свой родитель - NaN."""
+    n_gc, n_parents = gc_positions.shape[0], parent_positions.shape[0]
+    gc_velocities = _velocities(gc_positions, gc_controls, gc_dts, params)
+    parent_velocities = _velocities(parent_positions, parent_controls, parent_dts, params)
+    table = np.empty((n_gc, n_parents))
+    for i in prange(n_gc):
+        for j in range(n_parents):
+            if j == gc_parent_idx[i]:
+                table[i, j] = np.nan
+            else:
+                table[i, j] = _closing_speed(gc_positions, gc_velocities, parent_positions, parent_velocities, i, j)
+    return table
+
+
+def _converging_pairs(convergence, threshold=-1e-6, upper_triangle=False):
+    """
+    Индексы (rows, cols) пар со скоростью сближения < threshold, по возрастанию скорости
+    (устойчиво - при равенстве в порядке обхода строк). NaN не проходит сравнение.
+    """
+    mask = convergence < threshold
+    if upper_triangle:
+        mask = np.triu(mask, k=1)
+    rows, cols = np.nonzero(mask)
+    order = np.argsort(convergence[rows, cols], kind='stable')
+    return rows[order], cols[order]
+
+
+def _table_frame(table, row_names, col_names):
+    """DataFrame с подписями строк/столбцов вида gc_0, parent_1."""
+    return pd.DataFrame(table, index=row_names, columns=col_names)
+
+
+class _LazyTables(Mapping):
+    """
+    Группа таблиц результата: numpy-массивы лежат в 'arrays', DataFrame по ключу
+    строится при первом обращении (большинству вызывающих нужны только массивы).
+    """
+    
+    def __init__(self, tables, row_names, col_names, **extra):
+        self._tables = tables            # имя -> (N, M) массив
+        self._row_names, self._col_names = row_names, col_names
+        self._items = dict(extra, arrays=tables)
+        self._keys = list(tables) + list(self._items)
+    
+    def __getitem__(self, key):
+        if key not in self._items:
+            if key not in self._tables:
+                raise KeyError(key)
+            self._items[key] = _table_frame(self._tables[key], self._row_names, self._col_names)
+        return self._items[key]
+    
+    def __iter__(self):
+        return iter(self._keys)
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    def __repr__(self):
+        return f"_LazyTables({self._keys})"
+
+
+def _batched_meeting_search(pendulum, starts, controls, bounds, partner_starts=None,
+                            partner_controls=None, partner_bounds=None, targets=None, gtol=1e-10):
+    """
+    Минимальные расстояния K независимых встреч одним L-BFGS-B.
+    
+    Точка k выходит из starts[k] с управлением controls[k] за dt в bounds[k] и встречается
+    либо со второй движущейся точкой (partner_*), либо с неподвижной targets[k].
+    Целевая функция - сумма квадратов расстояний: задачи разделимы, минимум суммы
+    совпадает с минимумами пар. Градиент точный - pendulum.batch_step_jvp по dt.
+    
+    Общий останов не гарантирует сходимость каждой пары: пары, у которых проекция
+    градиента выше gtol (или все пары, если общий запуск не сошелся), решаются заново
+    по отдельности, и их успех - статус собственного запуска.
+    
+    Returns:
+        (distances (K,), dts (K,), partner_dts (K,) или None, converged (K,) bool,
+         scipy OptimizeResult общего запуска)
+    """
+    n = len(starts)
+    moving_partner = targets is None
+    
+    # Инварианты цели - один раз: непрерывные float64 массивы и связанный метод
+    step_jvp = pendulum.batch_step_jvp
+    starts = np.ascontiguousarray(starts, dtype=np.float64)
+    controls = np.ascontiguousarray(controls, dtype=np.float64)
+    if moving_partner:
+        partner_starts = np.ascontiguousarray(partner_starts, dtype=np.float64)
+        partner_controls = np.ascontiguousarray(partner_controls, dtype=np.float64)
+    else:
+        targets = np.ascontiguousarray(targets, dtype=np.float64)
+    
+    all_bounds = np.array([tuple(b) for b in bounds], dtype=np.float64).reshape(n, 2)
+    if moving_partner:
+        all_bounds = np.vstack([all_bounds, np.array([tuple(b) for b in partner_bounds], dtype=np.float64).reshape(n, 2)])
+    # Переменные пары k: dt[k] и (для движущегося партнера) dt[n + k]
+    variables = np.arange(n) if not moving_partner else np.stack([np.arange(n), n + np.arange(n)], axis=1)
+    
+    def make_objective(idx):
+        """Сумма квадратов расстояний пар idx и ее градиент; переменные - dt точек, затем партнеров."""
+        m = len(idx)
+        s, c = starts[idx], controls[idx]
+        zero_states, unit_dts = np.zeros((m, 2)), np.ones(m)
+        if moving_partner:
+            ps, pc = partner_starts[idx], partner_controls[idx]
+        
+        def positions(dt_all):
+            pos, d_pos = step_jvp(s, c, dt_all[:m], zero_states, unit_dts)
+            if not moving_partner:
+                return pos, d_pos, targets[idx], None
+            partner_pos, d_partner = step_jvp(ps, pc, dt_all[m:], zero_states, unit_dts)
+            return pos, d_pos, partner_pos, d_partner
+        
+        def objective(dt_all):
+            pos, d_pos, partner_pos, d_partner = positions(dt_all)
+            diff = pos - partner_pos
+            grad = 2.0 * np.einsum('ki,ki->k', diff, d_pos)
+            if moving_partner:
+                grad = np.concatenate([grad, -2.0 * np.einsum('ki,ki->k', diff, d_partner)])
+            return float(np.einsum('ki,ki->', diff, diff)), grad
+        
+        return objective, positions
+    
+    def solve(idx):
+        """L-BFGS-B по парам idx из середины интервалов; ftol=0 - сумма квадратов мала, останов по градиенту."""
+        objective, positions = make_objective(idx)
+        var_idx = variables[idx].T.ravel() if moving_partner else variables[idx]
+        var_bounds = all_bounds[var_idx]
+        result = minimize(objective, x0=var_bounds.mean(axis=1), jac=True, method='L-BFGS-B',
+                          bounds=[tuple(b) for b in var_bounds],
+                          options={'ftol': 0.0, 'gtol': gtol, 'maxiter': 1000})
+        pos, _, partner_pos, _ = positions(result.x)
+        _, grad = objective(result.x)
+        # Проекция градиента на бокс (как в критерии L-BFGS-B) - по переменным каждой пары
+        projected = np.abs(result.x - np.clip(result.x - grad, var_bounds[:, 0], var_bounds[:, 1]))
+        pair_projected = projected.reshape(-1, len(idx)).max(axis=0)
+        return result, np.linalg.norm(pos - partner_pos, axis=1), result.x.reshape(-1, len(idx)), pair_projected
+    
+    result, distances, dt_rows, pair_projected = solve(np.arange(n))
+    dts = dt_rows[0].copy()
+    partner_dts = dt_rows[1].copy() if moving_partner else None
+    converged = np.full(n, bool(result.success))
+    
+    # Пары без сходимости - отдельными запусками (как попарный поиск)
+    stalled = np.arange(n) if not result.success else np.flatnonzero(pair_projected > gtol)
+    for k in stalled.tolist():
+        pair_result, pair_distance, pair_dts, _ = solve(np.array([k]))
+        distances[k], dts[k] = pair_distance[0], pair_dts[0, 0]
+        if moving_partner:
+            partner_dts[k] = pair_dts[1, 0]
+        converged[k] = pair_result.success
+    
+    return distances, dts, partner_dts, converged, result
+
+
 def complete_meeting_analysis(tree, pendulum, dt_bounds=(0.001, 0.1), 
                               export_results=False, output_dir="results", show=True):
     """
@@ -19,12 +236,9 @@ def complete_meeting_analysis(tree, pendulum, dt_bounds=(0.001, 0.1),
         show: bool - показать весь процесс анализа
         
     Returns:
-        dict: полные результаты анализа
+        dict: полные результаты анализа; таблицы групп gc_gc_tables / gc_parent_tables
+              становятся DataFrame при обращении, массивы без pandas - в ['arrays']
     """
-    import numpy as np
-    import pandas as pd
-    import os
-    
     if not tree._grandchildren_created:
         raise RuntimeError("Сначала создайте внуков через tree.create_grandchildren()")
     
@@ -50,109 +264,59 @@ def complete_meeting_analysis(tree, pendulum, dt_bounds=(0.001, 0.1),
     
     # Вычисляем скорости сближения внуков
     n_gc = len(tree.grandchildren)
-    gc_gc_convergence = np.zeros((n_gc, n_gc))
-    
-    # Вычисляем скорости всех внуков
-    velocities = []
-    for gc in tree.grandchildren:
-        time_sign = np.sign(gc['dt'])
-        dynamics = pendulum.pendulum_dynamics(gc['position'], gc['control'])
-        velocity_vector = time_sign * dynamics
-        velocities.append(velocity_vector)
-    
-    # Заполняем таблицу скоростей сближения
-    for i in range(n_gc):
-        for j in range(i+1, n_gc):
-            r_diff = tree.grandchildren[i]['position'] - tree.grandchildren[j]['position']
-            v_diff = velocities[i] - velocities[j]
-            distance = np.linalg.norm(r_diff)
-            
-            if distance < 1e-10:
-                derivative_value = 0.0
-            else:
-                derivative_value = np.dot(r_diff, v_diff) / distance
-            
-            gc_gc_convergence[i, j] = derivative_value
-            gc_gc_convergence[j, i] = derivative_value
-    
-    gc_gc_convergence_df = pd.DataFrame(
-        gc_gc_convergence,
-        index=[f"gc_{i}" for i in range(n_gc)],
-        columns=[f"gc_{i}" for i in range(n_gc)]
-    )
+    gc_names = [f"gc_{i}" for i in range(n_gc)]  # подписи строятся один раз на весь анализ
+    params = tuple(float(p) for p in pendulum.get_params())
     
-    # Находим сближающиеся пары внук-внук
-    gc_gc_converging_pairs = []
-    for i in range(n_gc):
-        for j in range(i+1, n_gc):
-            velocity = gc_gc_convergence[i, j]
-            if velocity < -1e-6:
-                gc_gc_converging_pairs.append({
-                    'gc_i': i, 'gc_j': j, 'velocity': velocity,
-                    'pair_name': f"gc_{i}-gc_{j}"
-                })
+    # Позиции, управления и dt всех внуков - SoA-буферы дерева; скорости считает JIT-ядро
+    gc_positions, gc_controls, gc_dts = tree.gc_positions, tree.gc_controls, tree.gc_dts
+    gc_parent_idx = tree.gc_parent_idx
     
-    gc_gc_converging_pairs.sort(key=lambda x: x['velocity'])
+    gc_gc_convergence = _fill_gc_gc_convergence(gc_positions, gc_controls, gc_dts, params)
+    
+    # Сближающиеся пары внук-внук (i < j) - массивами индексов, по возрастанию скорости
+    pair_i, pair_j = _converging_pairs(gc_gc_convergence, upper_triangle=True)
     
     if show:
-        print(f"Найдено {len(gc_gc_converging_pairs)} сближающихся пар внук-внук")
+        print(f"Найдено {len(pair_i)} сближающихся пар внук-внук")
     
-    # Оптимизируем встречи внук-внук
-    gc_gc_distance_table = np.full((n_gc, n_gc), np.nan)
+    # Оптимизируем встречи внук-внук.
+    # Таблицы расстояний - float32 (диагностика и ранжирование, ~7 значащих цифр достаточно);
+    # таблицы времен - float64: из них восстанавливаются dt дерева, а площади там ~1e-9
+    gc_gc_distance_table = np.full((n_gc, n_gc), np.nan, dtype=np.float32)
     gc_gc_time_i_table = np.full((n_gc, n_gc), np.nan)
     gc_gc_time_j_table = np.full((n_gc, n_gc), np.nan)
     gc_gc_optimization_results = {}
     
-    for pair in gc_gc_converging_pairs:
-        gc_i_idx, gc_j_idx = pair['gc_i'], pair['gc_j']
-        gc_i = tree.grandchildren[gc_i_idx]
-        gc_j = tree.grandchildren[gc_j_idx]
-        
-        # Определяем ограничения времени
-        if gc_i['dt'] > 0:
-            dt_i_bounds = dt_bounds
-        else:
-            dt_i_bounds = (-dt_bounds[1], -dt_bounds[0])
-            
-        if gc_j['dt'] > 0:
-            dt_j_bounds = dt_bounds
-        else:
-            dt_j_bounds = (-dt_bounds[1], -dt_bounds[0])
-        
-        # Оптимизируем
-        def distance_function(dt_params):
-            dt_i, dt_j = dt_params
-            try:
-                parent_i_pos = tree.children[gc_i['parent_idx']]['position']
-                parent_j_pos = tree.children[gc_j['parent_idx']]['position']
-                pos_i = pendulum.step(parent_i_pos, gc_i['control'], dt_i)
-                pos_j = pendulum.step(parent_j_pos, gc_j['control'], dt_j)
-                return np.linalg.norm(pos_i - pos_j)
-            except:
-                return 1e6
-        
-        from scipy.optimize import minimize
+    def signed_bounds(gc_indices):
+        """Границы dt внуков с учетом направления времени."""
+        return [dt_bounds if gc_dts[j] > 0 else (-dt_bounds[1], -dt_bounds[0]) for j in gc_indices]
+    
+    # Все пары - одной оптимизацией (разделимая сумма квадратов расстояний)
+    if len(pair_i):
+        distances, dts_i, dts_j, converged, batch_result = _batched_meeting_search(
+            pendulum,
+            tree.child_positions[gc_parent_idx[pair_i]], gc_controls[pair_i], signed_bounds(pair_i),
+            partner_starts=tree.child_positions[gc_parent_idx[pair_j]],
+            partner_controls=gc_controls[pair_j],
+            partner_bounds=signed_bounds(pair_j)
+        )
+        if show:
+            print(f"Оптимизация {len(pair_i)} пар: {batch_result.nit} итераций, {batch_result.message}; "
+                  f"сошлось {int(converged.sum())}/{len(pair_i)}")
         
-        x0 = [(dt_i_bounds[0] + dt_i_bounds[1]) / 2, 
-              (dt_j_bounds[0] + dt_j_bounds[1]) / 2]
-        bounds = [dt_i_bounds, dt_j_bounds]
+        # Таблицы - векторной записью в [i, j] и [j, i]; только сошедшиеся пары
+        ok = np.isfinite(distances) & converged
+        ok_i, ok_j = pair_i[ok], pair_j[ok]
+        gc_gc_distance_table[ok_i, ok_j] = gc_gc_distance_table[ok_j, ok_i] = distances[ok]
+        gc_gc_time_i_table[ok_i, ok_j] = gc_gc_time_j_table[ok_j, ok_i] = dts_i[ok]
+        gc_gc_time_j_table[ok_i, ok_j] = gc_gc_time_i_table[ok_j, ok_i] = dts_j[ok]
         
-        try:
-            result = minimize(distance_function, x0=x0, bounds=bounds, method='L-BFGS-B')
-            if result.success:
-                gc_gc_distance_table[gc_i_idx, gc_j_idx] = result.fun
-                gc_gc_distance_table[gc_j_idx, gc_i_idx] = result.fun
-                gc_gc_time_i_table[gc_i_idx, gc_j_idx] = result.x[0]
-                gc_gc_time_j_table[gc_i_idx, gc_j_idx] = result.x[1]
-                gc_gc_time_i_table[gc_j_idx, gc_i_idx] = result.x[1]
-                gc_gc_time_j_table[gc_j_idx, gc_i_idx] = result.x[0]
-                
-                gc_gc_optimization_results[pair['pair_name']] = {
-                    'success': True, 'min_distance': result.fun,
-                    'optimal_dt_i': result.x[0], 'optimal_dt_j': result.x[1]
-                }
-        except:
-            gc_gc_optimization_results[pair['pair_name']] = {'success': False}
+        for k, (gc_i_idx, gc_j_idx) in enumerate(zip(pair_i.tolist(), pair_j.tolist())):
+            gc_gc_optimization_results[f"{gc_names[gc_i_idx]}-{gc_names[gc_j_idx]}"] = (
+                {'success': True, 'min_distance': distances[k],
+                 'optimal_dt_i': dts_i[k], 'optimal_dt_j': dts_j[k]}
+                if ok[k] else {'success': False}
+            )
     
     # ========================================================================
     # ЭТАП 2: АНАЛИЗ ВСТРЕЧ ВНУК-РОДИТЕЛЬ
@@ -164,92 +328,48 @@ def complete_meeting_analysis(tree, pendulum, dt_bounds=(0.001, 0.1),
     
     # Вычисляем скорости сближения внук-родитель
     n_parents = len(tree.children)
-    gc_parent_convergence = np.full((n_gc, n_parents), np.nan)
-    
-    # Вычисляем скорости родителей
-    parent_velocities = []
-    for parent in tree.children:
-        time_sign = np.sign(parent['dt'])
-        dynamics = pendulum.pendulum_dynamics(parent['position'], parent['control'])
-        parent_velocities.append(time_sign * dynamics)
-    
-    # Заполняем таблицу сближения внук-родитель
-    for gc_idx, gc in enumerate(tree.grandchildren):
-        for parent_idx in range(n_parents):
-            if parent_idx == gc['parent_idx']:  # Пропускаем своего родителя
-                continue
-            
-            r_diff = gc['position'] - tree.children[parent_idx]['position']
-            v_diff = velocities[gc_idx] - parent_velocities[parent_idx]
-            distance = np.linalg.norm(r_diff)
-            
-            if distance < 1e-10:
-                derivative_value = 0.0
-            else:
-                derivative_value = np.dot(r_diff, v_diff) / distance
-            
-            gc_parent_convergence[gc_idx, parent_idx] = derivative_value
-    
-    gc_parent_convergence_df = pd.DataFrame(
-        gc_parent_convergence,
-        index=[f"gc_{i}" for i in range(n_gc)],
-        columns=[f"parent_{i}" for i in range(n_parents)]
-    )
+    parent_names = [f"parent_{i}" for i in range(n_parents)]
     
-    # Находим сближающиеся пары внук-родитель
-    gc_parent_converging_pairs = []
-    for gc_idx in range(n_gc):
-        for parent_idx in range(n_parents):
-            velocity = gc_parent_convergence[gc_idx, parent_idx]
-            if not np.isnan(velocity) and velocity < -1e-6:
-                gc_parent_converging_pairs.append({
-                    'gc_idx': gc_idx, 'parent_idx': parent_idx, 'velocity': velocity,
-                    'pair_name': f"gc_{gc_idx}-parent_{parent_idx}"
-                })
+    # Позиции, управления и dt родителей - SoA-буферы дерева
+    parent_positions, parent_controls, parent_dts = tree.child_positions, tree.child_controls, tree.child_dts
+    
+    # Таблица сближения внук-родитель; свой родитель не рассматривается (NaN)
+    gc_parent_convergence = _fill_gc_parent_convergence(
+        gc_positions, gc_controls, gc_dts, gc_parent_idx,
+        parent_positions, parent_controls, parent_dts, params
+    )
     
-    gc_parent_converging_pairs.sort(key=lambda x: x['velocity'])
+    # Сближающиеся пары внук-родитель (свой родитель - NaN - отсекается сравнением)
+    pair_gc, pair_parent = _converging_pairs(gc_parent_convergence)
     
     if show:
-        print(f"Найдено {len(gc_parent_converging_pairs)} сближающихся пар внук-родитель")
+        print(f"Найдено {len(pair_gc)} сближающихся пар внук-родитель")
     
     # Оптимизируем встречи внук-родитель
-    gc_parent_distance_table = np.full((n_gc, n_parents), np.nan)
+    gc_parent_distance_table = np.full((n_gc, n_parents), np.nan, dtype=np.float32)
     gc_parent_time_table = np.full((n_gc, n_parents), np.nan)
     gc_parent_optimization_results = {}
     
-    for pair in gc_parent_converging_pairs:
-        gc_idx, parent_idx = pair['gc_idx'], pair['parent_idx']
-        gc = tree.grandchildren[gc_idx]
-        
-        # Определяем ограничения времени для внука
-        if gc['dt'] > 0:
-            dt_bounds_signed = dt_bounds
-        else:
-            dt_bounds_signed = (-dt_bounds[1], -dt_bounds[0])
-        
-        # Оптимизируем
-        def distance_function(dt):
-            try:
-                gc_parent_pos = tree.children[gc['parent_idx']]['position']
-                target_pos = tree.children[parent_idx]['position']
-                final_pos = pendulum.step(gc_parent_pos, gc['control'], dt)
-                return np.linalg.norm(final_pos - target_pos)
-            except:
-                return 1e6
+    # Все пары - одной оптимизацией: родитель неподвижен, двигается только внук
+    if len(pair_gc):
+        distances, dts, _, converged, batch_result = _batched_meeting_search(
+            pendulum,
+            parent_positions[gc_parent_idx[pair_gc]], gc_controls[pair_gc], signed_bounds(pair_gc),
+            targets=parent_positions[pair_parent]
+        )
+        if show:
+            print(f"Оптимизация {len(pair_gc)} пар: {batch_result.nit} итераций, {batch_result.message}; "
+                  f"сошлось {int(converged.sum())}/{len(pair_gc)}")
         
-        from scipy.optimize import minimize_scalar
+        ok = np.isfinite(distances) & converged
+        gc_parent_distance_table[pair_gc[ok], pair_parent[ok]] = distances[ok]
+        gc_parent_time_table[pair_gc[ok], pair_parent[ok]] = dts[ok]
         
-        try:
-            result = minimize_scalar(distance_function, bounds=dt_bounds_signed, method='bounded')
-            if result.success:
-                gc_parent_distance_table[gc_idx, parent_idx] = result.fun
-                gc_parent_time_table[gc_idx, parent_idx] = result.x
-                
-                gc_parent_optimization_results[pair['pair_name']] = {
-                    'success': True, 'min_distance': result.fun, 'optimal_dt': result.x
-                }
-        except:
-            gc_parent_optimization_results[pair['pair_name']] = {'success': False}
+        for k, (gc_idx, parent_idx) in enumerate(zip(pair_gc.tolist(), pair_parent.tolist())):
+            gc_parent_optimization_results[f"{gc_names[gc_idx]}-{parent_names[parent_idx]}"] = (
+                {'success': True, 'min_distance': distances[k], 'optimal_dt': dts[k]}
+                if ok[k] else {'success': False}
+            )
     
     # ========================================================================
     # ЭТАП 3: СОЗДАНИЕ ХРОНОЛОГИИ
@@ -265,43 +385,35 @@ def complete_meeting_analysis(tree, pendulum, dt_bounds=(0.001, 0.1),
         meetings = []
         gc = tree.grandchildren[gc_idx]
         
-        # Встречи с другими внуками
-        for other_gc_idx in range(n_gc):
-            if gc_idx == other_gc_idx:
-                continue
-            
+        # Встречи с другими внуками: только найденные (диагональ и несближающиеся пары - NaN)
+        for other_gc_idx in np.flatnonzero(~np.isnan(gc_gc_distance_table[gc_idx])).tolist():
             distance = gc_gc_distance_table[gc_idx, other_gc_idx]
-            if not np.isnan(distance):
-                meeting = {
-                    'type': 'grandchild',
-                    'partner': f"gc_{other_gc_idx}",
-                    'partner_idx': other_gc_idx,
-                    'distance': distance,
-                    'time_for_gc': gc_gc_time_i_table[gc_idx, other_gc_idx],
-                    'time_for_partner': gc_gc_time_j_table[gc_idx, other_gc_idx],
-                    'quality': 1.0 / (distance + 1e-8),
-                    'convergence_velocity': gc_gc_convergence[gc_idx, other_gc_idx]
-                }
-                meetings.append(meeting)
+            meeting = {
+                'type': 'grandchild',
+                'partner': gc_names[other_gc_idx],
+                'partner_idx': other_gc_idx,
+                'distance': distance,
+                'time_for_gc': gc_gc_time_i_table[gc_idx, other_gc_idx],
+                'time_for_partner': gc_gc_time_j_table[gc_idx, other_gc_idx],
+                'quality': 1.0 / (distance + 1e-8),
+                'convergence_velocity': gc_gc_convergence[gc_idx, other_gc_idx]
+            }
+            meetings.append(meeting)
         
-        # Встречи с чужими родителями
-        for parent_idx in range(n_parents):
-            if parent_idx == gc['parent_idx']:
-                continue
-            
+        # Встречи с чужими родителями (свой родитель в таблице - NaN)
+        for parent_idx in np.flatnonzero(~np.isnan(gc_parent_distance_table[gc_idx])).tolist():
             distance = gc_parent_distance_table[gc_idx, parent_idx]
-            if not np.isnan(distance):
-                meeting = {
-                    'type': 'parent',
-                    'partner': f"parent_{parent_idx}",
-                    'partner_idx': parent_idx,
-                    'distance': distance,
-                    'time_for_gc': gc_parent_time_table[gc_idx, parent_idx],
-                    'time_for_partner': None,
-                    'quality': 1.0 / (distance + 1e-8),
-                    'convergence_velocity': gc_parent_convergence[gc_idx, parent_idx]
-                }
-                meetings.append(meeting)
+            meeting = {
+                'type': 'parent',
+                'partner': parent_names[parent_idx],
+                'partner_idx': parent_idx,
+                'distance': distance,
+                'time_for_gc': gc_parent_time_table[gc_idx, parent_idx],
+                'time_for_partner': None,
+                'quality': 1.0 / (distance + 1e-8),
+                'convergence_velocity': gc_parent_convergence[gc_idx, parent_idx]
+            }
+            meetings.append(meeting)
         
         # Сортируем по качеству
         meetings.sort(key=lambda x: x['quality'], reverse=True)
@@ -309,7 +421,7 @@ def complete_meeting_analysis(tree, pendulum, dt_bounds=(0.001, 0.1),
         
         if show:
             direction = "forward" if gc['dt'] > 0 else "backward"
-            print(f"gc_{gc_idx} ({direction}): {len(meetings)} встреч")
+            print(f"{gc_names[gc_idx]} ({direction}): {len(meetings)} встреч")
             for i, meeting in enumerate(meetings[:3]):  # Топ-3
                 time_info = f"t={meeting['time_for_gc']:+.4f}с"
                 if meeting['time_for_partner'] is not None:
@@ -321,31 +433,21 @@ def complete_meeting_analysis(tree, pendulum, dt_bounds=(0.001, 0.1),
     # ЭТАП 4: СОЗДАНИЕ ИТОГОВЫХ ТАБЛИЦ
     # ========================================================================
     
-    # Создаем DataFrame для всех таблиц
+    # Таблицы - numpy-массивы; DataFrame строится лениво при обращении по ключу
     results = {
-        'gc_gc_tables': {
-            'distance_table': pd.DataFrame(gc_gc_distance_table, 
-                                         index=[f"gc_{i}" for i in range(n_gc)],
-                                         columns=[f"gc_{i}" for i in range(n_gc)]),
-            'time_table_i': pd.DataFrame(gc_gc_time_i_table,
-                                       index=[f"gc_{i}" for i in range(n_gc)],
-                                       columns=[f"gc_{i}" for i in range(n_gc)]),
-            'time_table_j': pd.DataFrame(gc_gc_time_j_table,
-                                       index=[f"gc_{i}" for i in range(n_gc)],
-                                       columns=[f"gc_{i}" for i in range(n_gc)]),
-            'convergence_table': gc_gc_convergence_df,
-            'optimization_results': gc_gc_optimization_results
-        },
-        'gc_parent_tables': {
-            'distance_table': pd.DataFrame(gc_parent_distance_table,
-                                         index=[f"gc_{i}" for i in range(n_gc)],
-                                         columns=[f"parent_{i}" for i in range(n_parents)]),
-            'time_table': pd.DataFrame(gc_parent_time_table,
-                                     index=[f"gc_{i}" for i in range(n_gc)],
-                                     columns=[f"parent_{i}" for i in range(n_parents)]),
-            'convergence_table': gc_parent_convergence_df,
-            'optimization_results': gc_parent_optimization_results
-        },
+        'gc_gc_tables': _LazyTables(
+            {'distance_table': gc_gc_distance_table,
+             'time_table_i': gc_gc_time_i_table,
+             'time_table_j': gc_gc_time_j_table,
+             'convergence_table': gc_gc_convergence},
+            gc_names, gc_names, optimization_results=gc_gc_optimization_results
+        ),
+        'gc_parent_tables': _LazyTables(
+            {'distance_table': gc_parent_distance_table,
+             'time_table': gc_parent_time_table,
+             'convergence_table': gc_parent_convergence},
+            gc_names, parent_names, optimization_results=gc_parent_optimization_results
+        ),
         'chronology': chronology,
         'summary': {
             'total_grandchildren': n_gc,
@@ -361,16 +463,16 @@ def complete_meeting_analysis(tree, pendulum, dt_bounds=(0.001, 0.1),
         
         # Экспортируем основные таблицы
         results['gc_gc_tables']['distance_table'].to_csv(
-            os.path.join(output_dir, "gc_gc_distances.csv"))
+            os.path.join(output_dir, "gc_gc_distances.csv"), float_format="%.6g")
         results['gc_parent_tables']['distance_table'].to_csv(
-            os.path.join(output_dir, "gc_parent_distances.csv"))
+            os.path.join(output_dir, "gc_parent_distances.csv"), float_format="%.6g")
         
         # Экспортируем хронологию
         chronology_data = []
         for gc_idx, meetings in chronology.items():
             for rank, meeting in enumerate(meetings, 1):
                 chronology_data.append({
-                    'grandchild': f"gc_{gc_idx}",
+                    'grandchild': gc_names[gc_idx],
                     'rank': rank,
                     'partner': meeting['partner'],
                     'partner_type': meeting['type'],
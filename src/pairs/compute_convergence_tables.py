@@ -1,4 +1,156 @@
-def compute_distance_derivative_table(grandchildren, pendulum, show=False):
+import math
+
+import numpy as np
+from numba import njit, prange
+
+
+# ──────────────────────────────────────────────────────────────────────
+# JIT-ядра таблиц: d/dt|r_a - r_b| = (r_a - r_b)·(v_a - v_b) / |r_a - r_b|
+# ──────────────────────────────────────────────────────────────────────
+@njit(cache=True, parallel=True, fastmath=True)
+def _deriv_table(positions, velocities):
+    """
+    Таблица (n, n) производных расстояний между внуками. Симметрична:
+    считается верхний треугольник и пишется в [i, j] и [j, i]; совпадающие точки - 0.
+    """
+    n = positions.shape[0]
+    out = np.zeros((n, n))
+    for i in prange(n):
+        for j in range(i + 1, n):
+            dx = positions[i, 0] - positions[j, 0]
+            dy = positions[i, 1] - positions[j, 1]
+            distance = math.sqrt(dx * dx + dy * dy)
+            if distance < 1e-10:
+                value = 0.0
+            else:
+                value = (dx * (velocities[i, 0] - velocities[j, 0])
+                         + dy * (velocities[i, 1] - velocities[j, 1])) / distance
+            out[i, j] = value
+            out[j, i] = value
+    return out
+
+
+@njit(cache=True, parallel=True, fastmath=True)
+def _gc_parent_deriv_table(gc_positions, gc_velocities, parent_positions, gc_parent_idx):
+    """Таблица (n_gc, n_parents) производных расстояний внук-родитель; родители статичны, свой родитель - NaN."""
+    n_gc, n_parents = gc_positions.shape[0], parent_positions.shape[0]
+    out = np.empty((n_gc, n_parents))
+    for i in prange(n_gc):
+        for j in range(n_parents):
+            if j == gc_parent_idx[i]:
+                out[i, j] = np.nan
+                continue
+            dx = gc_positions[i, 0] - parent_positions[j, 0]
+            dy = gc_positions[i, 1] - parent_positions[j, 1]
+            distance = math.sqrt(dx * dx + dy * dy)
+            if distance < 1e-10:
+                out[i, j] = 0.0
+            else:
+                out[i, j] = (dx * gc_velocities[i, 0] + dy * gc_velocities[i, 1]) / distance
+    return out
+
+
+# ──────────────────────────────────────────────────────────────────────
+# Вывод таблиц (show=True): форматирование отдельно от расчета
+# ──────────────────────────────────────────────────────────────────────
+def _labelled_frame(values_table, row_prefix, col_prefix):
+    """pandas.DataFrame с подписями строк/столбцов вида {prefix}_{i}."""
+    import pandas as pd
+    
+    return pd.DataFrame(values_table,
+                        index=[f"{row_prefix}_{i}" for i in range(values_table.shape[0])],
+                        columns=[f"{col_prefix}_{j}" for j in range(values_table.shape[1])])
+
+
+def _print_derivative_stats(values_table):
+    """Печать таблицы d/dt|r_i - r_j| внуков и статистики по верхнему треугольнику."""
+    import pandas as pd
+    
+    n = values_table.shape[0]
+    df = _labelled_frame(values_table, "gc", "gc")
+    
+    print("Таблица первых производных расстояний d/dt|r_i - r_j|:")
+    print("   < 0: сближаются (чем меньше, тем быстрее)")
+    print("   = 0: стационарно") 
+    print("   > 0: расходятся (чем больше, тем быстрее)")
+    print()
+    # Форматируем вывод с 5 знаками после запятой
+    with pd.option_context('display.precision', 5):
+        print(df)
+    
+    # Дополнительная статистика (только верхний треугольник)
+    valid_values = values_table[np.triu_indices(n, k=1)]
+    
+    negative_count = (valid_values < -1e-6).sum()
+    zero_count = ((valid_values >= -1e-6) & (valid_values <= 1e-6)).sum()
+    positive_count = (valid_values > 1e-6).sum()
+    
+    print(f"\nСтатистика:")
+    print(f"  Сближающихся пар: {negative_count}")
+    print(f"  Стационарных пар: {zero_count}")
+    print(f"  Расходящихся пар: {positive_count}")
+    print(f"  Всего уникальных пар: {len(valid_values)}")
+    
+    if negative_count > 0:
+        min_val = valid_values[valid_values < -1e-6].min()
+        print(f"  Максимальная скорость сближения: {min_val:.5f}")
+    if positive_count > 0:
+        max_val = valid_values[valid_values > 1e-6].max()
+        print(f"  Максимальная скорость расхождения: {max_val:.5f}")
+
+
+def _print_gc_parent_stats(values_table):
+    """Печать таблицы d/dt|r_внук - r_родитель| и статистики по связям с чужими родителями."""
+    import pandas as pd
+    
+    n_grandchildren, n_parents = values_table.shape
+    df = _labelled_frame(values_table, "gc", "parent")
+    
+    print("Таблица сближения внуков с ЧУЖИМИ родителями d/dt|r_внук - r_родитель|:")
+    print("   < 0: внук сближается с родителем")
+    print("   = 0: стационарно")
+    print("   > 0: внук отдаляется от родителя")
+    print("   NaN: свой родитель (исключен)")
+    print()
+    
+    # Форматируем вывод
+    with pd.option_context('display.precision', 5):
+        print(df)
+    
+    # Статистика по сближениям
+    valid_values = values_table[~np.isnan(values_table)]
+    
+    approaching_count = (valid_values < -1e-6).sum()
+    stationary_count = ((valid_values >= -1e-6) & (valid_values <= 1e-6)).sum()
+    receding_count = (valid_values > 1e-6).sum()
+    
+    print(f"\nСтатистика:")
+    print(f"  Внуков сближается с чужими родителями: {approaching_count}")
+    print(f"  Стационарных: {stationary_count}")
+    print(f"  Внуков отдаляется от чужих родителей: {receding_count}")
+    print(f"  Всего связей внук-чужой_родитель: {len(valid_values)}")
+    
+    if approaching_count > 0:
+        min_val = valid_values[valid_values < -1e-6].min()
+        print(f"  Максимальная скорость сближения: {min_val:.5f}")
+    if receding_count > 0:
+        max_val = valid_values[valid_values > 1e-6].max()
+        print(f"  Максимальная скорость отдаления: {max_val:.5f}")
+    
+    # Показываем какие внуки к каким родителям сближаются
+    print(f"\nВнуки, сближающиеся с чужими родителями:")
+    for gc_idx in range(n_grandchildren):
+        approaching_parents = []
+        for parent_idx in range(n_parents):
+            value = values_table[gc_idx, parent_idx]
+            if not np.isnan(value) and value < -1e-6:
+                approaching_parents.append(f"parent_{parent_idx}({value:.5f})")
+        
+        if approaching_parents:
+            print(f"  gc_{gc_idx}: {', '.join(approaching_parents)}")
+
+
+def compute_distance_derivative_table(grandchildren, pendulum, show=False, as_dataframe=False):
     """
     Составляет таблицу первых производных расстояний между всеми парами внуков.
     
@@ -6,31 +158,23 @@ def compute_distance_derivative_table(grandchildren, pendulum, show=False):
         grandchildren: list - список внуков с полями 'position', 'control', 'dt'
         pendulum: PendulumSystem - объект маятника для вычисления скоростей
         show: bool - выводить таблицу
+        as_dataframe: bool - вернуть pandas.DataFrame с подписями gc_i вместо массива
         
     Returns:
-        pandas.DataFrame: симметричная таблица значений d/dt|r_i - r_j|
+        np.ndarray (n, n) или pandas.DataFrame (as_dataframe=True):
+            симметричная таблица значений d/dt|r_i - r_j|
             Отрицательные: сближаются (чем меньше, тем быстрее)
             Положительные: расходятся (чем больше, тем быстрее)
     """
-    import numpy as np
-    import pandas as pd
-    
     n = len(grandchildren)
-    values_table = np.zeros((n, n))
-    
-    # Вычисляем "сырые" скорости всех внуков (без учета направления времени)
-    raw_velocities = []
-    time_directions = []
-    for i, gc in enumerate(grandchildren):
-        pos = gc['position']
-        control = gc['control']
-        
-        # Сохраняем направление времени отдельно
-        time_directions.append(np.sign(gc['dt']))
-        
-        # Получаем "сырую" динамику маятника (всегда для времени вперед)
-        dynamics = pendulum.pendulum_dynamics(pos, control)  # [theta_dot, theta_ddot]
-        raw_velocities.append(dynamics)
+    
+    # Поля внуков собираются в массивы (n, 2) / (n,): таблицу заполняет JIT-ядро без циклов Python
+    positions = np.array([gc['position'] for gc in grandchildren], dtype=np.float64).reshape(n, 2)
+    controls = np.array([gc['control'] for gc in grandchildren], dtype=np.float64)
+    
+    # Направления времени и "сырая" динамика маятника (всегда для времени вперед) одним вызовом
+    time_directions = np.sign([gc['dt'] for gc in grandchildren])
+    raw_velocities = pendulum.pendulum_dynamics_batch(positions, controls)  # [theta_dot, theta_ddot]
         
     if show:
         print("Отладочная информация первых 3 внуков:")
@@ -40,83 +184,22 @@ def compute_distance_derivative_table(grandchildren, pendulum, show=False):
             print(f"  Внук {i}: dt={gc['dt']:+.5f} ({direction})")
             print(f"    raw_dynamics={raw_velocities[i]}, time_direction={time_directions[i]:+1.0f}")
     
-    # Заполняем только верхний треугольник (оптимизация в 2 раза)  
-    for i in range(n):
-        for j in range(i+1, n):  # Только j > i
-            # Позиции внуков
-            r1 = grandchildren[i]['position']
-            r2 = grandchildren[j]['position']
-            
-            # Сырые скорости (без учета направления времени)
-            v1_raw = raw_velocities[i]
-            v2_raw = raw_velocities[j]
-            
-            # Направления времени
-            sign1 = time_directions[i]
-            sign2 = time_directions[j]
-            
-            # Вектор между точками
-            r_diff = r1 - r2
-            
-            # ИСПРАВЛЕНО: правильный учет направлений времени
-            # Формула v_diff = sign1 * v1_raw - sign2 * v2_raw работает универсально:
-            # - Если sign1 == sign2: получаем sign1 * (v1_raw - v2_raw) 
-            # - Если sign1 != sign2: получаем скорости с учетом встречного движения во времени
-            v_diff = sign1 * v1_raw - sign2 * v2_raw
-            
-            # Текущее расстояние
-            distance = np.linalg.norm(r_diff)
-            
-            if distance < 1e-10:
-                derivative_value = 0.0
-            else:
-                # Производная расстояния: d/dt |r1 - r2| = (r1-r2)·(v1-v2) / |r1-r2|
-                derivative_value = np.dot(r_diff, v_diff) / distance
-            
-            # Заполняем симметрично
-            values_table[i, j] = derivative_value
-            values_table[j, i] = derivative_value
-    
-    # Создаем pandas DataFrame
-    df = pd.DataFrame(values_table, 
-                     index=[f"gc_{i}" for i in range(n)],
-                     columns=[f"gc_{i}" for i in range(n)])
+    # Скорости с учетом направления времени: v_diff = sign_i * v_i_raw - sign_j * v_j_raw
+    # работает универсально - и для одинаковых, и для встречных направлений времени
+    velocities = time_directions[:, None] * raw_velocities
+    
+    values_table = _deriv_table(positions, velocities)
     
     if show:
-        print("Таблица первых производных расстояний d/dt|r_i - r_j|:")
-        print("   < 0: сближаются (чем меньше, тем быстрее)")
-        print("   = 0: стационарно") 
-        print("   > 0: расходятся (чем больше, тем быстрее)")
-        print()
-        # Форматируем вывод с 5 знаками после запятой
-        with pd.option_context('display.precision', 5):
-            print(df)
-        
-        # Дополнительная статистика (только верхний треугольник)
-        upper_triangle = df.where(np.triu(np.ones(df.shape), k=1).astype(bool))
-        valid_values = upper_triangle.stack().values
-        
-        negative_count = (valid_values < -1e-6).sum()
-        zero_count = ((valid_values >= -1e-6) & (valid_values <= 1e-6)).sum()
-        positive_count = (valid_values > 1e-6).sum()
-        
-        print(f"\nСтатистика:")
-        print(f"  Сближающихся пар: {negative_count}")
-        print(f"  Стационарных пар: {zero_count}")
-        print(f"  Расходящихся пар: {positive_count}")
-        print(f"  Всего уникальных пар: {len(valid_values)}")
-        
-        if negative_count > 0:
-            min_val = valid_values[valid_values < -1e-6].min()
-            print(f"  Максимальная скорость сближения: {min_val:.5f}")
-        if positive_count > 0:
-            max_val = valid_values[valid_values > 1e-6].max()
-            print(f"  Максимальная скорость расхождения: {max_val:.5f}")
-    
-    return df
+        _print_derivative_stats(values_table)
+    
+    # DataFrame с подписями - только по запросу, расчетам хватает массива
+    if as_dataframe:
+        return _labelled_frame(values_table, "gc", "gc")
+    return values_table
 
 
-def compute_grandchild_parent_convergence_table(grandchildren, children, pendulum, show=False):
+def compute_grandchild_parent_convergence_table(grandchildren, children, pendulum, show=False, as_dataframe=False):
     """
     Составляет таблицу первых производных расстояний между внуками и ЧУЖИМИ родителями.
     
@@ -125,116 +208,36 @@ def compute_grandchild_parent_convergence_table(grandchildren, children, pendulu
         children: list - список родителей с полями 'position', 'control', 'dt'
         pendulum: PendulumSystem - объект маятника для вычисления скоростей
         show: bool - выводить таблицу
+        as_dataframe: bool - вернуть pandas.DataFrame с подписями gc_i / parent_j вместо массива
         
     Returns:
-        pandas.DataFrame: таблица d/dt|r_внук - r_родитель|
+        np.ndarray (n_gc, n_parents) или pandas.DataFrame (as_dataframe=True):
+            таблица d/dt|r_внук - r_родитель|
             Строки: внуки (gc_0, gc_1, ...)
             Столбцы: родители (parent_0, parent_1, ...)
             Значения < 0: сближаются
             Значения > 0: расходятся
             NaN: свой родитель (исключен)
     """
-    import numpy as np
-    import pandas as pd
-    
     n_grandchildren = len(grandchildren)
     n_parents = len(children)
-    values_table = np.full((n_grandchildren, n_parents), np.nan)
-    
-    # Вычисляем сырые скорости внуков (без учета направления времени)
-    grandchild_raw_velocities = []
-    grandchild_time_directions = []
-    for gc in grandchildren:
-        pos = gc['position']
-        control = gc['control']
-        grandchild_time_directions.append(np.sign(gc['dt']))
-        dynamics = pendulum.pendulum_dynamics(pos, control)
-        grandchild_raw_velocities.append(dynamics)
-    
-    # РОДИТЕЛИ СТАТИЧНЫ - их скорость равна 0 (они не эволюционируют во времени)
-    
-    # Заполняем таблицу
-    for gc_idx, gc in enumerate(grandchildren):
-        own_parent_idx = gc['parent_idx']
-        
-        for parent_idx, parent in enumerate(children):
-            # Пропускаем своего родителя
-            if parent_idx == own_parent_idx:
-                continue
-            
-            # Позиции
-            gc_pos = gc['position']
-            parent_pos = parent['position']
-            
-            # Сырая скорость внука и направление времени
-            gc_vel_raw = grandchild_raw_velocities[gc_idx]
-            gc_time_sign = grandchild_time_directions[gc_idx]
-            
-            # Вектор между точками
-            r_diff = gc_pos - parent_pos
-            
-            # ИСПРАВЛЕНО: родители статичны (скорость = 0)
-            # v_diff = скорость_внука - 0 = gc_time_sign * gc_vel_raw
-            v_diff = gc_time_sign * gc_vel_raw
-            
-            # Текущее расстояние
-            distance = np.linalg.norm(r_diff)
-            
-            if distance < 1e-10:
-                derivative_value = 0.0
-            else:
-                # Производная расстояния: d/dt |r_внук - r_родитель|
-                derivative_value = np.dot(r_diff, v_diff) / distance
-            
-            values_table[gc_idx, parent_idx] = derivative_value
     
-    # Создаем pandas DataFrame
-    df = pd.DataFrame(values_table,
-                     index=[f"gc_{i}" for i in range(n_grandchildren)],
-                     columns=[f"parent_{i}" for i in range(n_parents)])
+    gc_positions = np.array([gc['position'] for gc in grandchildren], dtype=np.float64).reshape(n_grandchildren, 2)
+    gc_controls = np.array([gc['control'] for gc in grandchildren], dtype=np.float64)
+    gc_parent_idx = np.array([gc['parent_idx'] for gc in grandchildren], dtype=np.int64)
+    parent_positions = np.array([parent['position'] for parent in children], dtype=np.float64).reshape(n_parents, 2)
+    
+    # Скорости внуков с учетом направления времени; РОДИТЕЛИ СТАТИЧНЫ - их скорость равна 0
+    # (они не эволюционируют во времени), поэтому v_diff = gc_time_sign * gc_vel_raw
+    grandchild_time_directions = np.sign([gc['dt'] for gc in grandchildren])
+    gc_velocities = grandchild_time_directions[:, None] * pendulum.pendulum_dynamics_batch(gc_positions, gc_controls)
+    
+    values_table = _gc_parent_deriv_table(gc_positions, gc_velocities, parent_positions, gc_parent_idx)
     
     if show:
-        print("Таблица сближения внуков с ЧУЖИМИ родителями d/dt|r_внук - r_родитель|:")
-        print("   < 0: внук сближается с родителем")
-        print("   = 0: стационарно")
-        print("   > 0: внук отдаляется от родителя")
-        print("   NaN: свой родитель (исключен)")
-        print()
-        
-        # Форматируем вывод
-        with pd.option_context('display.precision', 5):
-            print(df)
-        
-        # Статистика по сближениям
-        valid_values = df.values[~np.isnan(df.values)]
-        
-        approaching_count = (valid_values < -1e-6).sum()
-        stationary_count = ((valid_values >= -1e-6) & (valid_values <= 1e-6)).sum()
-        receding_count = (valid_values > 1e-6).sum()
-        
-        print(f"\nСтатистика:")
-        print(f"  Внуков сближается с чужими родителями: {approaching_count}")
-        print(f"  Стационарных: {stationary_count}")
-        print(f"  Внуков отдаляется от чужих родителей: {receding_count}")
-        print(f"  Всего связей внук-чужой_родитель: {len(valid_values)}")
-        
-        if approaching_count > 0:
-            min_val = valid_values[valid_values < -1e-6].min()
-            print(f"  Максимальная скорость сближения: {min_val:.5f}")
-        if receding_count > 0:
-            max_val = valid_values[valid_values > 1e-6].max()
-            print(f"  Максимальная скорость отдаления: {max_val:.5f}")
-        
-        # Показываем какие внуки к каким родителям сближаются
-        print(f"\nВнуки, сближающиеся с чужими родителями:")
-        for gc_idx in range(n_grandchildren):
-            approaching_parents = []
-            for parent_idx in range(n_parents):
-                value = df.iloc[gc_idx, parent_idx]
-                if not np.isnan(value) and value < -1e-6:
-                    approaching_parents.append(f"parent_{parent_idx}({value:.5f})")
-            
-            if approaching_parents:
-                print(f"  gc_{gc_idx}: {', '.join(approaching_parents)}")
-    
-    return df
\ No newline at end of file
+        _print_gc_parent_stats(values_table)
+    
+    # DataFrame с подписями - только по запросу, расчетам хватает массива
+    if as_dataframe:
+        return _labelled_frame(values_table, "gc", "parent")
+    return values_table
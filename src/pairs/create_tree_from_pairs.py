@@ -3,7 +3,7 @@ from .find_optimal_pairs import find_optimal_pairs
 from .extract_optimal_times_from_pairs import extract_optimal_times_from_pairs
 
 
-def create_tree_from_pairs(tree, pendulum, config, show=False):
+def create_tree_from_pairs(tree, pendulum, config, show=False, pairs=None):
     """
     Создает оптимизированное дерево из найденных пар внуков.
     
@@ -17,6 +17,7 @@ def create_tree_from_pairs(tree, pendulum, config, show=False):
         pendulum: объект маятника
         config: конфигурация для нового дерева
         show: bool - вывод промежуточных результатов
+        pairs: list - уже найденные find_optimal_pairs(tree) пары (None - искать заново)
         
     Returns:
         dict: {
@@ -41,7 +42,8 @@ def create_tree_from_pairs(tree, pendulum, config, show=False):
         if show:
             print("Поиск оптимальных пар...")
         
-        pairs = find_optimal_pairs(tree, show=show and False)  # Детальный дебаг только при необходимости
+        if pairs is None:
+            pairs = find_optimal_pairs(tree, show=show and False)  # Детальный дебаг только при необходимости
         
         if pairs is None:
             if show:
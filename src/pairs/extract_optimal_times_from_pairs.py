@@ -43,6 +43,7 @@ def extract_optimal_times_from_pairs(pairs, tree, show=False):
         # ИСХОДНЫЕ ВРЕМЕНА
         # ================================================================
         
+        n_gc = len(tree.grandchildren)
         original_dt_children = np.array([child['dt'] for child in tree.children])
         original_dt_grandchildren = np.array([gc['dt'] for gc in tree.grandchildren])
         
@@ -60,7 +61,7 @@ def extract_optimal_times_from_pairs(pairs, tree, show=False):
         # ================================================================
         
         pair_mapping = {}
-        paired_grandchildren = set()
+        paired_mask = np.zeros(n_gc, dtype=bool)
         
         if show:
             print(f"\nОбработка {len(pairs)} пар:")
@@ -93,8 +94,7 @@ def extract_optimal_times_from_pairs(pairs, tree, show=False):
             }
             
             # Отмечаем как спаренных
-            paired_grandchildren.add(gc_i)
-            paired_grandchildren.add(gc_j)
+            paired_mask[gc_i] = paired_mask[gc_j] = True
             
             if show:
                 # Показываем изменения
@@ -111,36 +111,29 @@ def extract_optimal_times_from_pairs(pairs, tree, show=False):
         # ================================================================
         
         # Находим неспаренных внуков
-        unpaired_grandchildren = [i for i in range(len(tree.grandchildren)) if i not in paired_grandchildren]
+        unpaired_grandchildren = np.flatnonzero(~paired_mask).tolist()
         
-        # Анализ изменений
-        changed_count = sum(1 for i in range(len(tree.grandchildren)) 
-                           if abs(optimal_dt_grandchildren[i] - original_dt_grandchildren[i]) > 1e-10)
+        # Анализ изменений - маски по всем внукам сразу
+        changed_mask = np.abs(optimal_dt_grandchildren - original_dt_grandchildren) > 1e-10
+        changed_count = int(changed_mask.sum())
         
-        # Проверяем направления времени
-        direction_violations = 0
-        for i in range(len(tree.grandchildren)):
-            original = original_dt_grandchildren[i]
-            optimal = optimal_dt_grandchildren[i]
-            
-            # Проверяем что знак не поменялся
-            if (original > 0 and optimal <= 0) or (original < 0 and optimal >= 0):
-                direction_violations += 1
-                if show:
-                    print(f"ВНИМАНИЕ: gc_{i} изменил направление времени {original:+.6f} → {optimal:+.6f}")
-        
-        # Вычисляем статистику изменений
-        change_ratios = []
-        if changed_count > 0:
-            for i in range(len(tree.grandchildren)):
-                if abs(optimal_dt_grandchildren[i] - original_dt_grandchildren[i]) > 1e-10:
-                    if abs(original_dt_grandchildren[i]) > 1e-10:  # Избегаем деления на ноль
-                        change_ratio = abs(optimal_dt_grandchildren[i]) / abs(original_dt_grandchildren[i])
-                        change_ratios.append(change_ratio)
+        # Проверяем направления времени: знак не должен поменяться
+        violation_mask = (((original_dt_grandchildren > 0) & (optimal_dt_grandchildren <= 0))
+                          | ((original_dt_grandchildren < 0) & (optimal_dt_grandchildren >= 0)))
+        direction_violations = int(violation_mask.sum())
+        if show:
+            for i in np.flatnonzero(violation_mask):
+                print(f"ВНИМАНИЕ: gc_{i} изменил направление времени "
+                      f"{original_dt_grandchildren[i]:+.6f} → {optimal_dt_grandchildren[i]:+.6f}")
+        
+        # Вычисляем статистику изменений (исходное dt ~ 0 пропускаем - деление на ноль)
+        ratio_mask = changed_mask & (np.abs(original_dt_grandchildren) > 1e-10)
+        change_ratios = (np.abs(optimal_dt_grandchildren[ratio_mask])
+                         / np.abs(original_dt_grandchildren[ratio_mask])).tolist()
         
         stats = {
-            'total_grandchildren': len(tree.grandchildren),
-            'paired_count': len(paired_grandchildren),
+            'total_grandchildren': n_gc,
+            'paired_count': int(paired_mask.sum()),
             'unpaired_count': len(unpaired_grandchildren),
             'changed_count': changed_count,
             'direction_violations': direction_violations,
@@ -157,14 +150,13 @@ def extract_optimal_times_from_pairs(pairs, tree, show=False):
             if unpaired_grandchildren:
                 print(f"  Индексы неспаренных: {unpaired_grandchildren}")
             
-            print(f"\nСРАВНЕНИЕ ВРЕМЕН (все {len(tree.grandchildren)} внуков):")
+            print(f"\nСРАВНЕНИЕ ВРЕМЕН (все {n_gc} внуков):")
             print("  Индекс | Исходное    | Оптимальное | Изменение")
             print("  -------|-------------|-------------|----------")
-            for i in range(len(tree.grandchildren)):
+            for i in range(n_gc):
                 original = original_dt_grandchildren[i]
                 optimal = optimal_dt_grandchildren[i]
-                changed = abs(optimal - original) > 1e-10
-                status = "ИЗМЕНЕН" if changed else "исходное"
+                status = "ИЗМЕНЕН" if changed_mask[i] else "исходное"
                 
                 print(f"  gc_{i:2d}   | {original:+10.6f} | {optimal:+10.6f} | {status}")
             
@@ -3,7 +3,7 @@ def find_converging_grandchild_pairs(gc_gc_convergence_df, show=False):
     Находит все пары внуков с отрицательными скоростями сближения.
     
     Args:
-        gc_gc_convergence_df: pandas.DataFrame - таблица скоростей сближения внуков
+        gc_gc_convergence_df: np.ndarray | pandas.DataFrame - таблица скоростей сближения внуков
         show: bool - показать найденные пары
         
     Returns:
@@ -12,12 +12,13 @@ def find_converging_grandchild_pairs(gc_gc_convergence_df, show=False):
     import numpy as np
     
     converging_pairs = []
-    n = len(gc_gc_convergence_df)
+    values = np.asarray(gc_gc_convergence_df)
+    n = len(values)
     
     # Проходим только верхний треугольник (избегаем дублирования)
     for i in range(n):
         for j in range(i+1, n):
-            velocity = gc_gc_convergence_df.iloc[i, j]
+            velocity = values[i, j]
             
             if velocity < -1e-6:  # Сближаются (отрицательная производная расстояния)
                 converging_pairs.append({
@@ -43,7 +44,7 @@ def find_converging_grandchild_parent_pairs(gc_parent_convergence_df, show=False
     Находит все пары внук-родитель с отрицательными скоростями сближения.
     
     Args:
-        gc_parent_convergence_df: pandas.DataFrame - таблица сближения внуков с родителями
+        gc_parent_convergence_df: np.ndarray | pandas.DataFrame - таблица сближения внуков с родителями
         show: bool - показать найденные пары
         
     Returns:
@@ -52,10 +53,11 @@ def find_converging_grandchild_parent_pairs(gc_parent_convergence_df, show=False
     import numpy as np
     
     converging_pairs = []
+    values = np.asarray(gc_parent_convergence_df)
     
-    for gc_idx in range(len(gc_parent_convergence_df)):
-        for parent_idx in range(len(gc_parent_convergence_df.columns)):
-            velocity = gc_parent_convergence_df.iloc[gc_idx, parent_idx]
+    for gc_idx in range(values.shape[0]):
+        for parent_idx in range(values.shape[1]):
+            velocity = values[gc_idx, parent_idx]
             
             # Пропускаем NaN (свой родитель) и положительные скорости
             if not np.isnan(velocity) and velocity < -1e-6:
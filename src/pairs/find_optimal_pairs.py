@@ -1,6 +1,7 @@
+import math
 import numpy as np
 import pandas as pd
-from scipy.optimize import minimize, minimize_scalar
+from scipy.optimize import brentq, minimize, minimize_scalar
 
 # Импорты всех необходимых функций из пайплайна
 from .compute_convergence_tables import compute_distance_derivative_table, compute_grandchild_parent_convergence_table
@@ -44,7 +45,8 @@ def optimize_grandchild_pair_distance(gc_i_idx, gc_j_idx, grandchildren, childre
         try:
             pos_i = pendulum.step(parent_i_pos, gc_i['control'], dt_i, method="jit")
             pos_j = pendulum.step(parent_j_pos, gc_j['control'], dt_j, method="jit")
-            return np.linalg.norm(pos_i - pos_j)
+            dx, dy = pos_i[0] - pos_j[0], pos_i[1] - pos_j[1]
+            return math.sqrt(dx * dx + dy * dy)  # без диспетчеризации np.linalg.norm для 2-вектора
         except:
             return 1e6
     
@@ -126,38 +128,77 @@ def optimize_grandchild_parent_distance(gc_idx, parent_idx, grandchildren, child
     def distance_function(dt):
         try:
             gc_final_pos = pendulum.step(gc_parent_pos, gc['control'], dt, method="jit")
-            return np.linalg.norm(gc_final_pos - target_parent_pos)
+            dx, dy = gc_final_pos[0] - target_parent_pos[0], gc_final_pos[1] - target_parent_pos[1]
+            return math.sqrt(dx * dx + dy * dy)
         except:
             return 1e6
     
-    # БЫСТРАЯ оптимизация
+    def distance_slope(dt):
+        """Знак d|phi|^2/d(dt): phi · d(step)/d(dt), производная RK4-шага за тот же проход"""
+        gc_final_pos, d_pos = pendulum.step(gc_parent_pos, gc['control'], dt, return_sensitivity=True)
+        return ((gc_final_pos[0] - target_parent_pos[0]) * d_pos[0]
+                + (gc_final_pos[1] - target_parent_pos[1]) * d_pos[1])
+    
     try:
-        result = minimize_scalar(
-            distance_function,
-            bounds=dt_bounds_signed,
-            method='bounded',
-            options={
-                'xatol': 1e-6,   # Менее строго
-                'maxiter': 200   # Меньше итераций
+        # Производная меняет знак с - на + внутри границ - минимум находим корнем brentq
+        dt_lo, dt_hi = dt_bounds_signed
+        # Наклоны на обеих границах - одним пакетным JVP-вызовом
+        ends_pos, ends_d_pos = pendulum.batch_step_jvp(
+            np.array([gc_parent_pos, gc_parent_pos], dtype=np.float64), np.full(2, float(gc['control'])),
+            np.array([dt_lo, dt_hi], dtype=np.float64), np.zeros((2, 2)), np.ones(2))
+        slope_lo, slope_hi = np.einsum('ki,ki->k', ends_pos - target_parent_pos, ends_d_pos)
+        if slope_lo < 0.0 < slope_hi:
+            optimal_dt, root = brentq(distance_slope, dt_lo, dt_hi, xtol=1e-12, full_output=True)
+            result_info = {
+                'min_distance': distance_function(optimal_dt),
+                'method_used': 'brentq_gradient',
+                'function_evaluations': root.function_calls + 2,
+                'iterations': root.iterations
             }
-        )
-        
-        if result.success:
+        elif (slope_lo >= 0.0 and slope_hi >= 0.0) or (slope_lo <= 0.0 and slope_hi <= 0.0):
+            # Расстояние растет от нижней (падает к верхней) границы - граница сама локальный минимум (KKT)
+            optimal_dt = dt_lo if slope_lo >= 0.0 else dt_hi
+            result_info = {
+                'min_distance': float(np.linalg.norm(ends_pos[0 if slope_lo >= 0.0 else 1] - target_parent_pos)),
+                'method_used': 'bound_gradient',
+                'function_evaluations': 2,
+                'iterations': 0
+            }
+        else:
+            # Внутренний максимум (наклоны + и -) - поиск без производной
+            result = minimize_scalar(
+                distance_function,
+                bounds=dt_bounds_signed,
+                method='bounded',
+                options={
+                    'xatol': 1e-6,   # Менее строго
+                    'maxiter': 200   # Меньше итераций
+                }
+            )
+            if not result.success:
+                raise RuntimeError(result.message)
             optimal_dt = result.x
-            dt_valid = dt_bounds_signed[0] <= optimal_dt <= dt_bounds_signed[1]
+            result_info = {
+                'min_distance': result.fun,
+                'method_used': 'enhanced_bounded',
+                'function_evaluations': getattr(result, 'nfev', 0),
+                'iterations': getattr(result, 'nit', 0)
+            }
+        
+        dt_valid = dt_bounds_signed[0] <= optimal_dt <= dt_bounds_signed[1]
+        
+        if dt_valid:
+            final_pos = pendulum.step(gc_parent_pos, gc['control'], optimal_dt, method="jit")
             
-            if dt_valid:
-                final_pos = pendulum.step(gc_parent_pos, gc['control'], optimal_dt, method="jit")
-                
-                return {
-                    'success': True,
-                    'min_distance': result.fun,
-                    'optimal_dt': optimal_dt,
-                    'final_position': final_pos,
-                    'method_used': 'enhanced_bounded',
-                    'function_evaluations': getattr(result, 'nfev', 0),
-                    'iterations': getattr(result, 'nit', 0)
-                }
+            return {
+                'success': True,
+                'min_distance': result_info['min_distance'],
+                'optimal_dt': optimal_dt,
+                'final_position': final_pos,
+                'method_used': result_info['method_used'],
+                'function_evaluations': result_info['function_evaluations'],
+                'iterations': result_info['iterations']
+            }
     except:
         pass
     
@@ -241,12 +282,11 @@ def find_optimal_pairs(tree, show=False):
         )
         
         # Быстрая статистика для проверки
-        gc_gc_values = convergence_gc_gc.values
-        upper_triangle = np.triu(gc_gc_values, k=1)
-        valid_values = upper_triangle[upper_triangle != 0]
-        gc_gc_converging_count = (valid_values < -1e-6).sum()
+        # Верхний треугольник одной выборкой по индексам (без промежуточной triu-матрицы и маски)
+        upper_values = convergence_gc_gc[np.triu_indices_from(convergence_gc_gc, k=1)]
+        gc_gc_converging_count = (upper_values < -1e-6).sum()
         
-        gc_parent_values = convergence_gc_parent.values[~np.isnan(convergence_gc_parent.values)]
+        gc_parent_values = convergence_gc_parent[~np.isnan(convergence_gc_parent)]
         gc_parent_converging_count = (gc_parent_values < -1e-6).sum()
         
         if show:
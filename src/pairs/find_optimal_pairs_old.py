@@ -71,12 +71,12 @@ def find_optimal_pairs(tree, show=False):
         
         # Скорости сближения внук-внук
         convergence_gc_gc = compute_distance_derivative_table(
-            tree.grandchildren, pendulum, show=show and False  # Детальный дебаг только при необходимости
+            tree.grandchildren, pendulum, show=show and False, as_dataframe=True  # Детальный дебаг только при необходимости
         )
         
         # Скорости сближения внук-родитель
         convergence_gc_parent = compute_grandchild_parent_convergence_table(
-            tree.grandchildren, tree.children, pendulum, show=show and False
+            tree.grandchildren, tree.children, pendulum, show=show and False, as_dataframe=True
         )
         
         # Быстрая статистика для проверки
@@ -4,6 +4,7 @@ def optimize_grandchild_pair_distance(gc_i_idx, gc_j_idx, grandchildren, childre
     Оптимизирует dt для пары внуков с учетом их направлений времени.
     РАСШИРЕННАЯ ВЕРСИЯ с детальным дебагом оптимизации.
     """
+    import math
     import numpy as np
     from scipy.optimize import minimize
     
@@ -75,8 +76,9 @@ def optimize_grandchild_pair_distance(gc_i_idx, gc_j_idx, grandchildren, childre
             pos_i = pendulum.step(parent_i_pos, gc_i['control'], dt_i)
             pos_j = pendulum.step(parent_j_pos, gc_j['control'], dt_j)
             
-            # Расстояние между ними
-            distance = np.linalg.norm(pos_i - pos_j)
+            # Расстояние между ними (скаляр напрямую, без np.linalg.norm)
+            dx, dy = pos_i[0] - pos_j[0], pos_i[1] - pos_j[1]
+            distance = math.sqrt(dx * dx + dy * dy)
             
             return distance
             
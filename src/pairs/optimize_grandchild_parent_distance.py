@@ -4,7 +4,7 @@ def optimize_grandchild_parent_distance(gc_idx, parent_idx, grandchildren, child
     Оптимизирует dt для внука чтобы приблизиться к заданному родителю.
     УЛУЧШЕННАЯ ВЕРСИЯ с адаптивными границами dt.
     """
-    import numpy as np
+    import math
     from scipy.optimize import minimize_scalar
     
     gc = grandchildren[gc_idx]
@@ -51,8 +51,9 @@ def optimize_grandchild_parent_distance(gc_idx, parent_idx, grandchildren, child
             # Вычисляем финальную позицию внука
             gc_final_pos = pendulum.step(gc_parent_pos, gc['control'], dt)
             
-            # Расстояние до целевого родителя
-            distance = np.linalg.norm(gc_final_pos - target_parent_pos)
+            # Расстояние до целевого родителя (скаляр напрямую, без np.linalg.norm)
+            dx, dy = gc_final_pos[0] - target_parent_pos[0], gc_final_pos[1] - target_parent_pos[1]
+            distance = math.sqrt(dx * dx + dy * dy)
             
             return distance
             
@@ -4,6 +4,7 @@ from typing import Tuple
 from scipy.integrate import solve_ivp
 import numba
 from numba import njit, prange, float64
+from numba.types import UniTuple
 
 class PendulumSystem:
     """
@@ -27,9 +28,16 @@ class PendulumSystem:
         self._discretization_cache = {}  # key: (A_hash, B_hash, dt), value: (A_d, B_d)
 
         self._inv_ml2 = 1.0 / (m * l * l)   # часто используется в ядре
+        # Параметры JIT-ядер одним кортежем (g, l, c, inv_ml2): стабильный тип UniTuple(float64, 4)
+        self._params = (float(g), float(l), float(damping), self._inv_ml2)
+        self._params_arr = np.array(self._params)  # то же для gufunc (кортеж туда не передать)
         
     def get_control_bounds(self) -> np.ndarray:
         return np.array([-self.max_control, self.max_control])
+
+    def get_params(self) -> Tuple[float, float, float, float]:
+        """Параметры для JIT-ядер: (g, l, damping, 1/(m*l^2))."""
+        return self._params
         
     def get_linearized_matrices_at_state(self, state: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
@@ -126,6 +134,25 @@ class PendulumSystem:
         
         return np.array([d_theta, d_theta_dot])
     
+    def pendulum_dynamics_batch(self, states: np.ndarray, controls: np.ndarray) -> np.ndarray:
+        """
+        Векторизованная pendulum_dynamics для набора состояний.
+        
+        Args:
+            states (np.ndarray): Состояния (N, 2) [theta, theta_dot].
+            controls (np.ndarray): Управления (N,).
+        
+        Returns:
+            np.ndarray: Производные состояний (N, 2).
+        """
+        states = np.asarray(states, dtype=np.float64)
+        theta, theta_dot = states[:, 0], states[:, 1]
+        
+        out = np.empty_like(states)
+        out[:, 0] = theta_dot
+        out[:, 1] = -self.g / self.l * np.sin(theta) - self.damping * theta_dot + np.asarray(controls) / (self.m * self.l**2)
+        return out
+    
     def third_derivative(self, state: np.ndarray, control: float, control_dot: float = 0.0) -> float:
         """
         Вычисляет третью производную угла маятника (ω̈).
@@ -185,13 +212,17 @@ class PendulumSystem:
 
     
     def quad_step(self, state: np.ndarray, control: float, control_dot: float = 0.0, dt: float = 0.01) -> np.ndarray:
-        theta_dot, theta_ddot, theta_dddot = self.get_all_derivatives(state, control, control_dot)
-        linear_vector = np.array([theta_dot, theta_ddot])
-        quad_vector = np.array([theta_dot,theta_dddot])
-        
-        next_state = state + linear_vector * dt + quad_vector * dt**2 / 2
+        """Квадратичная экстраполяция состояния на dt (JIT-ядро _quad_step)."""
+        return self._quad_step(np.asarray(state, dtype=np.float64), control, control_dot, dt, self._params)
 
-        return next_state
+    def quad_trajectory(self, state: np.ndarray, control: float, control_dot: float, times: np.ndarray) -> np.ndarray:
+        """
+        Цепочка quad_step: poses[0] = state, poses[i] = quad_step(poses[i-1], ..., times[i]).
+        times    : (N+1,) - times[0] не используется
+        Возвращает (N+1, 2).
+        """
+        return self._quad_trajectory(np.asarray(state, dtype=np.float64), control, control_dot,
+                                     np.asarray(times, dtype=np.float64), self._params)
         
 
     def scipy_rk45_step(self, state: np.ndarray, control: float, dt: float) -> np.ndarray:
@@ -397,9 +428,10 @@ class PendulumSystem:
     # ──────────────────────────────────────────────────────────────────────
     @staticmethod
     @njit(float64[:](float64[:], float64, float64,          # state, u, dt
-                     float64, float64, float64, float64),   # g, l, c, inv_ml2
+                     UniTuple(float64, 4)),                 # params = (g, l, c, inv_ml2)
           cache=True, fastmath=True)
-    def _rk4_step(state, u, dt, g, l, c, inv_ml2):
+    def _rk4_step(state, u, dt, params):
+        g, l, c, inv_ml2 = params
         th, om = state
         k1t, k1o = om, -g / l * np.sin(th) - c * om + u * inv_ml2
         k2t, k2o = om + 0.5 * dt * k1o, -g / l * np.sin(th + 0.5 * dt * k1t) - c * (om + 0.5 * dt * k1o) + u * inv_ml2
@@ -414,7 +446,8 @@ class PendulumSystem:
     # ──────────────────────────────────────────────────────────────────────
     @staticmethod
     @njit(parallel=True, fastmath=True, cache=True)
-    def _batch_rk4(states, controls, dts, g, l, c, inv_ml2):
+    def _batch_rk4(states, controls, dts, params):
+        g, l, c, inv_ml2 = params
         out = np.empty_like(states)
         for i in prange(states.shape[0]):
             th, om = states[i]
@@ -432,13 +465,21 @@ class PendulumSystem:
     # ──────────────────────────────────────────────────────────────────────
     # 3. Публичный одиночный шаг
     # ──────────────────────────────────────────────────────────────────────
-    def step(self, state: np.ndarray, control: float, dt: float, method: str = "jit") -> np.ndarray:
+    def step(self, state: np.ndarray, control: float, dt: float, method: str = "jit",
+             return_sensitivity: bool = False):
         """
         Выполняет один интеграционный шаг.
         method = "jit"  (быстро)  или  "rk45" (fallback SciPy, медленно).
+        return_sensitivity=True (только jit): вернуть (pos, d_pos/d_dt) за один проход RK4.
         """
+        if return_sensitivity:
+            out, d_out = self.batch_step_jvp(np.asarray(state, dtype=np.float64)[None, :],
+                                             np.array([control], dtype=np.float64),
+                                             np.array([dt], dtype=np.float64),
+                                             np.zeros((1, 2)), np.ones(1))
+            return out[0], d_out[0]
         if method == "jit":
-            return self._rk4_step(state, control, dt, self.g, self.l, self.damping, self._inv_ml2)
+            return self._rk4_step(state, control, dt, self._params)
         elif method == "rk45":
             from scipy.integrate import RK45
 
@@ -464,6 +505,171 @@ class PendulumSystem:
         controls : (N,)
         dts      : (N,)
         """
-        return self._batch_rk4(states, controls, dts, self.g, self.l, self.damping, self._inv_ml2)
+        return self._batch_rk4(states, controls, dts, self._params)
+
+
+    # ──────────────────────────────────────────────────────────────────────
+    # 5. ВЕЕР из одной точки: N шагов от общего state (без prange)
+    # ──────────────────────────────────────────────────────────────────────
+    @staticmethod
+    @njit(cache=True, fastmath=True)
+    def _fan_rk4(state, controls, dts, params):
+        g, l, c, inv_ml2 = params
+        out = np.empty((controls.shape[0], 2))
+        th, om = state[0], state[1]
+        for i in range(controls.shape[0]):
+            u, dt = controls[i], dts[i]
+
+            k1t, k1o = om, -g / l * np.sin(th) - c * om + u * inv_ml2
+            k2t, k2o = om + 0.5 * dt * k1o, -g / l * np.sin(th + 0.5 * dt * k1t) - c * (om + 0.5 * dt * k1o) + u * inv_ml2
+            k3t, k3o = om + 0.5 * dt * k2o, -g / l * np.sin(th + 0.5 * dt * k2t) - c * (om + 0.5 * dt * k2o) + u * inv_ml2
+            k4t, k4o = om + dt * k3o,       -g / l * np.sin(th + dt * k3t)       - c * (om + dt * k3o)       + u * inv_ml2
+
+            out[i, 0] = th + (dt / 6.0) * (k1t + 2 * k2t + 2 * k3t + k4t)
+            out[i, 1] = om + (dt / 6.0) * (k1o + 2 * k2o + 2 * k3o + k4o)
+        return out
+
+    def fan_step(self, state: np.ndarray, controls: np.ndarray, dts: np.ndarray) -> np.ndarray:
+        """
+        Все N шагов стартуют из одной точки (например, 4 ребенка от корня).
+        state    : (2,)
+        controls : (N,)
+        dts      : (N,)
+        Возвращает (N, 2).
+        """
+        return self._fan_rk4(state, controls, dts, self._params)
+
+    # ──────────────────────────────────────────────────────────────────────
+    # 6. ПАРА шагов из одной точки с одним управлением: общий k1
+    # ──────────────────────────────────────────────────────────────────────
+    @staticmethod
+    @njit(cache=True, fastmath=True)
+    def _rk4_pair(state, u, dt_a, dt_b, params):
+        g, l, c, inv_ml2 = params
+        out = np.empty((2, 2))
+        th, om = state[0], state[1]
+        # k1 = f(state, u) не зависит от dt - считаем один раз на оба шага
+        k1t, k1o = om, -g / l * np.sin(th) - c * om + u * inv_ml2
+        for j in range(2):
+            dt = dt_a if j == 0 else dt_b
+            k2t, k2o = om + 0.5 * dt * k1o, -g / l * np.sin(th + 0.5 * dt * k1t) - c * (om + 0.5 * dt * k1o) + u * inv_ml2
+            k3t, k3o = om + 0.5 * dt * k2o, -g / l * np.sin(th + 0.5 * dt * k2t) - c * (om + 0.5 * dt * k2o) + u * inv_ml2
+            k4t, k4o = om + dt * k3o,       -g / l * np.sin(th + dt * k3t)       - c * (om + dt * k3o)       + u * inv_ml2
+
+            out[j, 0] = th + (dt / 6.0) * (k1t + 2 * k2t + 2 * k3t + k4t)
+            out[j, 1] = om + (dt / 6.0) * (k1o + 2 * k2o + 2 * k3o + k4o)
+        return out
+
+    def pair_step(self, state: np.ndarray, control: float, dt_a: float, dt_b: float) -> np.ndarray:
+        """
+        Два шага из одной точки с одним управлением (например, +dt и -dt внуков одного родителя).
+        Возвращает (2, 2): [шаг на dt_a, шаг на dt_b].
+        """
+        return self._rk4_pair(state, control, dt_a, dt_b, self._params)
+
+    # ──────────────────────────────────────────────────────────────────────
+    # 7. Квадратичная экстраполяция (quad_step) и цепочка таких шагов
+    # ──────────────────────────────────────────────────────────────────────
+    @staticmethod
+    @njit(cache=True, fastmath=True)
+    def _quad_step(state, u, u_dot, dt, params):
+        g, l, c, inv_ml2 = params
+        th, om = state[0], state[1]
+        # θ̇, θ̈ и θ⃛ (см. get_all_derivatives / third_derivative)
+        th_ddot = -g / l * np.sin(th) - c * om + u * inv_ml2
+        th_dddot = (-g / l * np.cos(th) * om + c * g / l * np.sin(th) + c * c * om
+                    - c * u * inv_ml2 + u_dot * inv_ml2)
+        out = np.empty(2)
+        out[0] = th + om * dt + om * dt * dt / 2
+        out[1] = om + th_ddot * dt + th_dddot * dt * dt / 2
+        return out
+
+    @staticmethod
+    @njit(cache=True, fastmath=True)
+    def _quad_trajectory(state, u, u_dot, times, params):
+        g, l, c, inv_ml2 = params
+        out = np.empty((times.shape[0], 2))
+        th, om = state[0], state[1]
+        out[0, 0], out[0, 1] = th, om
+        for i in range(1, times.shape[0]):
+            dt = times[i]
+            th_ddot = -g / l * np.sin(th) - c * om + u * inv_ml2
+            th_dddot = (-g / l * np.cos(th) * om + c * g / l * np.sin(th) + c * c * om
+                        - c * u * inv_ml2 + u_dot * inv_ml2)
+            th, om = th + om * dt + om * dt * dt / 2, om + th_ddot * dt + th_dddot * dt * dt / 2
+            out[i, 0], out[i, 1] = th, om
+        return out
 
     # ──────────────────────────────────────────────────────────────────────
+    # 8. gufunc-шаг: (state, u, dt) -> state на массивах любой формы
+    # ──────────────────────────────────────────────────────────────────────
+    @staticmethod
+    @numba.guvectorize([(float64[:], float64, float64, float64[:], float64[:])],
+                       '(n),(),(),(m)->(n)', nopython=True, cache=True, target='parallel')
+    def _gu_rk4(state, u, dt, params, out):
+        g, l, c, inv_ml2 = params[0], params[1], params[2], params[3]
+        th, om = state[0], state[1]
+        k1t, k1o = om, -g / l * np.sin(th) - c * om + u * inv_ml2
+        k2t, k2o = om + 0.5 * dt * k1o, -g / l * np.sin(th + 0.5 * dt * k1t) - c * (om + 0.5 * dt * k1o) + u * inv_ml2
+        k3t, k3o = om + 0.5 * dt * k2o, -g / l * np.sin(th + 0.5 * dt * k2t) - c * (om + 0.5 * dt * k2o) + u * inv_ml2
+        k4t, k4o = om + dt * k3o,       -g / l * np.sin(th + dt * k3t)       - c * (om + dt * k3o)       + u * inv_ml2
+        out[0] = th + (dt / 6.0) * (k1t + 2 * k2t + 2 * k3t + k4t)
+        out[1] = om + (dt / 6.0) * (k1o + 2 * k2o + 2 * k3o + k4o)
+
+    def step_batch(self, states: np.ndarray, controls: np.ndarray, dts: np.ndarray) -> np.ndarray:
+        """
+        step() на массивах: states (N,2), controls (N,), dts (N,) -> (N,2).
+        Работает с broadcasting (например, один state на N пар (u, dt)) и без GIL.
+        """
+        return self._gu_rk4(states, controls, dts, self._params_arr)
+
+    # ──────────────────────────────────────────────────────────────────────
+    # 9. RK4-шаг + касательная (JVP): значение и производная за один проход
+    # ──────────────────────────────────────────────────────────────────────
+    @staticmethod
+    @njit(cache=True, fastmath=True)
+    def _batch_rk4_jvp(states, controls, dts, d_states, d_dts, params):
+        # Производная RK4-отображения по (state, dt) вдоль направления (d_state, d_dt)
+        g, l, c, inv_ml2 = params
+        n = states.shape[0]
+        out = np.empty((n, 2))
+        d_out = np.empty((n, 2))
+        for i in range(n):
+            th, om = states[i, 0], states[i, 1]
+            dth, dom = d_states[i, 0], d_states[i, 1]
+            u, h, dh = controls[i], dts[i], d_dts[i]
+
+            k1t, k1o = om, -g / l * np.sin(th) - c * om + u * inv_ml2
+            dk1t, dk1o = dom, -g / l * np.cos(th) * dth - c * dom
+
+            x2t, x2o = th + 0.5 * h * k1t, om + 0.5 * h * k1o
+            dx2t, dx2o = dth + 0.5 * (dh * k1t + h * dk1t), dom + 0.5 * (dh * k1o + h * dk1o)
+            k2t, k2o = x2o, -g / l * np.sin(x2t) - c * x2o + u * inv_ml2
+            dk2t, dk2o = dx2o, -g / l * np.cos(x2t) * dx2t - c * dx2o
+
+            x3t, x3o = th + 0.5 * h * k2t, om + 0.5 * h * k2o
+            dx3t, dx3o = dth + 0.5 * (dh * k2t + h * dk2t), dom + 0.5 * (dh * k2o + h * dk2o)
+            k3t, k3o = x3o, -g / l * np.sin(x3t) - c * x3o + u * inv_ml2
+            dk3t, dk3o = dx3o, -g / l * np.cos(x3t) * dx3t - c * dx3o
+
+            x4t, x4o = th + h * k3t, om + h * k3o
+            dx4t, dx4o = dth + dh * k3t + h * dk3t, dom + dh * k3o + h * dk3o
+            k4t, k4o = x4o, -g / l * np.sin(x4t) - c * x4o + u * inv_ml2
+            dk4t, dk4o = dx4o, -g / l * np.cos(x4t) * dx4t - c * dx4o
+
+            st, so = k1t + 2 * k2t + 2 * k3t + k4t, k1o + 2 * k2o + 2 * k3o + k4o
+            dst, dso = dk1t + 2 * dk2t + 2 * dk3t + dk4t, dk1o + 2 * dk2o + 2 * dk3o + dk4o
+            out[i, 0] = th + (h / 6.0) * st
+            out[i, 1] = om + (h / 6.0) * so
+            d_out[i, 0] = dth + (dh / 6.0) * st + (h / 6.0) * dst
+            d_out[i, 1] = dom + (dh / 6.0) * so + (h / 6.0) * dso
+        return out, d_out
+
+    def batch_step_jvp(self, states: np.ndarray, controls: np.ndarray, dts: np.ndarray,
+                       d_states: np.ndarray, d_dts: np.ndarray):
+        """
+        batch_step + производная по направлению за тот же проход.
+        states (N,2), controls (N,), dts (N,), d_states (N,2), d_dts (N,) -> (out (N,2), d_out (N,2)).
+        d_states=0, d_dts=1 дает d_pos/d_dt; d_dts=0 - перенос возмущения начального состояния.
+        """
+        return self._batch_rk4_jvp(states, controls, dts, d_states, d_dts, self._params)
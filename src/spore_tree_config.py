@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import numpy as np
 from typing import Tuple, Optional
 
@@ -29,6 +29,9 @@ class SporeTreeConfig:
     grandchild_size: int = 40
     show_debug: bool = False  # отладочная информация по умолчанию
     
+    # Кэш дефолтного вектора dt: ((dt_base, dt_grandchildren_factor), вектор только для чтения)
+    _dt_vector_cache: Optional[tuple] = field(default=None, init=False, repr=False, compare=False)
+    
     def __post_init__(self):
         """Устанавливает дефолтное начальное положение если не задано."""
         if self.initial_position is None:
@@ -38,13 +41,21 @@ class SporeTreeConfig:
         """
         Возвращает дефолтный вектор времен для оптимизации.
         
+        Вектор кэшируется на экземпляре (пересчитывается только при смене dt_base / factor),
+        наружу отдается копия - вызывающий код может менять ее на месте.
+        
         Returns:
             np.array из 12 элементов: [4 dt для детей] + [8 dt для внуков]
         """
-        dt_children = np.ones(4) * self.dt_base
-        dt_grandchildren = np.ones(8) * self.dt_base * self.dt_grandchildren_factor
+        key = (self.dt_base, self.dt_grandchildren_factor)
+        if self._dt_vector_cache is None or self._dt_vector_cache[0] != key:
+            dt_vector = np.empty(12)
+            dt_vector[:4] = self.dt_base
+            dt_vector[4:] = self.dt_base * self.dt_grandchildren_factor
+            dt_vector.flags.writeable = False
+            self._dt_vector_cache = (key, dt_vector)
         
-        return np.hstack((dt_children, dt_grandchildren))
+        return self._dt_vector_cache[1].copy()
     
     def validate(self) -> bool:
         """
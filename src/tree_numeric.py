@@ -0,0 +1,150 @@
+"""
+Числовое JIT-ядро построения дерева спор глубиной 2.
+
+Форма дерева фиксирована (4 ребенка, 8 внуков), поэтому все построение -
+один скомпилированный вызов без словарей и промежуточных numpy-массивов.
+Порядок узлов совпадает с build_tree_arrays из original_code/cell_4.py.
+"""
+import numpy as np
+from numba import njit, prange
+
+from src.pendulum import PendulumSystem
+
+# Пара RK4-шагов из одной точки с общим k1 (то же ядро, что у pendulum.pair_step)
+_rk4_pair = PendulumSystem._rk4_pair
+
+# Знаки dt детей [forward_max, backward_max, forward_min, backward_min] и внуков (+dt, -dt на каждого родителя)
+_CHILD_DT_SIGNS = np.array([1.0, -1.0, 1.0, -1.0])
+_GC_DT_SIGNS = np.array([1.0, -1.0, 1.0, -1.0, 1.0, -1.0, 1.0, -1.0])
+
+
+@njit(cache=True)
+def build_tree_numeric(root_position, dt_children, dt_grandchildren, child_controls, params, k=2.0):
+    """
+    Дерево спор глубиной 2 фиксированной формы (4 ребенка, 8 внуков) одним JIT-вызовом.
+    
+    Те же шаги и порядок, что у Python-версии (RK4 детей, сортировка по углу,
+    внуки с обращенным управлением, sort_grandchildren_simple), но без
+    промежуточных numpy-вызовов и диспетчеризации из Python.
+    
+    Args:
+        root_position: (2,) позиция корня
+        dt_children: (4,) |dt| детей [forward_max, backward_max, forward_min, backward_min]
+        dt_grandchildren: (8,) |dt| внуков (по 2 на ребенка: +dt, -dt);
+                          пустой массив - автоматически |dt родителя| / k
+        child_controls: (4,) управления детей [u_max, u_max, u_min, u_min]
+                        (соседние дети с одним управлением считаются одной парой RK4)
+        params: pendulum.get_params() - (g, l, damping, 1/(m*l^2))
+        k: коэффициент уменьшения dt для автоматических dt внуков
+    
+    Returns:
+        (positions (13, 2), parent_idx (8,) int32, controls (12,), dts (12,)) - как в TreeArrays
+    """
+    positions = np.empty((13, 2))
+    controls = np.empty(12)
+    dts = np.empty(12)
+    positions[0] = root_position
+    root = positions[0]  # записываемая копия корня (входной массив может быть read-only)
+    
+    # Дети: RK4 из корня + углы; forward/backward с одним управлением - одна пара (общий k1)
+    raw_pos = np.empty((4, 2))
+    raw_dts = np.empty(4)
+    angles = np.empty(4)
+    for i in range(4):
+        raw_dts[i] = dt_children[i] * _CHILD_DT_SIGNS[i]
+    for p in range(2):
+        raw_pos[2 * p:2 * p + 2] = _rk4_pair(root, child_controls[2 * p], raw_dts[2 * p], raw_dts[2 * p + 1], params)
+    for i in range(4):
+        angles[i] = np.arctan2(raw_pos[i, 1] - root_position[1], raw_pos[i, 0] - root_position[0])
+    
+    # Устойчивая сортировка вставками по возрастанию угла (== argsort(kind='stable'))
+    child_order = np.arange(4)
+    for i in range(1, 4):
+        j = i
+        while j > 0 and angles[child_order[j - 1]] > angles[child_order[j]]:
+            child_order[j - 1], child_order[j] = child_order[j], child_order[j - 1]
+            j -= 1
+    for i in range(4):
+        c = child_order[i]
+        positions[1 + i] = raw_pos[c]
+        controls[i] = child_controls[c]
+        dts[i] = raw_dts[c]
+    
+    # Внуки: обращенное управление родителя, +dt / -dt (пара от одного родителя - общий k1)
+    gc_pos = np.empty((8, 2))
+    gc_controls = np.empty(8)
+    gc_dts = np.empty(8)
+    neg_angles = np.empty(8)
+    for i in range(8):
+        parent = i // 2
+        gc_controls[i] = -controls[parent]
+        if dt_grandchildren.shape[0] == 0:
+            gc_dts[i] = abs(dts[parent]) / k * _GC_DT_SIGNS[i]
+        else:
+            gc_dts[i] = dt_grandchildren[i] * _GC_DT_SIGNS[i]
+    for parent in range(4):
+        i = 2 * parent
+        gc_pos[i:i + 2] = _rk4_pair(positions[1 + parent], gc_controls[i], gc_dts[i], gc_dts[i + 1], params)
+    for i in range(8):
+        neg_angles[i] = -np.arctan2(gc_pos[i, 1] - root_position[1], gc_pos[i, 0] - root_position[0])
+    
+    # Устойчивая сортировка по убыванию угла (== argsort(-angles, kind='stable'))
+    order = np.arange(8)
+    for i in range(1, 8):
+        j = i
+        while j > 0 and neg_angles[order[j - 1]] > neg_angles[order[j]]:
+            order[j - 1], order[j] = order[j], order[j - 1]
+            j -= 1
+    
+    # Первый внук родителя 0 - в начало; если следующий тоже от родителя 0 - сдвиг на 1
+    roll_offset = 0
+    while order[roll_offset] // 2 != 0:
+        roll_offset += 1
+    if order[(roll_offset + 1) % 8] // 2 == 0:
+        roll_offset -= 1
+    
+    parent_idx = np.empty(8, dtype=np.int32)
+    for i in range(8):
+        g = order[(i + roll_offset) % 8]
+        positions[5 + i] = gc_pos[g]
+        controls[4 + i] = gc_controls[g]
+        dts[4 + i] = gc_dts[g]
+        parent_idx[i] = g // 2
+    
+    return positions, parent_idx, controls, dts
+
+
+@njit(cache=True, parallel=True, nogil=True)
+def batch_eval(root_position, dt_batch, child_controls, params):
+    """
+    Площади и расстояния пар для K деревьев из одной начальной позиции (prange по деревьям).
+    
+    Метрики те же, что у pair_metrics в cell_4: пары внуков (0,1), (2,3), (4,5), (6,7),
+    площадь - четырехугольник средних точек пар.
+    
+    Args:
+        root_position: (2,) позиция корня
+        dt_batch: (K, 12) |dt| [4 детей + 8 внуков] для каждого дерева
+        child_controls: (4,) управления детей [u_max, u_max, u_min, u_min]
+        params: pendulum.get_params()
+    
+    Returns:
+        (areas (K,), distances (K, 4))
+    """
+    n_trees = dt_batch.shape[0]
+    areas = np.empty(n_trees)
+    distances = np.empty((n_trees, 4))
+    for b in prange(n_trees):
+        positions, _, _, _ = build_tree_numeric(root_position, dt_batch[b, 0:4], dt_batch[b, 4:12],
+                                                child_controls, params, 2.0)
+        means = np.empty((4, 2))
+        for i in range(4):
+            dx = positions[6 + 2 * i, 0] - positions[5 + 2 * i, 0]
+            dy = positions[6 + 2 * i, 1] - positions[5 + 2 * i, 1]
+            distances[b, i] = np.sqrt(dx * dx + dy * dy)
+            means[i, 0] = positions[5 + 2 * i, 0] + 0.5 * dx
+            means[i, 1] = positions[5 + 2 * i, 1] + 0.5 * dy
+        # Площадь = 0.5 * |(m0 - m2) × (m1 - m3)|
+        areas[b] = 0.5 * abs((means[0, 0] - means[2, 0]) * (means[1, 1] - means[3, 1])
+                             - (means[1, 0] - means[3, 0]) * (means[0, 1] - means[2, 1]))
+    return areas, distances
@@ -7,9 +7,10 @@ import os
 # Это нужно, чтобы можно было импортировать модули из src
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.spore_tree import SporeTree
+from src.spore_tree import SporeTree, _pseudo_angle
 from src.spore_tree_config import SporeTreeConfig
 from src.pendulum import PendulumSystem
+from src.tree_numeric import build_tree_numeric, batch_eval
 
 @pytest.fixture
 def configured_tree() -> SporeTree:
@@ -97,3 +98,196 @@ def test_no_siblings_in_candidates(configured_tree: SporeTree):
                  f"не должен спариваться с кандидатом {candidate_id} (родитель {candidate_parent_id}), "
                  f"так как у них один родитель.")
 
+
+def test_pairing_csr_matches_candidate_map(configured_tree: SporeTree):
+    """
+    Проверяет, что CSR-массивы и плоские индексы пар совпадают с картой кандидатов.
+    """
+    tree = configured_tree
+    rowptr, colidx = tree.pairing_csr_rowptr, tree.pairing_csr_colidx
+    
+    for gc_id, candidates in tree.pairing_candidate_map.items():
+        assert colidx[rowptr[gc_id]:rowptr[gc_id + 1]].tolist() == candidates
+    
+    idx_i, idx_j = tree.pairing_candidate_idx
+    expected = sorted((i, j) for i, cands in tree.pairing_candidate_map.items() for j in cands if j > i)
+    assert sorted(zip(idx_i.tolist(), idx_j.tolist())) == expected
+
+
+def test_pseudo_angle_matches_arctan2_order():
+    """
+    Проверяет, что ключ сортировки внуков упорядочивает точки так же, как arctan2.
+    """
+    rng = np.random.default_rng(0)
+    points = np.vstack([rng.normal(size=(64, 2)), [[1.0, 0.0], [-1.0, 0.0], [-1.0, -0.0], [0.0, 1.0], [0.0, -1.0]]])
+    
+    by_atan2 = sorted(range(len(points)), key=lambda i: np.arctan2(points[i, 1], points[i, 0]))
+    by_pseudo = sorted(range(len(points)), key=lambda i: _pseudo_angle(*points[i].tolist()))
+    
+    assert by_atan2 == by_pseudo, "Порядок по псевдоуглу должен совпадать с порядком по arctan2"
+
+
+def test_build_tree_numeric_structure():
+    """
+    Проверяет JIT-дерево: дети получены RK4-шагом из корня, пары внуков - от разных родителей.
+    """
+    pendulum = PendulumSystem()
+    root = np.array([np.pi / 2, 0.0])
+    u_min, u_max = pendulum.get_control_bounds()
+    child_controls = np.array([u_max, u_max, u_min, u_min])
+    
+    positions, parent_idx, controls, dts = build_tree_numeric(
+        root, np.full(4, 0.1), np.full(8, 0.01), child_controls, pendulum.get_params())
+    
+    assert positions.shape == (13, 2) and controls.shape == (12,) and dts.shape == (12,)
+    for i in range(4):
+        expected = pendulum.step(root, controls[i], dts[i])
+        assert np.allclose(positions[1 + i], expected), f"Ребенок {i} не совпадает с pendulum.step"
+    for pair_idx in range(4):
+        assert parent_idx[2 * pair_idx] != parent_idx[2 * pair_idx + 1], \
+            f"Пара {pair_idx} содержит внуков от одного родителя"
+    assert np.allclose(controls[4:], -controls[parent_idx]), "Внуки должны иметь обращенное управление родителя"
+
+
+def test_batch_eval_matches_single_trees():
+    """
+    Проверяет, что пакетная оценка дает те же расстояния пар и площадь, что и отдельные деревья.
+    """
+    pendulum = PendulumSystem()
+    root = np.array([np.pi / 2, 0.0])
+    u_min, u_max = pendulum.get_control_bounds()
+    child_controls = np.array([u_max, u_max, u_min, u_min])
+    dt_batch = np.random.default_rng(0).uniform(0.001, 0.1, size=(5, 12))
+    
+    areas, distances = batch_eval(root, dt_batch, child_controls, pendulum.get_params())
+    
+    for b in range(dt_batch.shape[0]):
+        positions, _, _, _ = build_tree_numeric(root, dt_batch[b, :4], dt_batch[b, 4:],
+                                                child_controls, pendulum.get_params())
+        gc = positions[5:]
+        means = 0.5 * (gc[0::2] + gc[1::2])
+        area = 0.5 * abs((means[0, 0] - means[2, 0]) * (means[1, 1] - means[3, 1])
+                         - (means[1, 0] - means[3, 0]) * (means[0, 1] - means[2, 1]))
+        assert np.allclose(distances[b], np.linalg.norm(gc[0::2] - gc[1::2], axis=1))
+        assert np.isclose(areas[b], area)
+
+
+def test_gc_soa_buffers_follow_update_positions(configured_tree: SporeTree):
+    """
+    Проверяет, что SoA-буферы внуков совпадают со словарями и обновляются на месте.
+    """
+    tree = configured_tree
+    tree.sort_and_pair_grandchildren()
+    buffer = tree.gc_positions
+    
+    tree.update_positions(np.full(4, 0.05), np.full(8, 0.02))
+    
+    assert tree.gc_positions is buffer, "Буфер позиций внуков должен переиспользоваться"
+    for j, gc in enumerate(tree.grandchildren):
+        assert np.allclose(tree.gc_positions[j], gc['position'])
+        assert tree.gc_parent_idx[j] == gc['parent_idx']
+        assert tree.gc_controls[j] == gc['control']
+        assert tree.gc_sign_dt[j] == np.sign(gc['dt'])
+        assert tree.gc_dts[j] == gc['dt']
+    for i, child in enumerate(tree.children):
+        assert np.allclose(tree.child_positions[i], child['position'])
+        assert tree.child_controls[i] == child['control']
+        assert tree.child_dts[i] == child['dt']
+
+
+def test_step_batch_matches_step():
+    """
+    Проверяет, что gufunc step_batch совпадает с поэлементным pendulum.step.
+    """
+    pendulum = PendulumSystem()
+    rng = np.random.default_rng(1)
+    states = rng.normal(size=(6, 2))
+    controls = rng.uniform(-2.0, 2.0, size=6)
+    dts = rng.uniform(-0.1, 0.1, size=6)
+    
+    expected = np.array([pendulum.step(states[i], controls[i], dts[i]) for i in range(6)])
+    
+    assert np.allclose(pendulum.step_batch(states, controls, dts), expected)
+
+
+def test_pair_step_matches_two_steps():
+    """
+    Проверяет, что pair_step (общий k1) совпадает с двумя отдельными pendulum.step из той же точки.
+    """
+    pendulum = PendulumSystem()
+    state = np.array([np.pi / 3, 0.2])
+    
+    for dt_a, dt_b in [(0.05, -0.05), (0.01, 0.03), (-0.02, -0.07)]:
+        expected = np.array([pendulum.step(state, 1.5, dt_a), pendulum.step(state, 1.5, dt_b)])
+        assert np.allclose(pendulum.pair_step(state, 1.5, dt_a, dt_b), expected)
+
+
+def test_materialize_matches_rebuilt_tree(configured_tree: SporeTree):
+    """
+    Проверяет, что дерево из позиций evaluator совпадает с деревом, построенным заново, а прототип не меняется.
+    """
+    from src.area_opt.tree_area_evaluator import TreeAreaEvaluator
+    
+    tree = configured_tree
+    tree.sort_and_pair_grandchildren()
+    evaluator = TreeAreaEvaluator(tree)
+    prototype_positions = tree.gc_positions.copy()
+    dt_vector = np.random.default_rng(2).uniform(0.001, 0.1, size=12)
+    
+    materialized = evaluator.materialize(tree, dt_vector)
+    rebuilt = SporeTree(tree.pendulum, tree.config, dt_children=dt_vector[:4], dt_grandchildren=dt_vector[4:])
+    
+    for got, expected in zip(materialized.children + materialized.grandchildren, rebuilt.children + rebuilt.grandchildren):
+        assert np.allclose(got['position'], expected['position'])
+        assert np.isclose(got['dt'], expected['dt'])
+    assert np.allclose(materialized.gc_positions, rebuilt.gc_positions)
+    assert np.allclose(materialized.gc_dts, rebuilt.gc_dts)
+    assert np.allclose(materialized.child_positions, rebuilt.child_positions)
+    assert np.allclose(tree.gc_positions, prototype_positions), "Прототип не должен изменяться"
+
+
+def test_materialize_dt_matches_positions_for_negative_entries(configured_tree: SporeTree):
+    """
+    Проверяет, что при отрицательных элементах dt_vector времена дерева согласованы с его позициями.
+    """
+    from src.area_opt.tree_area_evaluator import TreeAreaEvaluator
+    
+    tree = configured_tree
+    tree.sort_and_pair_grandchildren()
+    evaluator = TreeAreaEvaluator(tree)
+    dt_vector = np.random.default_rng(3).uniform(0.001, 0.1, size=12)
+    dt_vector[[1, 6]] *= -1.0
+    
+    materialized = evaluator.materialize(tree, dt_vector)
+    
+    for child in materialized.children:
+        expected = tree.pendulum.step(tree.root['position'], child['control'], child['dt'])
+        assert np.allclose(child['position'], expected)
+    for gc in materialized.grandchildren:
+        parent = materialized.children[gc['parent_idx']]
+        expected = tree.pendulum.step(parent['position'], gc['control'], gc['dt'])
+        assert np.allclose(gc['position'], expected)
+    assert np.allclose(materialized.gc_dts, [gc['dt'] for gc in materialized.grandchildren])
+
+
+def test_dt_vector_cache_accepts_list_config_values(monkeypatch):
+    """
+    Проверяет, что конфиг со списком dt_bounds (как из YAML) дает результат и второй вызов берется из кэша.
+    """
+    import src.find_optimal_dt_vector as fodv
+    
+    fodv.clear_dt_vector_cache()
+    pendulum = PendulumSystem()
+    config = SporeTreeConfig(dt_base=0.1, dt_grandchildren_factor=0.1, dt_bounds=[0.001, 0.2])
+    position = np.array([np.pi / 2, 0.0])
+    
+    first = fodv.find_optimal_dt_vector(position, pendulum=pendulum, config=config)
+    assert first is not None and first.shape == (12,)
+    
+    def fail(*args, **kwargs):
+        raise AssertionError("Повторный вызов должен брать результат из кэша")
+    monkeypatch.setattr(fodv, "find_optimal_pairs", fail)
+    
+    second = fodv.find_optimal_dt_vector(position, pendulum=pendulum, config=config)
+    assert second is not None and np.array_equal(first, second)
+    fodv.clear_dt_vector_cache()